@@ -6,8 +6,8 @@ import threading
 
 from bitflyer import bitflyer
 from config import config
-from app.models import events, candle, dfcandle, trade
-from utils import mathlib
+from app.models import events, candle, dfcandle, paramcache, resample, search, trade
+from utils import incremental
 from utils.logsettings import getLogger
 
 logger = getLogger(__name__)
@@ -57,21 +57,100 @@ class AI(object):
         self.stop_limit_percent = stop_limit_percent
 
         # Optimized parameters
+        # They are replaced as a whole by the background optimization (see update_optimize_params)
         self.optimize_params = None
-
-
-        self.update_optimize_params()
+        self.optimized_at = None            # When the parameters were published
+        self.optimized_candle_time = None   # The last candle time used for the optimization
+        self.optimize_seconds = None        # How long the last optimization took
+        self.params_lock = threading.Lock()
+        self.optimize_thread = None
+        # Incremental indicators and trade models for the optimized parameters
+        self.indicators = None
+        self.indicator_params = None
+        self.trade_models = None
+        self.recent_candles = None
+
+
+        # The first optimization runs in the background (trade() skips until the parameters are published)
+        self.request_optimize_params()
     
     def update_optimize_params(self):
         '''
         Update optimized trade parameters
+
+        The new parameters are published at once when the optimization finishes,
+        and the trade keeps using the previous ones until then.
         '''
-        df = candle.get_all_candles(self.product_code, self.duration, self.past_period)
-        self.optimize_params = df.optimize_params() if df else None
+        started = time.monotonic()
+        df = resample.get_all_candles(self.product_code, self.duration, self.past_period)
+        strategy = search.get_strategy(
+            config.Config.optimize_strategy, config.Config.optimize_max_evals, config.Config.optimize_max_seconds)
+        params = paramcache.optimize_params(df, config.Config.optimize_workers, strategy) if df else None
+        with self.params_lock:
+            self.optimize_params = params
+            self.optimized_at = datetime.datetime.now()
+            self.optimized_candle_time = df.candles[-1].time if df else None
+            self.optimize_seconds = time.monotonic() - started
         logger.debug({
             'action': 'AI:update_optimize_params',
-            'params': self.optimize_params
+            'params': params,
+            'seconds': self.optimize_seconds
         })
+
+    def request_optimize_params(self):
+        '''
+        Starts update_optimize_params in a background thread
+
+        Returns False if an optimization is already running.
+        '''
+        with self.params_lock:
+            if self.optimize_thread is not None and self.optimize_thread.is_alive():
+                return False
+            self.optimize_thread = threading.Thread(target=self._run_optimize_params)
+            self.optimize_thread.setDaemon(True)
+            self.optimize_thread.start()
+        return True
+
+    def _run_optimize_params(self):
+        try:
+            self.update_optimize_params()
+        except Exception as e:
+            logger.error({
+                'action': 'AI:request_optimize_params',
+                'error': e
+            })
+
+    def params_staleness(self):
+        '''
+        How old the current parameters are
+
+        seconds: time since they were published
+        candles: the number of candles traded after the candles used for the optimization
+        '''
+        with self.params_lock:
+            optimized_at = self.optimized_at
+            optimized_candle_time = self.optimized_candle_time
+        if optimized_at is None:
+            return None
+        candles = 0
+        if optimized_candle_time is not None and self.last_time > optimized_candle_time:
+            candles = int((self.last_time - optimized_candle_time) / resample.duration_delta(self.duration))
+        return {
+            'seconds': (datetime.datetime.now() - optimized_at).total_seconds(),
+            'candles': candles,
+            'optimizing': self.optimize_thread is not None and self.optimize_thread.is_alive()
+        }
+
+    def stats(self):
+        '''
+        Statistics of the optimized parameters (see /api/stats)
+        '''
+        with self.params_lock:
+            optimize_seconds = self.optimize_seconds
+        return {
+            'staleness': self.params_staleness(),
+            'optimize_seconds': optimize_seconds
+        }
     
     def buy(self, candle:candle.Candle):
         '''
@@ -217,70 +296,70 @@ class AI(object):
         if params is None:
             logger.info('optimized params not found!')
 
-            self.update_optimize_params()
+            self.request_optimize_params()
             # セマフォ解放
             self.trade_semaphore.release()
             return
         logger.debug({
             'action': 'AI:trade',
-            'params': params.__dict__
+            'params': params.__dict__,
+            'staleness': self.params_staleness()
         })
-        df = candle.get_all_candles(self.product_code, self.duration, self.past_period)
-
-        # Calculate indicator values
-        if params.ema_enable:
-            ema_value1 = mathlib.ema(params.ema_period1, df.closes())
-            ema_value2 = mathlib.ema(params.ema_period2, df.closes())
-            ema_trade_model = trade.TradeEma(ema_value1, ema_value2, params.ema_period1, params.ema_period2)
-        
-        if params.bb_enable:
-            bb_up, bb_mid, bb_down = mathlib.bbands(params.bb_n, params.bb_k, df.closes())
-            bb_trade_model = trade.TradeBb(bb_up, bb_mid, bb_down, params.bb_n, params.bb_k)
-        
-        if params.ichimoku_enable:
-            ichimoku_tenkan, ichimoku_base, ichimoku_pre1, ichimoku_pre2, ichimoku_delay = mathlib.ichimoku(df.highs(), df.lows(), df.closes())
-            ichimoku_trade_model = trade.TradeIchimoku(ichimoku_tenkan, ichimoku_base, ichimoku_pre1, ichimoku_pre2, ichimoku_delay)
-        
-        if params.macd_enable:
-            macd, macd_signal, macd_histogram = mathlib.macd(
-                params.macd_short_period, params.macd_long_period, params.macd_signal_period, df.closes())
-            macd_trade_model = trade.TradeMacd(macd, macd_signal, macd_histogram, params.macd_short_period, params.macd_long_period, params.macd_signal_period)
-        
-        if params.rsi_enable:
-            rsi_value = mathlib.rsi(params.rsi_period, df.closes())
-            rsi_trade_model = trade.TradeRsi(rsi_value, params.rsi_period, params.rsi_buy_thread, params.rsi_sell_thread)
+        if self.indicators is None or self.indicator_params != params:
+            # Warm up the indicators from the history
+            self.init_indicators(params)
+            df = resample.get_all_candles(self.product_code, self.duration, self.past_period)
+        else:
+            # The last candle is fed again because it may have been updated after the last trade
+            df = resample.get_candles_after_time(self.product_code, self.duration, self.last_time)
+        if not df:
+            # セマフォ解放
+            self.trade_semaphore.release()
+            return
 
+        indicators = self.indicators
+        recent_candles = self.recent_candles
+        ema_trade_model = self.trade_models.get('ema')
+        bb_trade_model = self.trade_models.get('bbands')
+        macd_trade_model = self.trade_models.get('macd')
+        rsi_trade_model = self.trade_models.get('rsi')
 
         '''
         各candleに対して売買の計算をする
         '''
-        for i in range(len(df.candles)):
-            if self.last_time >= df.candles[i].time:
+        for c in df.candles:
+            for indicator in indicators:
+                indicator.update(c)
+            if self.last_time >= c.time:
                 continue
 
+            # Index of the candle in the indicator series
+            i = recent_candles.count - 1
+            candles = recent_candles.values
+
             buy_params, sell_params = {}, {}
-            if params.ema_enable:
+            if ema_trade_model:
                 ema_params = {'period1': ema_trade_model.period1, 'period2': ema_trade_model.period2}
                 if ema_trade_model.should_buy(i):
                     buy_params['ema'] = ema_params
                 if ema_trade_model.should_sell(i):
                     sell_params['ema'] = ema_params
             
-            if params.bb_enable:
+            if bb_trade_model:
                 bb_params = {'n': bb_trade_model.n, 'k': bb_trade_model.k}
-                if bb_trade_model.should_buy(i, df.candles):
+                if bb_trade_model.should_buy(i, candles):
                     buy_params['bbands'] = bb_params
-                if bb_trade_model.should_sell(i, df.candles):
+                if bb_trade_model.should_sell(i, candles):
                     sell_params['bbands'] = bb_params
             
-            if params.macd_enable:
+            if macd_trade_model:
                 macd_params = {'short_period1': macd_trade_model.short_period, 'long_period': macd_trade_model.long_period, 'signal_period': macd_trade_model.signal_period}
                 if macd_trade_model.should_buy(i):
                     buy_params['macd'] = macd_params
                 if macd_trade_model.should_sell(i):
                     sell_params['macd'] = macd_params
             
-            if params.rsi_enable:
+            if rsi_trade_model:
                 rsi_params = {'period': rsi_trade_model.preiod}
                 if rsi_trade_model.should_buy(i):
                     buy_params['rsi'] = rsi_params
@@ -292,14 +371,14 @@ class AI(object):
 
             # buy_pointが0より大きいなら買い
             if buy_point > 0:
-                _, is_order_completed = self.buy(df.candles[i])
+                _, is_order_completed = self.buy(c)
                 if is_order_completed:
-                    self.stop_limit = df.candles[i].close * self.stop_limit_percent
+                    self.stop_limit = c.close * self.stop_limit_percent
 
                     trade_logger.info({
                         'status': 'order completed',
                         'side': 'BUY',
-                        'time': df.candles[i].time.isoformat(),
+                        'time': c.time.isoformat(),
                         'params': buy_params,
                         'stop_limit': self.stop_limit
                     })
@@ -308,24 +387,24 @@ class AI(object):
 
             
             # sell_pointが0より大きい、または終値がstop limitを下回りそうなら売り
-            loss_cut = df.candles[i].close < self.stop_limit
+            loss_cut = c.close < self.stop_limit
             if sell_point > 0 or loss_cut:
-                _, is_order_completed = self.sell(df.candles[i])
+                _, is_order_completed = self.sell(c)
                 if is_order_completed:
                     self.stop_limit = 0.0
 
                     trade_logger.info({
                         'status': 'order completed',
                         'side': 'SELL',
-                        'time': df.candles[i].time.isoformat(),
+                        'time': c.time.isoformat(),
                         'params': sell_params,
                         'loss_cut': loss_cut
                     })
 
                     self.signal_events.signals[-1].notes = "Used indicators : " + str(sell_params)
 
-                    # パラメータの更新
-                    self.update_optimize_params()
+                    # パラメータの更新 (バックグラウンド)
+                    self.request_optimize_params()
 
         self.last_time = df.candles[-1].time
 
@@ -334,6 +413,42 @@ class AI(object):
 
 
 
+    def init_indicators(self, params):
+        '''
+        Create incremental indicators and trade models of the enabled parameters
+        '''
+        self.indicator_params = params
+        self.recent_candles = incremental.Candles()
+        self.indicators = [self.recent_candles]
+        self.trade_models = {}
+
+        if params.ema_enable:
+            ema1 = incremental.Ema(params.ema_period1)
+            ema2 = incremental.Ema(params.ema_period2)
+            self.indicators += [ema1, ema2]
+            self.trade_models['ema'] = trade.TradeEma(ema1.values, ema2.values, params.ema_period1, params.ema_period2)
+
+        if params.bb_enable:
+            bbands = incremental.Bbands(params.bb_n, params.bb_k)
+            self.indicators.append(bbands)
+            self.trade_models['bbands'] = trade.TradeBb(bbands.up, bbands.mid, bbands.down, params.bb_n, params.bb_k)
+
+        if params.ichimoku_enable:
+            ichimoku = incremental.Ichimoku()
+            self.indicators.append(ichimoku)
+            self.trade_models['ichimoku'] = trade.TradeIchimoku(ichimoku.tenkan, ichimoku.base, ichimoku.pre1, ichimoku.pre2, ichimoku.delay)
+
+        if params.macd_enable:
+            macd = incremental.Macd(params.macd_short_period, params.macd_long_period, params.macd_signal_period)
+            self.indicators.append(macd)
+            self.trade_models['macd'] = trade.TradeMacd(
+                macd.macd, macd.signal, macd.histogram, params.macd_short_period, params.macd_long_period, params.macd_signal_period)
+
+        if params.rsi_enable:
+            rsi = incremental.Rsi(params.rsi_period)
+            self.indicators.append(rsi)
+            self.trade_models['rsi'] = trade.TradeRsi(rsi.values, params.rsi_period, params.rsi_buy_thread, params.rsi_sell_thread)
+
     def get_available_balance(self):
         '''
         利用可能な資産
@@ -1,9 +1,10 @@
+import atexit
 import threading
 import queue
 
 from bitflyer import bitflyer
 from config import config
-from app.models import candle
+from app.models import base, candle, ingestion, resample, retention
 from app.controllers import ai
 from utils.logsettings import getLogger
 
@@ -12,8 +13,8 @@ logger = getLogger(__name__)
 
 
 def stream_ingestion_data():
-    # リアルタイムに取得したTickerのバッファ
-    ticker_q = queue.Queue()
+    # リアルタイムに取得したTickerのバッファ (上限を超えた場合はingestion_policyに従う)
+    ticker_q = ingestion.TickerQueue()
     # APIClient
     api_client = bitflyer.APIClient(config.Config.api_key, config.Config.api_secret)
 
@@ -22,22 +23,39 @@ def stream_ingestion_data():
     t.setDaemon(True)
     t.start()
 
+    # 開いているcandleはメモリ上で更新し、作成時・確定時・一定間隔でデータベースに書き込む
+    aggregator = candle.CandleAggregator(config.Config.candle_flush_interval)
+    atexit.register(aggregator.flush, True)
+
+    # データベースの肥大化を防ぐため、古いcandleはバックグラウンドで定期的に削除する
+    retention.start()
+
+    # trade_durationがテーブルにない場合は、元のdurationのcandleからリサンプリングする
+    trade_source = resample.source_duration(config.Config.trade_duration)
+    trade_delta = resample.duration_delta(config.Config.trade_duration)
+    trade_time = None
+
     while True:
         try:
-            ticker = ticker_q.get() # Tickerを取得
-            # 各duration毎にcandleを作成or更新
-            for duration in config.Config.durations.keys():
-                is_created = candle.create_or_update_candle(ticker, config.Config.product_code, duration)
-                # candleが作成されたらtradeを実行
-                if is_created and duration == config.Config.trade_duration:
+            try:
+                ticker = ticker_q.get(timeout=aggregator.flush_interval or None) # Tickerを取得
+            except queue.Empty:
+                aggregator.flush()
+                continue
+            # 最小のdurationのcandleを更新し、確定したcandleを上位のdurationに集約する
+            created = aggregator.update(ticker, config.Config.product_code)
+            # trade_durationのcandleが作成されたらtradeを実行
+            if trade_source in created:
+                open_time = base.truncate_epoch_ms(aggregator.open_time(config.Config.product_code, trade_source), trade_delta)
+                if open_time != trade_time:
+                    trade_time = open_time
                     logger.debug({
                         'action': 'stream_ingestion_data',
-                        'status': 'start ai trade'
+                        'status': 'start ai trade',
+                        'ingestion': ticker_q.stats()
                     })
                     ai.TRADE_AI.trade()
-                
-                # データベースの肥大化を防ぐため、10000個以上前のcandleはデータベースから削除する
-                candle.delete_old_candles(config.Config.product_code, duration, 10000)
+            aggregator.flush()
 
         except KeyboardInterrupt as err:
             logger.error({
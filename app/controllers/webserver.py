@@ -8,7 +8,7 @@ from flask import Flask, request, jsonify, render_template
 
 
 from config import config
-from app.models import candle
+from app.models import resample
 from app.controllers import ai
 from utils.logsettings import getLogger
 
@@ -45,9 +45,22 @@ def str2int(strs, defaults):
 
 ### Page ###
 
+def view_durations():
+    '''
+    Returns (durations of the buttons, index of trade_duration)
+    '''
+    durations = list(config.Config.durations)
+    if config.Config.trade_duration not in durations:
+        # trade_duration resampled from a stored duration
+        durations.append(config.Config.trade_duration)
+        durations.sort(key=resample.duration_delta)
+    return durations, durations.index(config.Config.trade_duration)
+
+
 @app.route('/', methods=['GET'])
 def view_candle():
-    return render_template('index.html')
+    durations, active = view_durations()
+    return render_template('index.html', durations=durations, active=active)
 
 
 ### API ####
@@ -68,7 +81,10 @@ def api_get_candle():
     if limit < 0 or limit > MAX_LIMIT:
         limit = MAX_LIMIT
     
-    df = candle.get_all_candles(product_code, duration, limit)
+    try:
+        df = resample.get_all_candles(product_code, duration, limit)
+    except ValueError as e:
+        return jsonify({'message': str(e), 'code': 400}), 400
     if not df:
         return jsonify({'message': 'DataFrameCandle is not found.', 'code': 500}), 500
     
@@ -155,6 +171,14 @@ def api_get_candle():
     return jsonify(df.getall())
 
 
+@app.route('/api/stats', methods=['GET'])
+def api_get_stats():
+    '''
+    Returns the statistics of the trade
+    '''
+    return jsonify({'ai': ai.TRADE_AI.stats()})
+
+
 
 
 
@@ -0,0 +1,224 @@
+'''
+Archive of the long history of candles
+
+    python -m app.models.archive [db_name] [--dir archive_dir]
+
+The candles of a (product_code, duration) are appended to a directory
+<archive_dir>/<product_code>_<duration> which has a file per column:
+
+    time.bin    int64 epoch microseconds (datetime64[us])
+    open.bin, close.bin, high.bin, low.bin, volume.bin    float64
+    index.bin   time of every INDEX_STRIDE-th candle (sparse index)
+
+Every value is little-endian and 8 bytes, so the i-th candle is at i * 8 of each file,
+and the files are memory-mapped as numpy arrays without reading them.
+Candles are only appended (in time order), and a torn append is cut off to the
+shortest column on the next append.
+
+The closed candles of the DB are exported by export() (see also app.models.retention),
+and DataFrameCandle.from_archive() opens a range of them without copying.
+'''
+import argparse
+import os
+
+import numpy as np
+
+from config import config
+from utils.logsettings import getLogger
+from . import base, writer
+
+
+logger = getLogger(__name__)
+
+
+COLUMNS = ('time', 'open', 'close', 'high', 'low', 'volume')
+DTYPES = {name: np.dtype('<f8') for name in COLUMNS}
+DTYPES['time'] = np.dtype('<M8[us]')
+ITEM_SIZE = 8
+
+# A candle of every INDEX_STRIDE candles is in the sparse index
+INDEX_STRIDE = 1024
+
+
+class Archive(object):
+    def __init__(self, product_code, duration, directory=None):
+        self.product_code = product_code
+        self.duration = duration
+        if directory is None:
+            directory = config.Config.db_archive_dir
+        self.path = os.path.join(directory, base.get_candle_table_name(product_code, duration))
+
+    def file(self, name):
+        return os.path.join(self.path, name + '.bin')
+
+    def length(self):
+        '''
+        The number of the candles (the shortest column)
+        '''
+        sizes = []
+        for name in COLUMNS:
+            try:
+                sizes.append(os.path.getsize(self.file(name)) // ITEM_SIZE)
+            except FileNotFoundError:
+                return 0
+        return min(sizes)
+
+    def map(self, name, length, dtype=None):
+        if length == 0:
+            return np.empty(0, dtype=dtype or DTYPES[name])
+        return np.memmap(self.file(name), dtype=dtype or DTYPES[name], mode='r', shape=(length,))
+
+    def open(self):
+        '''
+        Returns {column: read-only memory-mapped array} of every candle
+        '''
+        length = self.length()
+        return {name: self.map(name, length) for name in COLUMNS}
+
+    def index(self, length):
+        '''
+        Returns the sparse index of the candles
+        '''
+        count = -(-length // INDEX_STRIDE)
+        try:
+            size = os.path.getsize(self.file('index')) // ITEM_SIZE
+        except FileNotFoundError:
+            size = 0
+        if size < count:
+            self.build_index(length)
+        return self.map('index', count, DTYPES['time'])
+
+    def build_index(self, length):
+        times = self.map('time', length)
+        with open(self.file('index'), 'wb') as f:
+            f.write(np.ascontiguousarray(times[::INDEX_STRIDE]).tobytes())
+
+    def last_time(self):
+        '''
+        Returns the time (datetime64[us]) of the last candle, or None if the archive is empty
+        '''
+        length = self.length()
+        if length == 0:
+            return None
+        return self.map('time', length)[-1]
+
+    def append(self, columns):
+        '''
+        Appends the candles ({column: array} in time order) newer than the last candle
+
+        Returns the number of the appended candles.
+        '''
+        times = np.asarray(columns['time'], dtype=DTYPES['time'])
+        last_time = self.last_time()
+        if last_time is not None:
+            start = int(np.searchsorted(times, last_time, side='right'))
+        else:
+            start = 0
+        if start == len(times):
+            return 0
+        if np.any(times[start + 1:] <= times[start:-1]):
+            raise ValueError('Times of the candles must be increasing')
+
+        os.makedirs(self.path, exist_ok=True)
+        length = self.length()
+        for name in COLUMNS:
+            values = np.ascontiguousarray(np.asarray(columns[name])[start:], dtype=DTYPES[name])
+            with open(self.file(name), 'ab') as f:
+                # Cut off a torn append
+                f.truncate(length * ITEM_SIZE)
+                f.write(values.tobytes())
+
+        # Times of the new strides (the index is rebuilt when it is short)
+        new_length = length + len(times) - start
+        if os.path.exists(self.file('index')) and os.path.getsize(self.file('index')) // ITEM_SIZE == -(-length // INDEX_STRIDE):
+            first = -(-length // INDEX_STRIDE) * INDEX_STRIDE
+            if first < new_length:
+                with open(self.file('index'), 'ab') as f:
+                    f.write(np.ascontiguousarray(self.map('time', new_length)[first::INDEX_STRIDE]).tobytes())
+        else:
+            self.build_index(new_length)
+        return new_length - length
+
+    def search(self, times, index, t, side):
+        '''
+        Returns the position of t in the times, reading a stride of them
+        '''
+        block = max(int(np.searchsorted(index, t, side='right')) - 1, 0)
+        lo = block * INDEX_STRIDE
+        hi = min(lo + INDEX_STRIDE, len(times))
+        return lo + int(np.searchsorted(times[lo:hi], t, side=side))
+
+    def columns(self, start=None, end=None):
+        '''
+        Returns {column: read-only array} of the candles whose time is in [start, end) without copying them
+        '''
+        length = self.length()
+        columns = {name: self.map(name, length) for name in COLUMNS}
+        if length == 0:
+            return columns
+        times = columns['time']
+        index = self.index(length)
+        i = 0 if start is None else self.search(times, index, np.datetime64(start, 'us'), 'left')
+        j = length if end is None else self.search(times, index, np.datetime64(end, 'us'), 'left')
+        return {name: values[i:j] for name, values in columns.items()}
+
+
+def export(product_code, duration, until=None, directory=None, chunk_size=100000):
+    '''
+    Appends the candles of the DB newer than the archive and older than until (datetime)
+
+    until defaults to the latest candle, which may be still open.
+    Returns the number of the exported candles.
+    '''
+    archive = Archive(product_code, duration, directory)
+    last_time = archive.last_time()
+    after = -1 if last_time is None else int(last_time.astype('datetime64[ms]').astype(np.int64))
+    table_name = base.get_candle_table_name(product_code, duration)
+
+    exported = 0
+    writer.flush()
+    with base.connect() as conn:
+        if until is None:
+            before = conn.execute('select max(time) from {}'.format(table_name)).fetchone()[0]
+            if before is None:
+                return 0
+        else:
+            before = base.to_epoch_ms(until)
+        while True:
+            rows = conn.execute(
+                '''
+                select time, open, close, high, low, volume from {}
+                where time > ? and time < ? order by time asc limit ?;
+                '''.format(table_name),
+                (after, before, chunk_size)
+            ).fetchall()
+            if not rows:
+                break
+            data = np.array(rows, dtype=np.float64)
+            columns = {name: data[:, i] for i, name in enumerate(COLUMNS)}
+            columns['time'] = data[:, 0].astype(np.int64).astype('datetime64[ms]').astype(DTYPES['time'])
+            exported += archive.append(columns)
+            after = rows[-1][0]
+    logger.debug({
+        'action': 'archive:export',
+        'table': table_name,
+        'exported': exported
+    })
+    return exported
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the candles of the DB to the archive')
+    parser.add_argument('db_name', nargs='?', default=config.Config.db_name)
+    parser.add_argument('--dir', default=config.Config.db_archive_dir or 'archive')
+    args = parser.parse_args()
+
+    config.Config.db_name = args.db_name
+    for duration in config.Config.durations:
+        exported = export(config.Config.product_code, duration, directory=args.dir)
+        archive = Archive(config.Config.product_code, duration, args.dir)
+        print('{}: {} candles exported, {} candles archived'.format(archive.path, exported, archive.length()))
+
+
+if __name__ == '__main__':
+    main()
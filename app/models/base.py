@@ -1,5 +1,11 @@
+import contextlib
+import datetime
 import logging
+import os
+import queue
 import sqlite3
+import threading
+import time
 
 
 from config import config
@@ -10,53 +16,228 @@ logger = getLogger(__name__)
 
 
 TABLE_NAME_SIGNAL_EVENTS = 'signal_events'
+TABLE_NAME_OPTIMIZE_RESULTS = 'optimize_results'
+
+# Version of the schema (pragma user_version)
+#   0: time columns are timestamp
+#   1: time columns are integer epoch milliseconds (UTC) of WITHOUT ROWID tables
+#   2: optimize_results has text columns and created_at of integer epoch milliseconds
+SCHEMA_VERSION = 2
+
+EPOCH = datetime.datetime(1970, 1, 1)
+_MILLISECOND = datetime.timedelta(milliseconds=1)
+_WEEK_MS = datetime.timedelta(weeks=1) // _MILLISECOND
+# 1970-01-01 is Thursday
+_WEEK_OFFSET_MS = datetime.timedelta(days=4) // _MILLISECOND
+
+
+def to_epoch_ms(dt:datetime.datetime):
+    '''
+    Returns the epoch milliseconds of the datetime (a naive datetime is UTC)
+    '''
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return (dt - EPOCH) // _MILLISECOND
+
+
+def from_epoch_ms(ms):
+    '''
+    Returns the naive UTC datetime of the epoch milliseconds
+    '''
+    return EPOCH + datetime.timedelta(milliseconds=ms)
+
+
+def truncate_epoch_ms(ms, duration:datetime.timedelta):
+    '''
+    Returns the start (epoch milliseconds) of the candle of the duration which contains ms
+
+    Weekly candles start on Monday 00:00 UTC.
+    '''
+    step = duration // _MILLISECOND
+    offset = _WEEK_OFFSET_MS if step % _WEEK_MS == 0 else 0
+    return (ms - offset) // step * step + offset
 
 
 def get_candle_table_name(product_code, duration):
     return '{}_{}'.format(product_code, duration)
 
 
-def init():
+# Candles imported into the DB by another process (see app.models.importer) are noticed by
+# the caches of this process within IMPORT_CHECK_INTERVAL seconds by the mtime of a marker file
+IMPORT_CHECK_INTERVAL = 1.0
+_import_check = (None, None, None)     # (db_name, monotonic time checked, mtime of the marker)
+
+
+def import_marker():
+    return config.Config.db_name + '.imported'
+
+
+def mark_imported():
+    '''
+    Tells the other processes that candles are imported into the DB
+    '''
+    path = import_marker()
+    with open(path, 'a'):
+        pass
+    os.utime(path)
+
+
+def cache_generation():
+    '''
+    Returns (db_name, mtime of the import marker); the cached candles of another generation are stale
+    '''
+    global _import_check
+    db_name, checked, mtime = _import_check
+    now = time.monotonic()
+    if db_name != config.Config.db_name or now - checked >= IMPORT_CHECK_INTERVAL:
+        db_name = config.Config.db_name
+        try:
+            mtime = os.stat(import_marker()).st_mtime_ns
+        except OSError:
+            mtime = None
+        _import_check = (db_name, now, mtime)
+    return db_name, mtime
+
+
+class ConnectionPool(object):
+    '''
+    Pool of long-lived connections to the DB
+
+    A connection is lent to one thread at a time, and returned to the pool after use.
+    Connections use WAL so that the readers do not block the writer (and vice versa).
+    The pool is emptied when config.Config.db_name changes.
+    '''
+    def __init__(self, size):
+        self.size = size
+        self.pool = queue.LifoQueue()
+        self.db_name = None
+        self.lock = threading.Lock()
+
+    def open(self, db_name):
+        # time columns are integers (see to_epoch_ms), so no type detection is needed
+        conn = sqlite3.connect(
+            db_name, check_same_thread=False, cached_statements=config.Config.db_cached_statements)
+        conn.execute('pragma journal_mode=WAL')
+        conn.execute('pragma synchronous=NORMAL')
+        conn.execute('pragma mmap_size={:d}'.format(config.Config.db_mmap_size))
+        return conn
+
+    def acquire(self):
+        db_name = config.Config.db_name
+        with self.lock:
+            if db_name != self.db_name:
+                self.clear()
+                self.db_name = db_name
+        try:
+            return self.pool.get_nowait()
+        except queue.Empty:
+            return self.open(db_name)
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        with self.lock:
+            if self.pool.qsize() < self.size and self.db_name == config.Config.db_name:
+                self.pool.put(conn)
+                return
+        conn.close()
+
+    def clear(self):
+        while True:
+            try:
+                self.pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+_pool = ConnectionPool(config.Config.db_pool_size)
+
+
+@contextlib.contextmanager
+def connect():
+    '''
+    Lends a pooled connection
+
+    with base.connect() as conn:
+        ...
+    '''
+    conn = _pool.acquire()
     try:
-        # Need sqlite3.PARSE_DECLTYPES to deal with datetime
-        conn = sqlite3.connect(config.Config.db_name, detect_types=sqlite3.PARSE_DECLTYPES)
-    except FileNotFoundError as ex:
-        logger.error(ex)
+        yield conn
+    finally:
+        _pool.release(conn)
 
-    curs = conn.cursor()
 
-    # time column is UTC
+def create_signal_events_table(curs, table_name=TABLE_NAME_SIGNAL_EVENTS):
+    # time column is UTC epoch milliseconds
     curs.execute(
         '''
         create table if not exists {}(
-            time timestamp primary key not null,
-            product_code string,
-            side string,
-            price float,
-            size float,
-            notes string
-        )
-        '''.format(TABLE_NAME_SIGNAL_EVENTS)
+            time integer primary key not null,
+            product_code text,
+            side text,
+            price real,
+            size real,
+            notes text
+        ) without rowid
+        '''.format(table_name)
     )
 
-    for duration in config.Config.durations.keys():
-        # e.g. table_name = BTC_JPY_1m
-        table_name = get_candle_table_name(config.Config.product_code, duration)
-        # time column is UTC timestamp
+
+def create_candle_table(curs, table_name):
+    # time column is UTC epoch milliseconds
+    curs.execute(
+        '''
+        create table if not exists {}(
+            time integer primary key not null,
+            open real,
+            close real,
+            high real,
+            low real,
+            volume real
+        ) without rowid
+        '''.format(table_name)
+    )
+
+
+def init():
+    from . import migrate
+
+    with connect() as conn:
+        # Free pages of a new DB are returned by the retention (see app.models.retention)
+        if conn.execute("select count(*) from sqlite_master").fetchone()[0] == 0:
+            # (the header is written by journal_mode=WAL already, so the empty DB is vacuumed to apply it)
+            conn.execute('pragma auto_vacuum = incremental')
+            conn.execute('vacuum')
+
+        # Tables of an older schema are migrated first
+        migrate.migrate(conn)
+
+        curs = conn.cursor()
+        create_signal_events_table(curs)
+
+        # Cache of optimized parameters (see app.models.paramcache)
         curs.execute(
             '''
             create table if not exists {}(
-                time timestamp primary key not null,
-                open float,
-                close float,
-                high float,
-                low float,
-                volume float
+                product_code text not null,
+                duration text not null,
+                first_time text not null,
+                last_time text not null,
+                content_hash text not null,
+                search_space text not null,
+                params text,
+                created_at integer,
+                primary key (product_code, duration, first_time, last_time, content_hash, search_space)
             )
-            '''.format(table_name)
+            '''.format(TABLE_NAME_OPTIMIZE_RESULTS)
         )
 
-    conn.commit()
+        for duration in config.Config.durations.keys():
+            # e.g. table_name = BTC_JPY_1m
+            create_candle_table(curs, get_candle_table_name(config.Config.product_code, duration))
+
+        curs.execute('pragma user_version = {:d}'.format(SCHEMA_VERSION))
+        conn.commit()
 
-    curs.close()
-    conn.close()
\ No newline at end of file
+        curs.close()
@@ -1,9 +1,11 @@
 import logging
 import datetime
-import sqlite3
+import time
 
+import numpy as np
 
-from . import base, dfcandle
+
+from . import base, dfcandle, hotcache, resample, writer
 from config import config
 from bitflyer import bitflyer
 from utils.logsettings import getLogger
@@ -35,50 +37,47 @@ class Candle(object):
         return base.get_candle_table_name(self.product_code, self.duration)
 
     def get(self):
-        conn = sqlite3.connect(config.Config.db_name, detect_types=sqlite3.PARSE_DECLTYPES)
-        curs = conn.cursor()
-
-        curs.execute(
-            '''
-            select * from {} where time = ?;
-            '''.format(self.table),
-            (self.time.replace(tzinfo=None),)
-        )
-        rows = curs.fetchall()
-        curs.close()
-        conn.close()
-        return rows
+        time = base.to_epoch_ms(self.time)
+        row = writer.pending_rows(self.table).get(time)
+        if row is not None:
+            return [(self.time,) + row[1:]]
+        with base.connect() as conn:
+            curs = conn.cursor()
+            curs.execute(
+                '''
+                select * from {} where time = ?;
+                '''.format(self.table),
+                (time,)
+            )
+            rows = curs.fetchall()
+            curs.close()
+        return [(base.from_epoch_ms(row[0]),) + tuple(row[1:]) for row in rows]
 
     def create(self):
-        conn = sqlite3.connect(config.Config.db_name, detect_types=sqlite3.PARSE_DECLTYPES)
-        curs = conn.cursor()
-
-        
-        curs.execute(
+        time = base.to_epoch_ms(self.time)
+        row = (time, self.open, self.close, self.high, self.low, self.volume)
+        writer.submit(
             '''
             insert or replace into {} (time, open, close, high, low, volume) values (?, ?, ?, ?, ?, ?);
             '''.format(self.table),
-            (self.time.replace(tzinfo=None), self.open, self.close, self.high, self.low, self.volume)
+            row,
+            (self.table, time, row)
         )
-        conn.commit()
-        curs.close()
-        conn.close()
+        hotcache.CACHE.put(self.product_code, self.duration, row)
+        resample.invalidate(self.product_code, self.duration)
 
     def save(self):
-        conn = sqlite3.connect(config.Config.db_name, detect_types=sqlite3.PARSE_DECLTYPES)
-        curs = conn.cursor()
-
-
-        curs.execute(
+        time = base.to_epoch_ms(self.time)
+        row = (time, self.open, self.close, self.high, self.low, self.volume)
+        writer.submit(
             '''
             update {} set open = ?, close = ?, high = ?, low = ?, volume = ? where time = ?;
             '''.format(self.table),
-            (self.open, self.close, self.high, self.low, self.volume, self.time.replace(tzinfo=None))
+            row[1:] + (time,),
+            (self.table, time, row)
         )
-
-        conn.commit()
-        curs.close()
-        conn.close()
+        hotcache.CACHE.put(self.product_code, self.duration, row)
+        resample.invalidate(self.product_code, self.duration)
     
 
 def get_candle(product_code, duration, date_time:datetime.datetime):
@@ -88,120 +87,349 @@ def get_candle(product_code, duration, date_time:datetime.datetime):
     if not type(date_time) == datetime.datetime:
         raise TypeError('Type of "date_time" must be <class \'datetime.datetime\'>')
     table_name = base.get_candle_table_name(product_code, duration)
-    conn = sqlite3.connect(config.Config.db_name, detect_types=sqlite3.PARSE_DECLTYPES)
-    conn.row_factory = sqlite3.Row
-    curs = conn.cursor()
-
-    curs.execute(
-        '''
-        select time, open, close, high, low, volume from {} where time = ?;
-        '''.format(table_name),
-        (date_time.replace(tzinfo=None),)
-    )
-    row = curs.fetchone()
+    time = base.to_epoch_ms(date_time)
+    # A candle whose write is pending is newer than the DB
+    row = writer.pending_rows(table_name).get(time)
+    if row is None:
+        with base.connect() as conn:
+            curs = conn.cursor()
+            curs.execute(
+                '''
+                select time, open, close, high, low, volume from {} where time = ?;
+                '''.format(table_name),
+                (time,)
+            )
+            row = curs.fetchone()
+            curs.close()
     if not row:
         return
 
-    curs.close()
-    conn.close()
-
     return Candle(
         product_code = product_code,
         duration = duration,
-        time = row['time'],
-        open_v = row['open'],
-        close = row['close'],
-        high = row['high'],
-        low = row['low'],
-        volume = row['volume']
+        time = base.from_epoch_ms(row[0]),
+        open_v = row[1],
+        close = row[2],
+        high = row[3],
+        low = row[4],
+        volume = row[5]
     )
 
+def candle_time(ticker:bitflyer.Ticker, duration):
+    '''
+    Returns the time of the candle of the duration which contains the ticker
+    '''
+    ms = ticker.epoch_ms()
+    return base.from_epoch_ms(base.truncate_epoch_ms(ms, config.Config.durations[duration]))
+
+
 def create_or_update_candle(ticker:bitflyer.Ticker, product_code, duration):
     '''
     Return whether a candle is created. If a candle is updated, return False.
     '''
-    current_candle = get_candle(product_code, duration, ticker.truncate_datetime(duration))
-    price = ticker.get_mid_price()
+    time = candle_time(ticker, duration)
+    current_candle = get_candle(product_code, duration, time)
+    open_v, close, high, low, volume = ticker.ohlcv()
     if current_candle is None:
         candle = Candle(
             product_code = product_code,
             duration = duration,
-            time = ticker.truncate_datetime(duration),
-            open_v = price,
-            close = price,
-            high = price,
-            low = price,
-            volume = ticker.volume
+            time = time,
+            open_v = open_v,
+            close = close,
+            high = high,
+            low = low,
+            volume = volume
         )
         candle.create()
         return True
     
-    if current_candle.high < price:
-        current_candle.high = price
-    elif current_candle.low > price:
-        current_candle.low = price
+    if current_candle.high < high:
+        current_candle.high = high
+    if current_candle.low > low:
+        current_candle.low = low
     
-    current_candle.volume += ticker.volume
-    current_candle.close = price
+    current_candle.volume += volume
+    current_candle.close = close
     current_candle.save()
     return False
 
 
-def get_all_candles(product_code, duration, limit):
+def merge(a, b):
     '''
-    Returns the latest candles
+    Returns the values [open, close, high, low, volume] of the candle a followed by the candle b
     '''
-    df = dfcandle.DataFrameCandle(product_code, duration, [])
-    table_name = base.get_candle_table_name(product_code, duration)
-    conn = sqlite3.connect(config.Config.db_name, detect_types=sqlite3.PARSE_DECLTYPES)
-    curs = conn.cursor()
+    if a is None:
+        return b and list(b)
+    if b is None:
+        return list(a)
+    return [a[0], b[1], max(a[2], b[2]), min(a[3], b[3]), a[4] + b[4]]
+
+
+class OpenCandle(object):
+    '''
+    Open candle of a duration in CandleAggregator
+
+    values of the finest duration are the values of the candle.
+    values of a coarser duration are the merged values of its closed finer candles
+    (None if there is not any); the candle is merge(values, open candle of the finer duration).
+    '''
+    __slots__ = ('duration', 'delta', 'time', 'values')
+
+    def __init__(self, duration, delta:datetime.timedelta):
+        self.duration = duration
+        self.delta = delta
+        self.time = None        # epoch milliseconds
+        self.values = None
+
+
+class CandleAggregator(object):
+    '''
+    Builds the candles of every duration from tickers in memory
 
-    curs.execute(
+    Tickers only update the open candle of the finest duration.
+    When a candle is closed, it is merged into the open candle of the next coarser duration
+    (each duration is a multiple of the finer ones, see config.parse_durations),
+    so a coarser duration costs O(1) per closed candle instead of per ticker.
+    Candles are written to the DB when they are created, when they are closed,
+    and by flush() when flush_interval seconds have passed since the last write.
+    After a restart the open candles are recovered from the DB (as of their last write).
+    '''
+    def __init__(self, flush_interval=1.0, durations=None):
+        if durations is None:
+            durations = config.Config.durations
+        # finest first
+        self.durations = sorted(durations.items(), key=lambda item: item[1])
+        self.flush_interval = flush_interval
+        self.candles = {}       # {product_code: [OpenCandle of each duration]}
+        self.dirty = set()      # product codes whose candles are updated after the last write
+        self.last_flush = time.monotonic()
+
+    def update(self, ticker:bitflyer.Ticker, product_code):
         '''
-        select * from (
-            select time, open, close, high, low, volume from {} order by time desc limit ?
-        ) order by time asc;
-        '''.format(table_name),
-        (limit,)
-    )
-    rows = curs.fetchall()
-    if not rows:
-        return
-    
-    curs.close()
-    conn.close()
-
-    for i in range(len(rows)):
-        df.candles.append(
-            Candle(
-                product_code = product_code,
-                duration = duration,
-                time = rows[i][0],
-                open_v = rows[i][1],
-                close = rows[i][2],
-                high = rows[i][3],
-                low = rows[i][4],
-                volume = rows[i][5]
-            )
+        Returns the durations whose candle is created by the ticker
+
+        ticker may be tickers of a candle coalesced into a delta (see ingestion.TickerDelta).
+        '''
+        ms = ticker.epoch_ms()
+        ohlcv = ticker.ohlcv()
+
+        candles = self.candles.get(product_code)
+        if candles is None:
+            candles = self.candles[product_code] = self.recover(product_code, ms)
+
+        finest = candles[0]
+        candle_time = base.truncate_epoch_ms(ms, finest.delta)
+        if finest.values is not None:
+            if candle_time == finest.time:
+                values = finest.values
+                if values[2] < ohlcv[2]:
+                    values[2] = ohlcv[2]
+                if values[3] > ohlcv[3]:
+                    values[3] = ohlcv[3]
+                values[4] += ohlcv[4]
+                values[1] = ohlcv[1]
+                self.dirty.add(product_code)
+                return []
+            if candle_time < finest.time:
+                # A late ticker of a closed candle
+                self.update_late(ticker, product_code, ms)
+                return []
+
+        created = []
+        closed = None   # values of the closed candle of the finer duration
+        for candle in candles:
+            candle_time = base.truncate_epoch_ms(ms, candle.delta)
+            if candle is not finest and candle_time == candle.time:
+                # The candle stays open
+                candle.values = merge(candle.values, closed)
+                self.dirty.add(product_code)
+                break
+
+            closed = candle.values if candle is finest else merge(candle.values, closed)
+            if candle.time is not None and closed is not None:
+                self.write(product_code, candle.time, candle.duration, closed)
+
+            candle.time = candle_time
+            candle.values = list(ohlcv) if candle is finest else None
+            self.write(product_code, candle.time, candle.duration, ohlcv)
+            created.append(candle.duration)
+        return created
+
+    def update_late(self, ticker:bitflyer.Ticker, product_code, ms):
+        '''
+        Adds a ticker older than the open candle of the finest duration
+
+        The closed candles are merged with an upsert, without reading them from the DB.
+        '''
+        ohlcv = ticker.ohlcv()
+        for candle in self.candles[product_code][1:]:
+            if base.truncate_epoch_ms(ms, candle.delta) == candle.time:
+                # Merged into the closed finer candles (the coarser candles contain them)
+                if candle.values is None:
+                    candle.values = list(ohlcv)
+                else:
+                    candle.values[2] = max(candle.values[2], ohlcv[2])
+                    candle.values[3] = min(candle.values[3], ohlcv[3])
+                    candle.values[4] += ohlcv[4]
+                self.dirty.add(product_code)
+                break
+        # The candles of the ticker closed already
+        for candle in self.candles[product_code]:
+            candle_time = base.truncate_epoch_ms(ms, candle.delta)
+            if candle_time == candle.time:
+                break
+            self.write_late(product_code, candle_time, candle.duration, ohlcv)
+
+    def recover(self, product_code, ms):
+        '''
+        Returns the open candles of the time, which are written before a restart
+        '''
+        candles = []
+        finer = None    # values written of the finer duration
+        for duration, delta in self.durations:
+            candle = OpenCandle(duration, delta)
+            candle.time = base.truncate_epoch_ms(ms, delta)
+            row = get_candle(product_code, duration, base.from_epoch_ms(candle.time))
+            values = [row.open, row.close, row.high, row.low, row.volume] if row else None
+            if not candles:
+                candle.values = values
+            elif values is None:
+                candle.time = None
+            else:
+                # The written candle contains the open finer candle (high and low can be merged again)
+                candle.values = values[:4] + [values[4] - (finer[4] if finer else 0)]
+            finer = values
+            candles.append(candle)
+        return candles
+
+    def open_time(self, product_code, duration):
+        '''
+        Returns the time (epoch milliseconds) of the open candle of the duration, or None
+        '''
+        for candle in self.candles.get(product_code, []):
+            if candle.duration == duration:
+                return candle.time
+
+    def write(self, product_code, candle_time, duration, values):
+        Candle(product_code, duration, base.from_epoch_ms(candle_time), *values).create()
+
+    def write_late(self, product_code, candle_time, duration, values):
+        '''
+        Merges the values of a late ticker into the closed candle (a new candle if there is not)
+
+        The close of the candle stays (the ticker is older than it).
+        '''
+        table = base.get_candle_table_name(product_code, duration)
+        row = (candle_time, *values)
+        merged = hotcache.CACHE.merge(product_code, duration, row)
+        if merged is None:
+            current = writer.pending_rows(table).get(candle_time)
+            if current is not None:
+                merged = current[:3] + (max(current[3], values[2]), min(current[4], values[3]), current[5] + values[4])
+        writer.submit(
+            '''
+            insert into {} (time, open, close, high, low, volume) values (?, ?, ?, ?, ?, ?)
+            on conflict(time) do update set
+                high = max(high, excluded.high),
+                low = min(low, excluded.low),
+                volume = volume + excluded.volume;
+            '''.format(table),
+            row,
+            None if merged is None else (table, candle_time, merged)
         )
-    return df
+        resample.invalidate(product_code, duration)
 
+    def close(self, product_code):
+        '''
+        Writes the open candles of the product code
+        '''
+        if product_code not in self.dirty:
+            return
+        values = None
+        for candle in self.candles[product_code]:
+            values = merge(candle.values, values)
+            if candle.time is not None and values is not None:
+                self.write(product_code, candle.time, candle.duration, values)
+        self.dirty.discard(product_code)
 
-def delete_old_candles(product_code, duration, limit):
+    def flush(self, force=False):
+        '''
+        Writes the updated open candles if flush_interval seconds have passed (or force)
+
+        Returns whether the candles are written.
+        '''
+        now = time.monotonic()
+        if not force and now - self.last_flush < self.flush_interval:
+            return False
+        for product_code in list(self.dirty):
+            self.close(product_code)
+        self.last_flush = now
+        return True
+
+
+def get_all_candles(product_code, duration, limit):
     '''
-    Delete candles whose created time is before the time
+    Returns the latest candles
+
+    The candles are read from the cache (see app.models.hotcache), and from the DB if it is short of them.
     '''
-    table_name = base.get_candle_table_name(product_code, duration)
-    limit_time = datetime.datetime.now() - config.Config.durations[duration] * limit
-    conn = sqlite3.connect(config.Config.db_name, detect_types=sqlite3.PARSE_DECLTYPES)
-    curs = conn.cursor()
+    rows, complete = hotcache.CACHE.latest(product_code, duration, limit)
+    if not complete:
+        table_name = base.get_candle_table_name(product_code, duration)
+        # Taken before reading the DB, so that a write committed meanwhile is read from either
+        pending = writer.pending_rows(table_name)
+        with base.connect() as conn:
+            curs = conn.cursor()
+            if len(rows):
+                curs.execute(
+                    '''
+                    select time, open, close, high, low, volume from {} where time < ? order by time desc limit ?;
+                    '''.format(table_name),
+                    (int(rows[0, 0]), limit - len(rows))
+                )
+            else:
+                curs.execute(
+                    '''
+                    select time, open, close, high, low, volume from {} order by time desc limit ?;
+                    '''.format(table_name),
+                    (limit,)
+                )
+            older = curs.fetchall()
+            curs.close()
+        if len(rows):
+            pending = {t: row for t, row in pending.items() if t < rows[0, 0]}
+        older = writer.merge_rows(older, pending, reverse=True, limit=limit - len(rows))
+        older = np.array(older[::-1], dtype=np.float64).reshape(-1, len(dfcandle.COLUMNS))
+        hotcache.CACHE.prepend(product_code, duration, older, len(older) < limit - len(rows))
+        rows = np.concatenate([older, rows])
+    if not len(rows):
+        return
 
-    curs.execute(
-        '''
-        delete from {} where time < ?
-        '''.format(table_name),
-        (limit_time,)
-    )
-    conn.commit()
-    curs.close()
-    conn.close()
\ No newline at end of file
+    return dfcandle.DataFrameCandle.from_epoch_rows(product_code, duration, rows)
+
+
+def get_candles_after_time(product_code, duration, time:datetime.datetime):
+    '''
+    Returns the candles whose time is equal to or after the time
+    '''
+    rows = hotcache.CACHE.after(product_code, duration, base.to_epoch_ms(time))
+    if rows is None:
+        table_name = base.get_candle_table_name(product_code, duration)
+        ms = base.to_epoch_ms(time)
+        pending = {t: row for t, row in writer.pending_rows(table_name).items() if t >= ms}
+        with base.connect() as conn:
+            curs = conn.cursor()
+            curs.execute(
+                '''
+                select time, open, close, high, low, volume from {} where time >= ? order by time asc;
+                '''.format(table_name),
+                (ms,)
+            )
+            rows = curs.fetchall()
+            curs.close()
+        rows = writer.merge_rows(rows, pending)
+    if not len(rows):
+        return
+
+    return dfcandle.DataFrameCandle.from_epoch_rows(product_code, duration, rows)
@@ -2,15 +2,44 @@ import logging
 from dataclasses import dataclass
 from typing import List
 
+import numpy as np
+
 from config import config
-from utils import mathlib
+from utils import mathlib, npmathlib
 from utils.logsettings import getLogger
-from . import candle, events, trade
+from . import archive, base, candle, events, trade
 
 
 logger = getLogger(__name__)
 
 
+# Search spaces of the optimizers
+EMA_PERIODS1 = range(5, 12)
+EMA_PERIODS2 = range(12, 20)
+BB_NS = range(10, 20)
+BB_KS = tuple(i/10 for i in range(17, 23))
+MACD_SHORT_PERIODS = range(10, 20)
+MACD_LONG_PERIODS = range(20, 30)
+MACD_SIGNAL_PERIODS = range(5, 15)
+RSI_PERIODS = range(10, 20)
+RSI_BUY_THREADS = range(27, 33)
+RSI_SELL_THREADS = range(67, 73)
+
+SEARCH_SPACES = {
+    'ema': {'period1': EMA_PERIODS1, 'period2': EMA_PERIODS2},
+    'bb': {'n': BB_NS, 'k': BB_KS},
+    'macd': {'short_period': MACD_SHORT_PERIODS, 'long_period': MACD_LONG_PERIODS, 'signal_period': MACD_SIGNAL_PERIODS},
+    'rsi': {'period': RSI_PERIODS, 'buy_thread': RSI_BUY_THREADS, 'sell_thread': RSI_SELL_THREADS}
+}
+# Parameters returned when nothing makes a profit
+DEFAULT_PARAMS = {
+    'ema': {'period1': 7, 'period2': 14},
+    'bb': {'n': 20, 'k': 2.0},
+    'macd': {'short_period': 12, 'long_period': 26, 'signal_period': 9},
+    'rsi': {'period': 14, 'buy_thread': 30, 'sell_thread': 70}
+}
+
+
 @dataclass
 class Sma(object):
     '''
@@ -84,10 +113,10 @@ class HV(object):
     values: List[float]
 
 
-@dataclass
+@dataclass(frozen=True)
 class TradeParams(object):
     '''
-    Trade Params
+    Trade Params (immutable, so that it can be shared between threads)
     '''
     ema_enable: bool
     ema_period1: int
@@ -149,14 +178,55 @@ class Rankings(object):
         self.rankings = self._sort_by_performance(dummy_rankings, reverse)
 
 
+COLUMNS = ('time', 'open', 'close', 'high', 'low', 'volume')
+
+
+class CandleView(object):
+    '''
+    Read-only sequence of the candles of DataFrameCandle
+
+    Candle objects are created from the columns when they are accessed,
+    and kept for the next access.
+    '''
+    def __init__(self, df):
+        self.df = df
+        self.cache = [None] * df.length()
+
+    def __len__(self):
+        return len(self.cache)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        c = self.cache[index]
+        if c is None:
+            if index < 0:
+                index += len(self)
+            c = self.df.candle(index)
+            self.cache[index] = c
+        return c
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
 class DataFrameCandle(object):
     '''
     Dataframe of candales
+
+    The candles are stored as columns of numpy arrays (COLUMNS).
+    time is datetime64[us] (UTC) and the others are float64.
     '''
-    def __init__(self, product_code, duration, candles):
+    def __init__(self, product_code, duration, candles=(), columns=None):
         self.product_code = product_code
         self.duration = duration
-        self.candles = candles
+        if columns is None:
+            columns = self.rows_to_columns(
+                [(c.time, c.open, c.close, c.high, c.low, c.volume) for c in candles])
+        self.columns = columns
+        self._candles = None
+        self._indicators = {}   # Indicator arrays cached by evaluate()
         self.events = None      # Signal Events
         self.smas = []          # [sma(period1), sma(period2), ...]
         self.emas = []          # [ema(period1), ema(period2), ...]
@@ -166,12 +236,118 @@ class DataFrameCandle(object):
         self.macd = None
         self.hvs = []            # [hv(period1), hv(period2), ...]
 
+    @staticmethod
+    def rows_to_columns(rows):
+        '''
+        Returns columns of rows of (time, open, close, high, low, volume)
+        '''
+        if not rows:
+            columns = {name: np.empty(0) for name in COLUMNS}
+            columns['time'] = np.empty(0, dtype='datetime64[us]')
+            return columns
+        times, opens, closes, highs, lows, volumes = zip(*rows)
+        return {
+            'time': np.array([t.replace(tzinfo=None) for t in times], dtype='datetime64[us]'),
+            'open': np.array(opens, dtype=np.float64),
+            'close': np.array(closes, dtype=np.float64),
+            'high': np.array(highs, dtype=np.float64),
+            'low': np.array(lows, dtype=np.float64),
+            'volume': np.array(volumes, dtype=np.float64)
+        }
+
+    @classmethod
+    def from_rows(cls, product_code, duration, rows):
+        '''
+        Create DataFrameCandle from rows of (time, open, close, high, low, volume)
+        '''
+        return cls(product_code, duration, columns=cls.rows_to_columns(rows))
+
+    @classmethod
+    def from_epoch_rows(cls, product_code, duration, rows):
+        '''
+        Create DataFrameCandle from rows of (epoch milliseconds, open, close, high, low, volume)
+
+        The rows are converted by numpy at once.
+        '''
+        data = np.array(rows, dtype=np.float64).reshape(-1, len(COLUMNS))
+        return cls.from_columns(
+            product_code, duration,
+            data[:, 0].astype(np.int64).astype('datetime64[ms]').astype('datetime64[us]'),
+            *(np.ascontiguousarray(data[:, i]) for i in range(1, len(COLUMNS))))
+
+    @classmethod
+    def from_columns(cls, product_code, duration, time, open_v, close, high, low, volume):
+        '''
+        Create DataFrameCandle from arrays without copying them
+        '''
+        columns = {
+            'time': np.asarray(time, dtype='datetime64[us]'),
+            'open': np.asarray(open_v, dtype=np.float64),
+            'close': np.asarray(close, dtype=np.float64),
+            'high': np.asarray(high, dtype=np.float64),
+            'low': np.asarray(low, dtype=np.float64),
+            'volume': np.asarray(volume, dtype=np.float64)
+        }
+        return cls(product_code, duration, columns=columns)
+
+    @classmethod
+    def from_archive(cls, product_code, duration, start=None, end=None, directory=None):
+        '''
+        Create DataFrameCandle of the archived candles whose time is in [start, end)
+
+        The columns are read-only arrays memory-mapped from the archive (see app.models.archive).
+        '''
+        columns = archive.Archive(product_code, duration, directory).columns(start, end)
+        return cls.from_columns(product_code, duration, *(columns[name] for name in COLUMNS))
+
+    @property
+    def candles(self):
+        '''
+        Candle objects (created lazily)
+        '''
+        if self._candles is None:
+            self._candles = CandleView(self)
+        return self._candles
+
+    def length(self):
+        return len(self.columns['close'])
+
+    def candle(self, index):
+        '''
+        Returns Candle object of the index
+        '''
+        return candle.Candle(
+            product_code = self.product_code,
+            duration = self.duration,
+            time = self.columns['time'][index].item(),
+            open_v = self.columns['open'][index].item(),
+            close = self.columns['close'][index].item(),
+            high = self.columns['high'][index].item(),
+            low = self.columns['low'][index].item(),
+            volume = self.columns['volume'][index].item()
+        )
 
     def getall(self):
+        table = base.get_candle_table_name(self.product_code, self.duration)
         data =  {
             'product_code': self.product_code,
             'duration': self.duration,
-            'candles': [c.__dict__ for c in self.candles]
+            'candles': [
+                {
+                    'product_code': self.product_code,
+                    'duration': self.duration,
+                    'table': table,
+                    'time': t,
+                    'open': o,
+                    'close': c,
+                    'high': h,
+                    'low': l,
+                    'volume': v
+                }
+                for t, o, c, h, l, v in zip(
+                    self.times(), self.opens().tolist(), self.closes().tolist(),
+                    self.highs().tolist(), self.lows().tolist(), self.volumes().tolist())
+            ]
         }
         if self.events:
             data['events'] = self.events.data()
@@ -193,22 +369,25 @@ class DataFrameCandle(object):
         return data
 
     def times(self):
-        return [c.time for c in self.candles]
+        '''
+        Returns the times as a list of datetime
+        '''
+        return self.columns['time'].tolist()
     
     def opens(self):
-        return [c.open for c in self.candles]
+        return self.columns['open']
 
     def closes(self):
-        return [c.close for c in self.candles]
+        return self.columns['close']
 
     def highs(self):
-        return [c.high for c in self.candles]
+        return self.columns['high']
     
     def lows(self):
-        return [c.low for c in self.candles]
+        return self.columns['low']
 
     def volumes(self):
-        return [c.volume for c in self.candles]
+        return self.columns['volume']
     
     def set_events(self, signal_events):
         if type(signal_events) != events.SignalEvents:
@@ -223,7 +402,7 @@ class DataFrameCandle(object):
         return False
 
     def add_sma(self, period):
-        if len(self.candles) > period:
+        if self.length() > period:
             self.smas.append(
                 Sma(period, mathlib.sma(period, self.closes()))
             )
@@ -231,7 +410,7 @@ class DataFrameCandle(object):
         return False
 
     def add_ema(self, period):
-        if len(self.candles) > period:
+        if self.length() > period:
             self.emas.append(
                 Ema(period, mathlib.ema(period, self.closes()))
             )
@@ -239,14 +418,14 @@ class DataFrameCandle(object):
         return False
     
     def add_bbands(self, n, k):
-        if len(self.candles) > n:
+        if self.length() > n:
             up, mid, down = mathlib.bbands(n, k, self.closes())
             self.bbands = Bbands(n, k, up, mid, down)
             return True
         return False
     
     def add_ichimoku(self, tenkan_period, base_period, pre1_shift, pre2_period, delay_period):
-        if len(self.candles) > max(tenkan_period, base_period, pre2_period, delay_period):
+        if self.length() > max(tenkan_period, base_period, pre2_period, delay_period):
             tenkan, base, pre1, pre2, delay = mathlib.ichimoku(
                 self.highs(), self.lows(), self.closes(), tenkan_period, base_period, pre1_shift, pre2_period, delay_period
             )
@@ -258,7 +437,7 @@ class DataFrameCandle(object):
         return False
     
     def add_rsi(self, period):
-        if len(self.candles) > period:
+        if self.length() > period:
             values = mathlib.rsi(period, self.closes())
             self.rsi = Rsi(period, values)
             return True
@@ -272,14 +451,14 @@ class DataFrameCandle(object):
                 'error': 'Short period must be shorter than long period'
             })
             return False
-        if len(self.candles) > max(long_period, signal_period):
+        if self.length() > max(long_period, signal_period):
             macd, signal, histogram = mathlib.macd(short_period, long_period, signal_period, self.closes())
             self.macd = Macd(short_period, long_period, signal_period, macd, signal, histogram)
             return True
         return False
     
     def add_hv(self, period):
-        if len(self.candles) > period:
+        if self.length() > period:
             values = mathlib.historical_volatility(period, self.closes())
             self.hvs.append(
                 HV(period, values)
@@ -287,42 +466,84 @@ class DataFrameCandle(object):
             return True
         return False
 
+    def simulate(self, trade_model):
+        '''
+        Simulates trades of the trade model over the candles
+
+        The buy / sell signals of all the candles are obtained at once by trade_model.signals(),
+        and turned into trades by trade.fills().
+        '''
+        signal_events = events.SignalEvents([])
+        times = self.columns['time']
+        closes = self.columns['close']
+        for i, index in enumerate(trade.fills(*trade_model.signals(self))):
+            if i % 2 == 0:
+                signal_events.buy(self.product_code, times[index].item(), closes[index].item(), 1.0, False)
+            else:
+                signal_events.sell(self.product_code, times[index].item(), closes[index].item(), 1.0, False)
+        return signal_events
+
+    def performance(self, trade_model):
+        '''
+        Returns the profit of the trade model (None if it never trades)
+
+        Same as simulate(trade_model).profit() without creating signal events.
+        '''
+        indices = trade.fills(*trade_model.signals(self))
+        if not indices:
+            return None
+        prices = self.columns['close'][indices].tolist()
+        total = 0.0
+        before_sell = 0.0
+        for i, price in enumerate(prices):
+            if i % 2 == 0:
+                total -= price * 1.0
+            else:
+                total += price * 1.0
+                before_sell = total
+        # While holding, the profit is not confirmed.
+        if len(prices) % 2 == 1:
+            return before_sell
+        return total
+
     def back_test_ema(self, period1, period2):
         '''
         EMA simulation
         '''
-        len_candles = len(self.candles)
+        len_candles = self.length()
         if len_candles < period1 or len_candles < period2:
             return
         
-        signal_events = events.SignalEvents([])
-        ema_value1 = mathlib.ema(period1, self.closes())
-        ema_value2 = mathlib.ema(period2, self.closes())
+        closes = self.closes()
+        ema_value1 = mathlib.ema(period1, closes)
+        ema_value2 = mathlib.ema(period2, closes)
 
         trade_model = trade.TradeEma(ema_value1, ema_value2, period1, period2)
-
-        for i in range(1, len_candles):
-            if trade_model.should_buy(i):
-                signal_events.buy(self.product_code, self.candles[i].time, self.candles[i].close, 1.0, False)
-            
-            if trade_model.should_sell(i):
-                signal_events.sell(self.product_code, self.candles[i].time, self.candles[i].close, 1.0, False)
-        return signal_events
+        return self.simulate(trade_model)
     
-    def optimize_ema(self):
+    def optimize_ema(self, periods1=EMA_PERIODS1, periods2=EMA_PERIODS2):
         '''
         Obtains optimized EMA parameters by brute force method
+
+        EMAs of all the periods are calculated at once, and each simulation picks up the rows.
         '''
         performance = 0.0
         best_period1 = 7
         best_period2 = 14
 
-        for period1 in range(5, 12):
-            for period2 in range(12, 20):
-                signal_events = self.back_test_ema(period1, period2)
-                if not signal_events or not signal_events.signals:
+        len_candles = self.length()
+        periods = sorted(set(periods1) | set(periods2))
+        emas = npmathlib.ema_matrix(periods, self.closes())
+        emas = dict(zip(periods, emas))
+
+        for period1 in periods1:
+            for period2 in periods2:
+                if len_candles < period1 or len_candles < period2:
+                    continue
+                trade_model = trade.TradeEma(emas[period1], emas[period2], period1, period2)
+                profit = self.performance(trade_model)
+                if profit is None:
                     continue
-                profit = signal_events.profit()
                 if performance < profit:
                     performance = profit
                     best_period1 = period1
@@ -333,37 +554,36 @@ class DataFrameCandle(object):
         '''
         bbands simulation
         '''
-        len_candles = len(self.candles)
+        len_candles = self.length()
         if len_candles < n:
             return
         
-        signal_events = events.SignalEvents([])
         bb_up, bb_mid, bb_down = mathlib.bbands(n, k, self.closes())
 
         trade_model = trade.TradeBb(bb_up, bb_mid, bb_down, n, k)
+        return self.simulate(trade_model)
 
-        for i in range(1, len_candles):
-            if trade_model.should_buy(i, self.candles):
-                signal_events.buy(self.product_code, self.candles[i].time, self.candles[i].close, 1.0, False)
-            
-            if trade_model.should_sell(i, self.candles):
-                signal_events.sell(self.product_code, self.candles[i].time, self.candles[i].close, 1.0, False)
-        return signal_events
-
-    def optimize_bb(self):
+    def optimize_bb(self, ns=BB_NS, ks=BB_KS):
         '''
         Obtains optimized bbands parameters by brute force method
+
+        Bands of all the n and k are calculated at once.
         '''
         performance = 0.0
         best_n = 20
         best_k = 2.0
 
-        for n in range(10, 20):
-            for k in (i/10 for i in range(17, 23)):
-                signal_events = self.back_test_bb(n, k)
-                if not signal_events or not signal_events.signals:
+        len_candles = self.length()
+        ups, mids, downs = npmathlib.bbands_matrix(ns, ks, self.closes())
+
+        for row, n in enumerate(ns):
+            if len_candles < n:
+                continue
+            for col, k in enumerate(ks):
+                trade_model = trade.TradeBb(ups[row, col], mids[row], downs[row, col], n, k)
+                profit = self.performance(trade_model)
+                if profit is None:
                     continue
-                profit = signal_events.profit()
                 if performance < profit:
                     performance = profit
                     best_n = n
@@ -374,22 +594,14 @@ class DataFrameCandle(object):
         '''
         Ichimoku simulation
         '''
-        len_candles = len(self.candles)
+        len_candles = self.length()
         if len_candles < 52:
             return
         
-        signal_events = events.SignalEvents([])
         tenkan, base, pre1, pre2, delay = mathlib.ichimoku(self.highs(), self.lows(), self.closes())
 
         trade_model = trade.TradeIchimoku(tenkan, base, pre1, pre2, delay)
-        
-        for i in range(1, len(delay)):
-            if trade_model.should_buy(i, self.candles):
-                signal_events.buy(self.product_code, self.candles[i].time, self.candles[i].close, 1.0, False)
-            
-            if trade_model.should_sell(i, self.candles):
-                signal_events.sell(self.product_code, self.candles[i].time, self.candles[i].close, 1.0, False)
-        return signal_events
+        return self.simulate(trade_model)
 
     def optimize_ichimoku(self):
         signal_events = self.back_test_ichimoku()
@@ -401,39 +613,49 @@ class DataFrameCandle(object):
         '''
         MACD simulation
         '''
-        len_candles = len(self.candles)
+        len_candles = self.length()
         if len_candles < long_period:
             return
         
-        signal_events = events.SignalEvents([])
         macd, signal, histogram = mathlib.macd(short_period, long_period, signal_period, self.closes())
 
         trade_model = trade.TradeMacd(macd, signal, histogram, short_period, long_period, signal_period)
-
-        for i in range(1, len_candles):
-            if trade_model.should_buy(i):
-                signal_events.buy(self.product_code, self.candles[i].time, self.candles[i].close, 1.0, False)
-            
-            if trade_model.should_sell(i):
-                signal_events.sell(self.product_code, self.candles[i].time, self.candles[i].close, 1.0, False)
-        return signal_events
+        return self.simulate(trade_model)
     
-    def optimize_macd(self):
+    def optimize_macd(self, short_periods=MACD_SHORT_PERIODS, long_periods=MACD_LONG_PERIODS, signal_periods=MACD_SIGNAL_PERIODS):
         '''
         Obtains optimized MACD parameters by brute force method
+
+        EMAs of all the short and long periods are calculated once,
+        and the signal lines of all the signal periods are calculated at once for each MACD line.
         '''
         performance = 0.0
         best_short_period = 12
         best_long_period = 26
         best_signal_period = 9
 
-        for short_p in range(10, 20):
-            for long_p in range(20, 30):
-                for signal_p in range(5, 15):
-                    signal_events = self.back_test_macd(short_p, long_p, signal_p)
-                    if not signal_events or not signal_events.signals:
+        len_candles = self.length()
+        signal_periods = list(signal_periods)
+        periods = sorted(set(short_periods) | set(long_periods))
+        emas = dict(zip(periods, npmathlib.ema_matrix(periods, self.closes())))
+
+        for short_p in short_periods:
+            for long_p in long_periods:
+                if len_candles < long_p:
+                    continue
+                macd = emas[short_p] - emas[long_p]
+                macd[:long_p] = np.nan
+                signals = np.full((len(signal_periods), len_candles), np.nan)
+                signals[:, long_p:] = npmathlib.ema_matrix(signal_periods, macd[long_p:])
+                histograms = macd - signals
+
+                for row, signal_p in enumerate(signal_periods):
+                    histograms[row, :max(long_p, signal_p)] = np.nan
+                    trade_model = trade.TradeMacd(
+                        macd, signals[row], histograms[row], short_p, long_p, signal_p)
+                    profit = self.performance(trade_model)
+                    if profit is None:
                         continue
-                    profit = signal_events.profit()
                     if performance < profit:
                         performance = profit
                         best_short_period = short_p
@@ -445,39 +667,39 @@ class DataFrameCandle(object):
         '''
         RSI simulation
         '''
-        len_candles = len(self.candles)
+        len_candles = self.length()
         if len_candles < period:
             return
         
-        signal_events = events.SignalEvents([])
         rsi_value = mathlib.rsi(period, self.closes())
 
         trade_model = trade.TradeRsi(rsi_value, period, buy_thread, sell_thread)
-        
-        for i in range(1, len_candles):
-            if trade_model.should_buy(i):
-                signal_events.buy(self.product_code, self.candles[i].time, self.candles[i].close, 1.0, False)
-            
-            if trade_model.should_sell(i):
-                signal_events.sell(self.product_code, self.candles[i].time, self.candles[i].close, 1.0, False)
-        return signal_events
+        return self.simulate(trade_model)
     
-    def optimize_rsi(self):
+    def optimize_rsi(self, periods=RSI_PERIODS, buy_threads=RSI_BUY_THREADS, sell_threads=RSI_SELL_THREADS):
         '''
         Obtains optimiszed RSI parameters by brute force method
+
+        RSI of all the periods are calculated at once.
         '''
         performance = 0.0
         best_period = 14
         best_buy_thread = 30
         best_sell_thread = 70
 
-        for period in range(10, 20):
-            for buy_thread in range(27, 33):
-                for sell_thread in range(67, 73):
-                    signal_events = self.back_test_rsi(period, buy_thread, sell_thread)
-                    if not signal_events or not signal_events.signals:
+        len_candles = self.length()
+        rsis = npmathlib.rsi_matrix(periods, self.closes())
+
+        for row, period in enumerate(periods):
+            if len_candles < period:
+                continue
+            rsi_value = rsis[row]
+            for buy_thread in buy_threads:
+                for sell_thread in sell_threads:
+                    trade_model = trade.TradeRsi(rsi_value, period, buy_thread, sell_thread)
+                    profit = self.performance(trade_model)
+                    if profit is None:
                         continue
-                    profit = signal_events.profit()
                     if performance < profit:
                         performance = profit
                         best_period = period
@@ -486,15 +708,116 @@ class DataFrameCandle(object):
         
         return performance, best_period, best_buy_thread, best_sell_thread
     
-    def optimize_params(self):
+    def tail(self, length):
+        '''
+        Returns DataFrameCandle of the latest length candles (views of the columns)
+        '''
+        start = max(self.length() - length, 0)
+        return DataFrameCandle.from_columns(
+            self.product_code, self.duration, *(self.columns[name][start:] for name in COLUMNS))
+
+    def _indicator(self, key, calculate):
+        if key not in self._indicators:
+            self._indicators[key] = calculate()
+        return self._indicators[key]
+
+    def evaluate(self, indicator, params):
+        '''
+        Returns the performance of the parameters of the indicator ('ema', 'bb', 'macd' or 'rsi')
+
+        None if the candles are too short or the parameters never trade.
+        '''
+        len_candles = self.length()
+        closes = self.closes()
+        if indicator == 'ema':
+            period1, period2 = params['period1'], params['period2']
+            if len_candles < period1 or len_candles < period2:
+                return None
+            value1 = self._indicator(('ema', period1), lambda: npmathlib.ema(period1, closes))
+            value2 = self._indicator(('ema', period2), lambda: npmathlib.ema(period2, closes))
+            trade_model = trade.TradeEma(value1, value2, period1, period2)
+        elif indicator == 'bb':
+            n, k = params['n'], params['k']
+            if len_candles < n:
+                return None
+            up, mid, down = self._indicator(('bb', n, k), lambda: npmathlib.bbands(n, k, closes))
+            trade_model = trade.TradeBb(up, mid, down, n, k)
+        elif indicator == 'macd':
+            short_period, long_period, signal_period = params['short_period'], params['long_period'], params['signal_period']
+            if short_period >= long_period or len_candles < long_period:
+                return None
+            macd, signal, histogram = self._indicator(
+                ('macd', short_period, long_period, signal_period),
+                lambda: npmathlib.macd(short_period, long_period, signal_period, closes))
+            trade_model = trade.TradeMacd(macd, signal, histogram, short_period, long_period, signal_period)
+        elif indicator == 'rsi':
+            period = params['period']
+            if len_candles < period:
+                return None
+            value = self._indicator(('rsi', period), lambda: npmathlib.rsi(period, closes))
+            trade_model = trade.TradeRsi(value, period, params['buy_thread'], params['sell_thread'])
+        else:
+            raise ValueError('Unknown indicator: {}'.format(indicator))
+        return self.performance(trade_model)
+
+    def search(self, indicator, strategy, space=None):
+        '''
+        Obtains optimized parameters of the indicator by the search strategy (app.models.search)
+
+        space: the search space (default: SEARCH_SPACES[indicator])
+        Returns the same tuple as the optimize_* method.
+        '''
+        if space is None:
+            space = SEARCH_SPACES[indicator]
+        tails = {}
+
+        def objective(params, fraction):
+            if fraction >= 1.0:
+                return self.evaluate(indicator, params)
+            length = max(int(self.length() * fraction), 1)
+            if length not in tails:
+                tails[length] = self.tail(length)
+            return tails[length].evaluate(indicator, params)
+
+        performance, params = strategy.run(space, objective)
+        logger.debug({
+            'action': 'DataFrameCandle:search',
+            'indicator': indicator,
+            'strategy': type(strategy).__name__,
+            'evals': strategy.budget.evals,
+            'performance': performance
+        })
+        if params is None:
+            params = DEFAULT_PARAMS[indicator]
+        return (performance, *(params[name] for name in space))
+
+    def optimize_params(self, max_workers=1, strategy=None):
         '''
         Returns optimized trade parameters.
-        
+
+        max_workers: the number of processes to search parameters (1: in this process)
+        strategy: the search strategy (None: the exhaustive grid search by the optimize_* methods),
+                  whose budget is split among the indicators
+        '''
+        if max_workers != 1:
+            from . import optimizer
+            return optimizer.optimize_params(self, max_workers, strategy)
+        if strategy is not None:
+            strategies = strategy.split(len(SEARCH_SPACES))
+            return self.rank_params(
+                *(self.search(indicator, strategy) for indicator, strategy in zip(SEARCH_SPACES, strategies)))
+        return self.rank_params(self.optimize_ema(), self.optimize_bb(), self.optimize_macd(), self.optimize_rsi())
+
+    def rank_params(self, ema_result, bb_result, macd_result, rsi_result):
+        '''
+        Returns trade parameters whose indicators are enabled by the ranking of performances
+
+        Each result is a return value of the optimize_* method.
         '''
-        ema_performance, ema_period1, ema_period2 = self.optimize_ema()
-        bb_performance, bb_n, bb_k = self.optimize_bb()
-        macd_performance, macd_short_period, macd_long_period, macd_signal_period = self.optimize_macd()
-        rsi_performance, rsi_period, rsi_buy_thread, rsi_sell_thread = self.optimize_rsi()
+        ema_performance, ema_period1, ema_period2 = ema_result
+        bb_performance, bb_n, bb_k = bb_result
+        macd_performance, macd_short_period, macd_long_period, macd_signal_period = macd_result
+        rsi_performance, rsi_period, rsi_buy_thread, rsi_sell_thread = rsi_result
 
         ema_ranking = Ranking(ema_performance)
         bb_ranking = Ranking(bb_performance)
@@ -1,9 +1,9 @@
 import datetime
-import sqlite3
 import json
 
 
 from config import config
+from . import base, writer
 
 
 TABLE_NAME_SIGNAL_EVENTS = 'signal_events'
@@ -27,19 +27,14 @@ class SignalEvent(object):
         self.notes = ""
     
     def save(self):
-        conn = sqlite3.connect(config.Config.db_name)
-        curs = conn.cursor()
-
-        curs.execute(
+        time = base.to_epoch_ms(self.time)
+        writer.submit(
             '''
             insert or replace into {} (time, product_code, side, price, size, notes) values (?, ?, ?, ?, ?, ?)
             '''.format(TABLE_NAME_SIGNAL_EVENTS),
-            (self.time.replace(tzinfo=None), self.product_code, self.side, self.price, self.size, self.notes)
+            (time, self.product_code, self.side, self.price, self.size, self.notes),
+            (TABLE_NAME_SIGNAL_EVENTS, time, (time, self.product_code, self.side, self.price, self.size))
         )
-        
-        conn.commit()
-        curs.close()
-        conn.close()
 
 
 class SignalEvents(object):
@@ -136,36 +131,36 @@ def get_signal_events_by_count(load_events):
     '''
     Returns the latest signal events
     '''
-    conn = sqlite3.connect(config.Config.db_name, detect_types=sqlite3.PARSE_DECLTYPES)
-    conn.row_factory = sqlite3.Row
-    curs = conn.cursor()
-
-    curs.execute(
-        '''
-        select * from (
-            select time, product_code, side, price, size from {} where product_code = ? order by time desc limit ?
-        ) order by time asc;
-        '''.format(TABLE_NAME_SIGNAL_EVENTS),
-        (config.Config.product_code, load_events)
-    )
-
-    rows = curs.fetchall()
+    # An event replaced by a pending event of another product code is dropped too
+    pending = writer.pending_rows(TABLE_NAME_SIGNAL_EVENTS)
+    with base.connect() as conn:
+        curs = conn.cursor()
+        curs.execute(
+            '''
+            select * from (
+                select time, product_code, side, price, size from {} where product_code = ? order by time desc limit ?
+            ) order by time asc;
+            '''.format(TABLE_NAME_SIGNAL_EVENTS),
+            (config.Config.product_code, load_events)
+        )
+        rows = curs.fetchall()
+        curs.close()
+    if pending:
+        rows = writer.merge_rows(rows, pending, reverse=True)
+        rows = [row for row in rows if row[1] == config.Config.product_code][:load_events][::-1]
     if not rows:
         return
-    
-    curs.close()
-    conn.close()
 
     signal_events = SignalEvents([])
 
     for row in rows:
         signal_events.signals.append(
             SignalEvent(
-                time = row['time'],
-                product_code = row['product_code'] ,
-                side = row['side'],
-                price = row['price'],
-                size = row['size']
+                time = base.from_epoch_ms(row[0]),
+                product_code = row[1] ,
+                side = row[2],
+                price = row[3],
+                size = row[4]
             )
         )
 
@@ -176,35 +171,33 @@ def get_signal_events_after_time(time):
     '''
     Returns the signal events after given time
     '''
-    conn = sqlite3.connect(config.Config.db_name, detect_types=sqlite3.PARSE_DECLTYPES)
-    conn.row_factory = sqlite3.Row
-    curs = conn.cursor()
-
-    curs.execute(
-        '''
-        select * from (
-            select time, product_code, side, price, size from {} where time >= ? order by time desc
-        ) order by time asc;
-        '''.format(TABLE_NAME_SIGNAL_EVENTS),
-        (time,)
-    )
-
-    rows = curs.fetchall()
+    ms = base.to_epoch_ms(time)
+    pending = {t: row for t, row in writer.pending_rows(TABLE_NAME_SIGNAL_EVENTS).items() if t >= ms}
+    with base.connect() as conn:
+        curs = conn.cursor()
+        curs.execute(
+            '''
+            select * from (
+                select time, product_code, side, price, size from {} where time >= ? order by time desc
+            ) order by time asc;
+            '''.format(TABLE_NAME_SIGNAL_EVENTS),
+            (ms,)
+        )
+        rows = curs.fetchall()
+        curs.close()
+    rows = writer.merge_rows(rows, pending)
     if not rows:
         return
-    
-    curs.close()
-    conn.close()
 
     signal_events = SignalEvents([])
     for row in rows:
         signal_events.signals.append(
             SignalEvent(
-                time = row['time'],
-                product_code = row['product_code'],
-                side = row['side'],
-                price = row['price'],
-                size = row['size']
+                time = base.from_epoch_ms(row[0]),
+                product_code = row[1],
+                side = row[2],
+                price = row[3],
+                size = row[4]
             )
         )
     return signal_events
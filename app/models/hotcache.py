@@ -0,0 +1,235 @@
+'''
+In-memory cache of the latest candles
+
+Every candle written by Candle.create / Candle.save is also put into a fixed-capacity
+ring buffer of its (product_code, duration), so the buffer holds every candle between
+its oldest and newest time as the DB does (the DB is behind by the write-behind queue).
+Reads of the latest candles are served from the buffer, and only the candles older than
+the buffer are read from the DB (they are added to the buffer while there is room).
+
+Rows are [epoch milliseconds, open, close, high, low, volume] in a float64 array.
+'''
+import threading
+
+import numpy as np
+
+from config import config
+from . import base
+
+
+class CandleBuffer(object):
+    '''
+    Ring buffer of the latest candles of a (product_code, duration)
+    '''
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.data = np.empty((capacity, 6), dtype=np.float64)
+        self.start = 0          # index of the oldest row
+        self.size = 0
+        # Whether the DB has no candle older than the buffer
+        self.complete = False
+
+    def __len__(self):
+        return self.size
+
+    def oldest(self):
+        return self.data[self.start, 0]
+
+    def newest(self):
+        return self.data[(self.start + self.size - 1) % self.capacity, 0]
+
+    def rows(self, n=None):
+        '''
+        Returns the latest n rows (all rows if n is None) in time order
+        '''
+        n = self.size if n is None else min(n, self.size)
+        index = (self.start + self.size - n + np.arange(n)) % self.capacity
+        return self.data[index]
+
+    def put(self, row):
+        '''
+        Inserts or replaces the row
+        '''
+        t = row[0]
+        if self.size and t == self.newest():
+            self.data[(self.start + self.size - 1) % self.capacity] = row
+        elif self.size == 0 or t > self.newest():
+            self.data[(self.start + self.size) % self.capacity] = row
+            if self.size == self.capacity:
+                self.start = (self.start + 1) % self.capacity
+                self.complete = False
+            else:
+                self.size += 1
+        elif t >= self.oldest():
+            rows = self.rows()
+            i = int(np.searchsorted(rows[:, 0], t))
+            if rows[i, 0] == t:
+                self.data[(self.start + i) % self.capacity] = row
+            else:
+                # A late candle between the cached ones
+                if self.size == self.capacity:
+                    self.complete = False
+                self.reset(np.insert(rows, i, row, axis=0))
+        else:
+            # A candle older than the buffer is in the DB only
+            self.complete = False
+
+    def prepend(self, rows):
+        '''
+        Adds the rows (in time order) older than the buffer while there is room
+        '''
+        if self.size:
+            rows = rows[rows[:, 0] < self.oldest()]
+        room = self.capacity - self.size
+        if not len(rows) or not room:
+            return
+        self.reset(np.concatenate([rows[-room:], self.rows()]))
+
+    def discard_before(self, t):
+        '''
+        Removes the rows older than t (deleted from the DB)
+        '''
+        rows = self.rows()
+        i = int(np.searchsorted(rows[:, 0], t))
+        if i:
+            self.reset(rows[i:])
+
+    def reset(self, rows):
+        rows = rows[-self.capacity:]
+        self.data[:len(rows)] = rows
+        self.start = 0
+        self.size = len(rows)
+
+
+class HotCache(object):
+    '''
+    CandleBuffers of every (product_code, duration)
+
+    The buffers are emptied when config.Config.db_name changes or candles are imported into the DB
+    (see base.cache_generation).
+    '''
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.buffers = {}
+        self.generation = None
+        self.lock = threading.Lock()
+
+        # Statistics
+        self.hits = 0
+        self.misses = 0
+
+    def buffer(self, product_code, duration, create=False):
+        '''
+        Returns the buffer of the (product_code, duration), or None if it has no buffer and not create
+
+        Only writes create buffers, so reads of unknown product codes allocate nothing.
+        '''
+        generation = base.cache_generation()
+        if self.generation != generation:
+            self.buffers.clear()
+            self.generation = generation
+        key = (product_code, duration)
+        buffer = self.buffers.get(key)
+        if buffer is None and create:
+            buffer = self.buffers[key] = CandleBuffer(self.capacity)
+        return buffer
+
+    def put(self, product_code, duration, row):
+        if self.capacity <= 0:
+            return
+        with self.lock:
+            self.buffer(product_code, duration, create=True).put(row)
+
+    def latest(self, product_code, duration, limit):
+        '''
+        Returns (rows, complete): the latest rows up to limit, and whether they are all of the latest limit candles
+        '''
+        if self.capacity <= 0:
+            return np.empty((0, 6)), False
+        with self.lock:
+            buffer = self.buffer(product_code, duration)
+            if buffer is None:
+                rows, complete = np.empty((0, 6)), False
+            else:
+                rows = buffer.rows(limit)
+                complete = len(rows) >= limit or buffer.complete
+        if complete:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return rows, complete
+
+    def after(self, product_code, duration, t):
+        '''
+        Returns the rows whose time is equal to or after t, or None if the buffer does not cover t
+        '''
+        if self.capacity <= 0:
+            return None
+        with self.lock:
+            buffer = self.buffer(product_code, duration)
+            if not buffer or (t < buffer.oldest() and not buffer.complete):
+                self.misses += 1
+                return None
+            rows = buffer.rows()
+        self.hits += 1
+        return rows[np.searchsorted(rows[:, 0], t):]
+
+    def prepend(self, product_code, duration, rows, complete):
+        '''
+        Adds the rows read from the DB, which are older than the buffer
+
+        complete: whether the DB has no candle older than the rows
+        '''
+        if self.capacity <= 0:
+            return
+        with self.lock:
+            # A buffer is not created for no rows (e.g. of an unknown product code)
+            buffer = self.buffer(product_code, duration, create=len(rows) > 0)
+            if buffer is None:
+                return
+            size = len(buffer)
+            buffer.prepend(rows)
+            if complete and len(buffer) - size == len(rows):
+                buffer.complete = True
+
+    def merge(self, product_code, duration, row):
+        '''
+        Merges the high, low and volume of the row (a late ticker) into the cached candle of its time
+
+        Returns the merged row, or None if the buffer does not cover the time.
+        '''
+        if self.capacity <= 0:
+            return None
+        t = row[0]
+        with self.lock:
+            buffer = self.buffer(product_code, duration)
+            if not buffer or t < buffer.oldest() or t > buffer.newest():
+                return None
+            rows = buffer.rows()
+            i = int(np.searchsorted(rows[:, 0], t))
+            if rows[i, 0] == t:
+                # The close is not replaced by the older ticker
+                _, open_v, close, high, low, volume = rows[i].tolist()
+                row = (t, open_v, close, max(high, row[3]), min(low, row[4]), volume + row[5])
+            buffer.put(row)
+        return row
+
+    def discard_before(self, product_code, duration, t):
+        with self.lock:
+            buffer = self.buffers.get((product_code, duration))
+            if buffer is not None:
+                buffer.discard_before(t)
+
+    def clear(self):
+        with self.lock:
+            self.buffers.clear()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'buffers': {'{}_{}'.format(*key): len(buffer) for key, buffer in self.buffers.items()}
+        }
+
+
+CACHE = HotCache(config.Config.candle_cache_size)
@@ -0,0 +1,310 @@
+'''
+Importer of historical ticks and candles
+
+    python -m app.models.importer [--kind auto|ticks|ohlcv] [--duration 1m] [--workers N] [--db db_name] files...
+
+Files are CSV (with a header) or JSON lines, optionally gzipped (e.g. ticks.csv.gz, candles.jsonl).
+Fields are matched by name:
+
+    ticks: timestamp (or time), best_bid and best_ask (or price / ltp), volume (or size)
+    ohlcv: time (or timestamp), open, close, high, low, volume (candles of --duration)
+
+Times are ISO 8601 (UTC unless an offset is given) or epoch seconds / milliseconds.
+Rows are read in chunks and aggregated into candles of every configured duration
+(of --duration and coarser for ohlcv) with numpy. A candle of ticks is merged into the
+candle of the same time in the DB with the rules of create_or_update_candle: the open is kept,
+the close is replaced, the high and low are extended and the volume is added.
+A candle of ohlcv replaces the candle of the same time, so a file can be imported again.
+
+Files are read and aggregated by worker processes in parallel, and their candles are
+written in the order of the files in transactions of batch_size candles.
+The rows of a file and the files should be in time order.
+Running processes (e.g. the streamer) drop their cached candles once they see the import
+(see base.cache_generation).
+'''
+import argparse
+import concurrent.futures
+import csv
+import datetime
+import gzip
+import json
+import os
+import time
+
+import numpy as np
+
+from config import config
+from utils.logsettings import getLogger
+from . import base, hotcache, resample
+
+
+logger = getLogger(__name__)
+
+
+COLUMNS = ('time', 'open', 'close', 'high', 'low', 'volume')
+
+# Names of the fields (first found is used)
+FIELDS = {
+    'time': ('time', 'timestamp', 'date', 'exec_date'),
+    'best_bid': ('best_bid',),
+    'best_ask': ('best_ask',),
+    'price': ('price', 'ltp'),
+    'open': ('open',),
+    'close': ('close',),
+    'high': ('high',),
+    'low': ('low',),
+    'volume': ('volume', 'size')
+}
+
+def open_file(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', newline='')
+    return open(path, 'r', newline='')
+
+
+def file_format(path):
+    name = path[:-3] if path.endswith('.gz') else path
+    if name.endswith('.jsonl') or name.endswith('.ndjson') or name.endswith('.json'):
+        return 'jsonl'
+    return 'csv'
+
+
+def find_fields(names):
+    '''
+    Returns {field: name in the file} of the fields in the file
+
+    Raises ValueError if there is not a time field.
+    '''
+    lower = {name.strip().lower(): name for name in names}
+    fields = {}
+    for field, candidates in FIELDS.items():
+        for candidate in candidates:
+            if candidate in lower:
+                fields[field] = lower[candidate]
+                break
+    if 'time' not in fields:
+        raise ValueError('No time field ({}): {}'.format(' / '.join(FIELDS['time']), sorted(lower)))
+    return fields
+
+
+def detect_kind(fields):
+    if all(field in fields for field in ('open', 'close', 'high', 'low')):
+        return 'ohlcv'
+    if 'price' in fields or ('best_bid' in fields and 'best_ask' in fields):
+        return 'ticks'
+    raise ValueError('Neither ticks nor candles: {}'.format(sorted(fields)))
+
+
+def read_chunks(path, chunk_size=500000):
+    '''
+    Yields (fields, {field: list of values}) of every chunk_size rows
+    '''
+    with open_file(path) as f:
+        if file_format(path) == 'csv':
+            reader = csv.reader(f)
+            header = next(reader, None)
+            if header is None:
+                return
+            fields = find_fields(header)
+            index = {field: header.index(name) for field, name in fields.items()}
+            chunk = {field: [] for field in fields}
+            for row in reader:
+                if not row:
+                    continue
+                for field, i in index.items():
+                    chunk[field].append(row[i])
+                if len(chunk['time']) >= chunk_size:
+                    yield fields, chunk
+                    chunk = {field: [] for field in fields}
+        else:
+            fields = None
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                # The fields are of the first record
+                if fields is None:
+                    fields = find_fields(record)
+                    chunk = {field: [] for field in fields}
+                for field, name in fields.items():
+                    value = record.get(name)
+                    if value is None:
+                        raise ValueError('{}:{}: no value of {}'.format(path, line_number, name))
+                    chunk[field].append(value)
+                if len(chunk['time']) >= chunk_size:
+                    yield fields, chunk
+                    chunk = {field: [] for field in fields}
+            if fields is None:
+                return
+        if chunk['time']:
+            yield fields, chunk
+
+
+def parse_times(values):
+    '''
+    Returns the epoch milliseconds (int64 array) of ISO 8601 strings or epoch seconds / milliseconds
+    '''
+    try:
+        numbers = np.asarray(values, dtype=np.float64)
+    except ValueError:
+        numbers = None
+    if numbers is not None:
+        if len(numbers) and np.nanmax(numbers) > 1e11:
+            return numbers.astype(np.int64)
+        return np.round(numbers * 1000).astype(np.int64)
+
+    strings = np.char.strip(np.asarray(values, dtype=str))
+    strings = np.char.rstrip(strings, 'Z')
+    try:
+        return strings.astype('datetime64[ms]').astype(np.int64)
+    except ValueError:
+        # With UTC offsets (e.g. +09:00)
+        return np.array([base.to_epoch_ms(datetime.datetime.fromisoformat(s)) for s in strings], dtype=np.int64)
+
+
+def to_candles(fields, chunk, kind, durations):
+    '''
+    Returns {duration: candles} of the chunk
+
+    durations: [(duration, timedelta)] finest first. For ohlcv, the first one is the duration of the rows.
+    '''
+    times = parse_times(chunk['time'])
+    order = np.argsort(times, kind='stable')
+    times = times[order]
+    volumes = np.asarray(chunk['volume'], dtype=np.float64)[order] if 'volume' in fields else np.zeros(len(times))
+
+    if kind == 'ticks':
+        if 'best_bid' in fields and 'best_ask' in fields:
+            prices = (np.asarray(chunk['best_bid'], dtype=np.float64) + np.asarray(chunk['best_ask'], dtype=np.float64)) / 2
+        else:
+            prices = np.asarray(chunk['price'], dtype=np.float64)
+        prices = prices[order]
+        # A ticker is a candle whose open, close, high and low are its price
+        candles = {'open': prices, 'close': prices, 'high': prices, 'low': prices}
+    else:
+        candles = {name: np.asarray(chunk[name], dtype=np.float64)[order] for name in ('open', 'close', 'high', 'low')}
+    candles['time'] = times
+    candles['volume'] = volumes
+    candles = resample.rollup(candles, durations[0][1])
+
+    result = {durations[0][0]: candles}
+    for duration, delta in durations[1:]:
+        candles = resample.rollup(candles, delta)
+        result[duration] = candles
+    return result
+
+
+def load_file(path, kind='auto', duration=None, chunk_size=500000):
+    '''
+    Reads the file, and returns (rows read, kind of the rows, {duration: candles})
+    '''
+    durations = sorted(config.Config.durations.items(), key=lambda item: item[1])
+    read = 0
+    pieces = {}
+    for fields, chunk in read_chunks(path, chunk_size):
+        if kind == 'auto':
+            kind = detect_kind(fields)
+        if kind == 'ohlcv':
+            if duration is None:
+                raise ValueError('The duration of the candles is required')
+            durations = [(d, delta) for d, delta in durations if delta >= config.Config.durations[duration]]
+        for d, candles in to_candles(fields, chunk, kind, durations).items():
+            pieces.setdefault(d, []).append(candles)
+        read += len(chunk['time'])
+
+    # The candles of chunks are merged (a candle may be split into two chunks)
+    result = {}
+    for d, delta in durations:
+        if d not in pieces:
+            continue
+        candles = {name: np.concatenate([c[name] for c in pieces[d]]) for name in COLUMNS}
+        result[d] = resample.rollup(candles, delta) if len(pieces[d]) > 1 else candles
+    return read, kind, result
+
+
+def write_candles(product_code, candles, batch_size=50000, replace=False):
+    '''
+    Merges the candles {duration: candles} into the tables in transactions of batch_size candles
+
+    replace: replaces the candles of the same times instead of merging them (for ohlcv)
+    Returns {duration: candles written}.
+    '''
+    written = {}
+    with base.connect() as conn:
+        for duration, c in candles.items():
+            if replace:
+                sql = '''
+                    insert or replace into {} (time, open, close, high, low, volume) values (?, ?, ?, ?, ?, ?);
+                    '''
+            else:
+                sql = '''
+                    insert into {} (time, open, close, high, low, volume) values (?, ?, ?, ?, ?, ?)
+                    on conflict(time) do update set
+                        close = excluded.close,
+                        high = max(high, excluded.high),
+                        low = min(low, excluded.low),
+                        volume = volume + excluded.volume;
+                    '''
+            sql = sql.format(base.get_candle_table_name(product_code, duration))
+            rows = list(zip(c['time'].tolist(), *(c[name].tolist() for name in COLUMNS[1:])))
+            for i in range(0, len(rows), batch_size):
+                with conn:
+                    conn.executemany(sql, rows[i:i + batch_size])
+            written[duration] = len(rows)
+    return written
+
+
+def import_files(paths, product_code=None, kind='auto', duration=None, workers=1, batch_size=50000):
+    '''
+    Imports the files, and returns {path: (rows read, {duration: candles written})}
+
+    Files are read by worker processes if workers > 1, and written in the order of paths.
+    '''
+    product_code = product_code or config.Config.product_code
+    base.init()
+    results = {}
+    executor = None
+    if workers > 1 and len(paths) > 1:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=min(workers, len(paths)))
+        loaded = executor.map(load_file, paths, [kind] * len(paths), [duration] * len(paths))
+    else:
+        loaded = (load_file(path, kind, duration) for path in paths)
+    try:
+        for path, (read, loaded_kind, candles) in zip(paths, loaded):
+            results[path] = (read, write_candles(product_code, candles, batch_size, replace=loaded_kind == 'ohlcv'))
+            logger.info({
+                'action': 'importer:import_files',
+                'path': path,
+                'rows': read,
+                'candles': results[path][1]
+            })
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    # Imported candles are not in the caches (of this process and, by the marker, of the others)
+    hotcache.CACHE.clear()
+    resample.CACHE.clear()
+    base.mark_imported()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import ticks or candles into the candle tables')
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('--kind', choices=('auto', 'ticks', 'ohlcv'), default='auto')
+    parser.add_argument('--duration', choices=list(config.Config.durations), help='duration of the candles (ohlcv)')
+    parser.add_argument('--product-code', default=config.Config.product_code)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--db', default=config.Config.db_name)
+    args = parser.parse_args()
+
+    config.Config.db_name = args.db
+    start = time.monotonic()
+    results = import_files(args.files, args.product_code, args.kind, args.duration, args.workers)
+    for path, (rows, candles) in results.items():
+        print('{}: {} rows -> {}'.format(path, rows, candles))
+    print('{} files imported in {:.1f} seconds'.format(len(results), time.monotonic() - start))
+
+
+if __name__ == '__main__':
+    main()
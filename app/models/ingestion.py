@@ -0,0 +1,170 @@
+'''
+Bounded queue of the realtime tickers
+
+The websocket puts tickers into the queue and stream_ingestion_data gets them.
+When the consumer is stalled (e.g. by a trade or a slow write), the queue holds at most
+maxsize items and the overflow is handled by the policy:
+
+    block         the producer waits for a free slot
+    drop_oldest   the oldest item is dropped
+    coalesce      while the consumer is behind, a ticker of the same candle (of the finest duration)
+                  as the newest queued item is merged into it as an OHLCV delta (TickerDelta),
+                  so the candles are the same as without coalescing.
+                  The oldest item is dropped if the queue is full of different candles.
+
+Tickers whose tick_id is among the recent dedup_window tick ids of the product are dropped
+(e.g. tickers sent again after a reconnect).
+'''
+import collections
+import datetime
+import queue
+import threading
+import time
+
+from config import config
+from . import base
+
+
+POLICIES = ('block', 'drop_oldest', 'coalesce')
+
+
+class TickerDelta(object):
+    '''
+    Tickers of a candle coalesced into one OHLCV delta
+
+    It has the methods of a ticker used by CandleAggregator.update.
+    '''
+    __slots__ = ('product_code', 'tick_id', 'epoch_us', 'values', 'count')
+
+    def __init__(self, ticker):
+        self.product_code = ticker.product_code
+        self.tick_id = ticker.tick_id
+        self.epoch_us = ticker.epoch_us
+        self.values = ticker.ohlcv()
+        self.count = 1
+
+    def add(self, ticker):
+        _, close, high, low, volume = ticker.ohlcv()
+        values = self.values
+        values[1] = close
+        if values[2] < high:
+            values[2] = high
+        if values[3] > low:
+            values[3] = low
+        values[4] += volume
+        self.tick_id = ticker.tick_id
+        self.epoch_us = ticker.epoch_us
+        self.count += 1
+
+    def ohlcv(self):
+        return list(self.values)
+
+    def epoch_ms(self):
+        return self.epoch_us // 1000
+
+
+class TickerQueue(object):
+    '''
+    Bounded queue of tickers with an overflow policy (get and put as queue.Queue)
+    '''
+    def __init__(self, maxsize=None, policy=None, dedup_window=None, delta:datetime.timedelta=None):
+        self.maxsize = maxsize if maxsize is not None else config.Config.ingestion_queue_size
+        self.policy = policy or config.Config.ingestion_policy
+        if self.policy not in POLICIES:
+            raise ValueError('Unknown policy: {} (one of {})'.format(self.policy, ', '.join(POLICIES)))
+        self.dedup_window = dedup_window if dedup_window is not None else config.Config.ingestion_dedup_window
+        # Candles of the finest duration are not merged by coalescing
+        self.delta = delta or min(config.Config.durations.values())
+
+        self.items = collections.deque()
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)
+        self.not_full = threading.Condition(self.lock)
+        self.tick_ids = {}      # {product_code: (deque, set) of the recent tick ids}
+
+        # Statistics
+        self.received = 0
+        self.duplicates = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.lag = 0.0          # seconds from the timestamp of the last ticker got
+        self.max_lag = 0.0
+
+    def qsize(self):
+        with self.lock:
+            return len(self.items)
+
+    def duplicate(self, ticker):
+        if self.dedup_window <= 0:
+            return False
+        recent = self.tick_ids.get(ticker.product_code)
+        if recent is None:
+            recent = self.tick_ids[ticker.product_code] = (collections.deque(), set())
+        ids, id_set = recent
+        if ticker.tick_id in id_set:
+            return True
+        ids.append(ticker.tick_id)
+        id_set.add(ticker.tick_id)
+        if len(ids) > self.dedup_window:
+            id_set.discard(ids.popleft())
+        return False
+
+    def coalesce(self, ticker):
+        '''
+        Merges the ticker into the newest item if they are of the same candle
+        '''
+        if not self.items:
+            return False
+        newest = self.items[-1]
+        if newest.product_code != ticker.product_code:
+            return False
+        # Tickers are merged in time order
+        if newest.epoch_us > ticker.epoch_us or (
+                base.truncate_epoch_ms(newest.epoch_us // 1000, self.delta) != base.truncate_epoch_ms(ticker.epoch_us // 1000, self.delta)):
+            return False
+        if not isinstance(newest, TickerDelta):
+            newest = self.items[-1] = TickerDelta(newest)
+        newest.add(ticker)
+        self.coalesced += 1
+        return True
+
+    def put(self, ticker, block=True, timeout=None):
+        with self.lock:
+            self.received += 1
+            if self.duplicate(ticker):
+                self.duplicates += 1
+                return
+            if self.policy == 'coalesce' and self.coalesce(ticker):
+                return
+            if self.maxsize > 0 and len(self.items) >= self.maxsize:
+                if self.policy == 'block':
+                    if not self.not_full.wait_for(lambda: len(self.items) < self.maxsize, timeout if block else 0):
+                        self.dropped += 1
+                        raise queue.Full
+                else:
+                    self.items.popleft()
+                    self.dropped += 1
+            self.items.append(ticker)
+            self.not_empty.notify()
+
+    def get(self, block=True, timeout=None):
+        with self.lock:
+            if not self.not_empty.wait_for(lambda: self.items, timeout if block else 0):
+                raise queue.Empty
+            ticker = self.items.popleft()
+            self.not_full.notify()
+        self.lag = time.time() - ticker.epoch_us / 1000000
+        if self.lag > self.max_lag:
+            self.max_lag = self.lag
+        return ticker
+
+    def stats(self):
+        return {
+            'size': len(self.items),
+            'received': self.received,
+            'duplicates': self.duplicates,
+            'dropped': self.dropped,
+            'coalesced': self.coalesced,
+            'lag': self.lag,
+            'max_lag': self.max_lag
+        }
@@ -0,0 +1,110 @@
+'''
+Migration of the DB schema
+
+    python -m app.models.migrate [db_name]
+
+Version 0 -> 1: the time columns of the candle and signal event tables become
+integer epoch milliseconds (UTC), and the tables become WITHOUT ROWID tables.
+Each table is copied and swapped in its own short transaction,
+so a DB can be migrated while the application is using it.
+
+Version 1 -> 2: the cache of optimized parameters (see app.models.paramcache) is dropped,
+and base.init creates it again with text columns and created_at of epoch milliseconds.
+'''
+import argparse
+
+from config import config
+from utils.logsettings import getLogger
+from . import base
+
+
+logger = getLogger(__name__)
+
+
+# timestamp text (UTC) -> epoch milliseconds
+EPOCH_MS = 'cast(round((julianday(time) - 2440587.5) * 86400000) as integer)'
+
+
+def get_schema_version(conn):
+    return conn.execute('pragma user_version').fetchone()[0]
+
+
+def legacy_tables(conn):
+    '''
+    Returns [(table_name, columns)] of the tables whose time column is timestamp
+    '''
+    tables = []
+    names = [row[0] for row in conn.execute("select name from sqlite_master where type = 'table' order by name")]
+    for name in names:
+        columns = {row[1]: row[2].lower() for row in conn.execute('pragma table_info({})'.format(name))}
+        if columns.get('time') == 'timestamp':
+            tables.append((name, list(columns)))
+    return tables
+
+
+def migrate_table(conn, table_name, columns):
+    '''
+    Copies the table into the new schema and replaces it in a transaction
+    '''
+    tmp_name = table_name + '_migrating'
+    curs = conn.cursor()
+    curs.execute('begin immediate')
+    try:
+        curs.execute('drop table if exists {}'.format(tmp_name))
+        if 'side' in columns:
+            base.create_signal_events_table(curs, tmp_name)
+            values = 'product_code, side, price, size, notes'
+        else:
+            base.create_candle_table(curs, tmp_name)
+            values = 'open, close, high, low, volume'
+        curs.execute(
+            'insert or replace into {} (time, {}) select {}, {} from {}'.format(
+                tmp_name, values, EPOCH_MS, values, table_name)
+        )
+        rows = curs.rowcount
+        curs.execute('drop table {}'.format(table_name))
+        curs.execute('alter table {} rename to {}'.format(tmp_name, table_name))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        curs.close()
+    logger.info({
+        'action': 'migrate:migrate_table',
+        'table': table_name,
+        'rows': rows
+    })
+    return rows
+
+
+def migrate(conn):
+    '''
+    Migrates the tables of an older schema
+
+    Returns the number of migrated tables.
+    '''
+    if get_schema_version(conn) >= base.SCHEMA_VERSION:
+        return 0
+    tables = legacy_tables(conn)
+    for table_name, columns in tables:
+        migrate_table(conn, table_name, columns)
+    conn.execute('drop table if exists {}'.format(base.TABLE_NAME_OPTIMIZE_RESULTS))
+    conn.execute('pragma user_version = {:d}'.format(base.SCHEMA_VERSION))
+    conn.commit()
+    return len(tables)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Migrate the DB to the current schema')
+    parser.add_argument('db_name', nargs='?', default=config.Config.db_name)
+    args = parser.parse_args()
+
+    config.Config.db_name = args.db_name
+    with base.connect() as conn:
+        tables = migrate(conn)
+    print('{}: {} tables migrated (schema version {})'.format(args.db_name, tables, base.SCHEMA_VERSION))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+'''
+Parallel parameter optimization
+
+The grid of each indicator is split into tasks which are run by a process pool.
+Candle columns are passed to the workers through shared memory,
+and the DataFrameCandle of each worker refers to it without copying.
+Results are merged in the order of the serial search, so the parameters are
+the same as DataFrameCandle.optimize_params().
+With a search strategy (app.models.search), the search of each indicator is a task.
+'''
+import contextlib
+import os
+import threading
+import concurrent.futures
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from . import dfcandle
+from utils.logsettings import getLogger
+
+
+logger = getLogger(__name__)
+
+
+COLUMNS = ('time', 'open', 'close', 'high', 'low', 'volume')
+
+_executor = None
+_executor_workers = None
+_executor_lock = threading.Lock()
+
+# Data cached in a worker process: {'name': shared memory name, 'shm': SharedMemory, 'df': DataFrameCandle}
+_worker_cache = {}
+
+
+def get_context():
+    '''
+    Returns the multiprocessing context of the process pool
+
+    The workers are not forked from this process, which runs the streaming and trading threads
+    (a fork copies the locks held by them). They are forked from a forkserver which imports this module.
+    '''
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('spawn')
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload([__name__])
+    return context
+
+
+def get_executor(max_workers):
+    '''
+    Returns the process pool, which is reused while max_workers is unchanged
+    '''
+    global _executor, _executor_workers
+    with _executor_lock:
+        if _executor is None or _executor_workers != max_workers:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            _executor = concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, mp_context=get_context())
+            _executor_workers = max_workers
+        return _executor
+
+
+def to_columns(df:dfcandle.DataFrameCandle):
+    '''
+    Returns the columns of the candles as a (len(COLUMNS), length) float64 array
+
+    time is microseconds from the epoch.
+    '''
+    columns = np.empty((len(COLUMNS), df.length()))
+    columns[0] = df.columns['time'].view(np.int64)
+    for row, name in enumerate(COLUMNS[1:], 1):
+        columns[row] = df.columns[name]
+    return columns
+
+
+def from_columns(product_code, duration, columns):
+    '''
+    Returns DataFrameCandle of the columns made by to_columns
+
+    The price columns are views of the array (only time is converted).
+    '''
+    time = columns[0].astype(np.int64).view('datetime64[us]')
+    return dfcandle.DataFrameCandle.from_columns(product_code, duration, time, *columns[1:])
+
+
+def _get_dataframe(spec):
+    '''
+    Returns DataFrameCandle of the shared memory in a worker process
+
+    The DataFrameCandle refers to the shared memory directly,
+    which is kept attached until the next optimization run.
+    '''
+    if _worker_cache.get('name') != spec['name']:
+        if 'shm' in _worker_cache:
+            shm = _worker_cache.pop('shm')
+            del _worker_cache['df']
+            shm.close()
+        shm = shared_memory.SharedMemory(name=spec['name'])
+        columns = np.ndarray((len(COLUMNS), spec['length']), dtype=np.float64, buffer=shm.buf)
+        _worker_cache['name'] = spec['name']
+        _worker_cache['shm'] = shm
+        _worker_cache['df'] = from_columns(spec['product_code'], spec['duration'], columns)
+    return _worker_cache['df']
+
+
+def _run(spec, method, kwargs):
+    df = _get_dataframe(spec)
+    return getattr(df, method)(**kwargs)
+
+
+def tasks():
+    '''
+    Returns (indicator, method, kwargs) of the optimization tasks in the order of the serial search
+    '''
+    result = []
+    for period1 in dfcandle.EMA_PERIODS1:
+        result.append(('ema', 'optimize_ema', {'periods1': [period1]}))
+    for n in dfcandle.BB_NS:
+        result.append(('bb', 'optimize_bb', {'ns': [n]}))
+    for short_period in dfcandle.MACD_SHORT_PERIODS:
+        for long_period in dfcandle.MACD_LONG_PERIODS:
+            result.append(('macd', 'optimize_macd', {'short_periods': [short_period], 'long_periods': [long_period]}))
+    for period in dfcandle.RSI_PERIODS:
+        result.append(('rsi', 'optimize_rsi', {'periods': [period]}))
+    return result
+
+
+def merge(results):
+    '''
+    Merges the results of the tasks of an indicator in the order of the serial search
+
+    Like the serial search, only a strictly better performance replaces the best.
+    '''
+    best = results[0]
+    for result in results[1:]:
+        if best[0] < result[0]:
+            best = result
+    return best
+
+
+def search_tasks(strategy, max_workers):
+    '''
+    Returns (indicator, method, kwargs) of the search of each indicator by the strategy
+
+    The budget of the strategy is split among the searches, which max_workers processes run at the same time.
+    '''
+    strategies = strategy.split(len(dfcandle.SEARCH_SPACES), max_workers)
+    return [
+        (indicator, 'search', {'indicator': indicator, 'strategy': strategy})
+        for indicator, strategy in zip(dfcandle.SEARCH_SPACES, strategies)
+    ]
+
+
+@contextlib.contextmanager
+def shared(df:dfcandle.DataFrameCandle):
+    '''
+    Copies the candles to shared memory and yields the spec of it for the workers
+    '''
+    columns = to_columns(df)
+    shm = shared_memory.SharedMemory(create=True, size=max(columns.nbytes, 1))
+    try:
+        array = np.ndarray(columns.shape, dtype=np.float64, buffer=shm.buf)
+        array[:] = columns
+        del array
+        yield {
+            'name': shm.name,
+            'length': df.length(),
+            'product_code': df.product_code,
+            'duration': df.duration
+        }
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def optimize_params(df:dfcandle.DataFrameCandle, max_workers=None, strategy=None):
+    '''
+    Returns optimized trade parameters by the process pool
+
+    max_workers: the number of processes (None or 0: the number of CPUs)
+    strategy: the search strategy (None: the exhaustive grid search)
+    '''
+    max_workers = max_workers or os.cpu_count()
+    task_list = tasks() if strategy is None else search_tasks(strategy, max_workers)
+    with shared(df) as spec:
+        executor = get_executor(max_workers)
+        futures = [executor.submit(_run, spec, method, kwargs) for _, method, kwargs in task_list]
+        results = {'ema': [], 'bb': [], 'macd': [], 'rsi': []}
+        for (indicator, _, _), future in zip(task_list, futures):
+            results[indicator].append(future.result())
+
+    logger.debug({
+        'action': 'optimizer:optimize_params',
+        'workers': max_workers,
+        'tasks': len(task_list)
+    })
+    return df.rank_params(
+        merge(results['ema']), merge(results['bb']), merge(results['macd']), merge(results['rsi']))
@@ -0,0 +1,165 @@
+'''
+Persistent cache of optimized trade parameters
+
+Results of DataFrameCandle.optimize_params are stored in the DB, keyed by
+the product, duration, the first and last candle time, a hash of the candles
+and the search space (including the strategy and the ranking setting).
+A restart or a repeated optimization over the same candles returns the stored parameters.
+Old entries are evicted by age and count.
+'''
+import dataclasses
+import datetime
+import hashlib
+import json
+
+import numpy as np
+
+from config import config
+from utils.logsettings import getLogger
+from . import base, dfcandle
+
+
+logger = getLogger(__name__)
+
+
+TABLE_NAME_OPTIMIZE_RESULTS = base.TABLE_NAME_OPTIMIZE_RESULTS
+
+
+def content_hash(df:dfcandle.DataFrameCandle):
+    '''
+    Returns a hash of the candles
+    '''
+    h = hashlib.blake2b(digest_size=16)
+    for name in dfcandle.COLUMNS:
+        h.update(np.ascontiguousarray(df.columns[name]).tobytes())
+    return h.hexdigest()
+
+
+def search_space(strategy=None):
+    '''
+    Returns the description of the search as a JSON string
+    '''
+    space = {
+        'spaces': {indicator: {name: list(values) for name, values in params.items()}
+                   for indicator, params in dfcandle.SEARCH_SPACES.items()},
+        'num_ranking': config.Config.num_ranking,
+        'strategy': None
+    }
+    if strategy is not None:
+        space['strategy'] = {
+            'name': type(strategy).__name__,
+            'options': {k: v for k, v in strategy.__dict__.items() if k not in ('budget', 'best')},
+            'max_evals': strategy.budget.max_evals,
+            'max_seconds': strategy.budget.max_seconds
+        }
+    return json.dumps(space, sort_keys=True)
+
+
+def cache_key(df:dfcandle.DataFrameCandle, space):
+    times = df.columns['time']
+    key = {
+        'product_code': df.product_code,
+        'duration': df.duration,
+        'first_time': str(times[0]),
+        'last_time': str(times[-1]),
+        'content_hash': content_hash(df),
+        'search_space': hashlib.blake2b(space.encode(), digest_size=16).hexdigest()
+    }
+    return key
+
+
+def get(key):
+    '''
+    Returns (found, params)
+
+    params is None when the optimization found no profitable parameters.
+    '''
+    with base.connect() as conn:
+        curs = conn.cursor()
+        curs.execute(
+            '''
+            select params from {} where product_code = ? and duration = ? and first_time = ? and last_time = ?
+                and content_hash = ? and search_space = ?;
+            '''.format(TABLE_NAME_OPTIMIZE_RESULTS),
+            (key['product_code'], key['duration'], key['first_time'], key['last_time'],
+             key['content_hash'], key['search_space'])
+        )
+        row = curs.fetchone()
+        curs.close()
+    if row is None:
+        return False, None
+    params = json.loads(row[0])
+    if params is None:
+        return True, None
+    return True, dfcandle.TradeParams(**params)
+
+
+def put(key, params):
+    with base.connect() as conn:
+        curs = conn.cursor()
+        curs.execute(
+            '''
+            insert or replace into {} (product_code, duration, first_time, last_time, content_hash, search_space, params, created_at)
+            values (?, ?, ?, ?, ?, ?, ?, ?);
+            '''.format(TABLE_NAME_OPTIMIZE_RESULTS),
+            (key['product_code'], key['duration'], key['first_time'], key['last_time'],
+             key['content_hash'], key['search_space'],
+             json.dumps(dataclasses.asdict(params) if params else None),
+             base.to_epoch_ms(datetime.datetime.now(datetime.timezone.utc)))
+        )
+        conn.commit()
+        curs.close()
+
+
+def evict(max_entries, max_age):
+    '''
+    Deletes the entries older than max_age (datetime.timedelta) and all but the latest max_entries
+
+    Returns the number of deleted entries.
+    '''
+    deleted = 0
+    with base.connect() as conn:
+        curs = conn.cursor()
+        if max_age:
+            curs.execute(
+                'delete from {} where created_at < ?;'.format(TABLE_NAME_OPTIMIZE_RESULTS),
+                (base.to_epoch_ms(datetime.datetime.now(datetime.timezone.utc) - max_age),)
+            )
+            deleted += curs.rowcount
+        if max_entries:
+            curs.execute(
+                '''
+                delete from {0} where rowid not in (
+                    select rowid from {0} order by created_at desc, rowid desc limit ?
+                );
+                '''.format(TABLE_NAME_OPTIMIZE_RESULTS),
+                (max_entries,)
+            )
+            deleted += curs.rowcount
+        conn.commit()
+        curs.close()
+    return deleted
+
+
+def optimize_params(df:dfcandle.DataFrameCandle, max_workers=1, strategy=None):
+    '''
+    Returns df.optimize_params(max_workers, strategy), from the cache if the same candles were optimized
+    '''
+    max_entries = config.Config.optimize_cache_entries
+    if max_entries <= 0:
+        return df.optimize_params(max_workers, strategy)
+
+    key = cache_key(df, search_space(strategy))
+    found, params = get(key)
+    if found:
+        logger.debug({
+            'action': 'paramcache:optimize_params',
+            'status': 'hit',
+            'last_time': key['last_time']
+        })
+        return params
+
+    params = df.optimize_params(max_workers, strategy)
+    put(key, params)
+    evict(max_entries, datetime.timedelta(hours=config.Config.optimize_cache_hours))
+    return params
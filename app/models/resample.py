@@ -0,0 +1,206 @@
+'''
+Resampling of candles into durations without a table
+
+A duration which is not in config.Config.durations (e.g. 3m, 15m, 4h, 1w) is built from
+the coarsest stored duration which divides it (e.g. 15m from 1m, 4h from 1h, 1w from 1d)
+by a group-by of the candles over the time buckets with numpy.
+Results are kept in an LRU cache keyed by (product_code, duration, range), and an entry
+is recomputed once a candle of its source duration is written (see Candle.create / save).
+Stored durations are read from their tables as before.
+'''
+import collections
+import datetime
+import threading
+
+import numpy as np
+
+from config import config
+from . import base, candle, dfcandle
+
+
+def duration_delta(duration):
+    '''
+    Returns timedelta of the duration
+    '''
+    delta = config.Config.durations.get(duration)
+    if delta is None:
+        delta = config.parse_duration(duration)
+    return delta
+
+
+def source_duration(duration):
+    '''
+    Returns the stored duration which the candles of the duration are built from
+    '''
+    if duration in config.Config.durations:
+        return duration
+    delta = duration_delta(duration)
+    sources = [d for d, source in config.Config.durations.items() if source <= delta and not delta % source]
+    if not sources:
+        raise ValueError('{} can not be built from {}'.format(duration, ', '.join(config.Config.durations)))
+    return max(sources, key=lambda d: config.Config.durations[d])
+
+
+def group(times, delta:datetime.timedelta):
+    '''
+    Returns (bucket times, start index of each bucket) of the sorted epoch milliseconds
+    '''
+    bucket_times = base.truncate_epoch_ms(times, delta)
+    starts = np.flatnonzero(np.diff(bucket_times)) + 1
+    if len(bucket_times):
+        starts = np.concatenate([[0], starts])
+    return bucket_times[starts], starts
+
+
+def rollup(candles, delta:datetime.timedelta):
+    '''
+    Returns the candles of the duration of the candles (or ticks) {column: array} in time order
+
+    time is epoch milliseconds.
+    '''
+    times = candles['time']
+    bucket_times, starts = group(times, delta)
+    ends = np.append(starts[1:], len(times)) - 1
+    return {
+        'time': bucket_times,
+        'open': candles['open'][starts],
+        'close': candles['close'][ends],
+        'high': np.maximum.reduceat(candles['high'], starts),
+        'low': np.minimum.reduceat(candles['low'], starts),
+        'volume': np.add.reduceat(candles['volume'], starts)
+    }
+
+
+def resample(df:'dfcandle.DataFrameCandle', duration):
+    '''
+    Returns DataFrameCandle of the duration built from the candles of df
+    '''
+    columns = dict(df.columns)
+    columns['time'] = columns['time'].astype('datetime64[ms]').astype(np.int64)
+    if not len(columns['time']):
+        return dfcandle.DataFrameCandle(df.product_code, duration)
+    candles = rollup(columns, duration_delta(duration))
+    candles['time'] = candles['time'].astype('datetime64[ms]')
+    return dfcandle.DataFrameCandle.from_columns(
+        df.product_code, duration, *(candles[name] for name in dfcandle.COLUMNS))
+
+
+class ResampleCache(object):
+    '''
+    LRU cache of resampled candles
+
+    Each (product_code, source duration) has a version, which is incremented by a write of its candles.
+    An entry made with an older version is not returned.
+    The entries are dropped when config.Config.db_name changes or candles are imported into the DB.
+    '''
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = collections.OrderedDict()   # {key: (version, columns)}
+        self.versions = {}
+        self.generation = None
+        self.lock = threading.Lock()
+
+        # Statistics
+        self.hits = 0
+        self.misses = 0
+
+    def version(self, product_code, duration):
+        with self.lock:
+            generation = base.cache_generation()
+            if self.generation != generation:
+                self.entries.clear()
+                self.generation = generation
+            return self.versions.get((product_code, duration), 0)
+
+    def invalidate(self, product_code, duration):
+        if self.maxsize <= 0:
+            return
+        key = (product_code, duration)
+        with self.lock:
+            self.versions[key] = self.versions.get(key, 0) + 1
+
+    def get(self, key, version):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, version, columns):
+        if self.maxsize <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (version, columns)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self.entries)
+        }
+
+
+CACHE = ResampleCache(config.Config.resample_cache_size)
+
+
+def invalidate(product_code, duration):
+    CACHE.invalidate(product_code, duration)
+
+
+def _cached(product_code, duration, source, key, load):
+    '''
+    Returns DataFrameCandle of the cached columns, or of the columns resampled from load()
+    '''
+    version = CACHE.version(product_code, source)
+    columns = CACHE.get(key, version)
+    if columns is None:
+        df = load()
+        if not df:
+            return
+        columns = resample(df, duration).columns
+        CACHE.put(key, version, columns)
+    if not len(columns['time']):
+        return
+    # A new DataFrameCandle for each caller (indicators are added to it), sharing the columns
+    return dfcandle.DataFrameCandle(product_code, duration, columns=columns)
+
+
+def get_all_candles(product_code, duration, limit):
+    '''
+    Returns the latest candles of any duration (see candle.get_all_candles)
+    '''
+    source = source_duration(duration)
+    if source == duration:
+        return candle.get_all_candles(product_code, duration, limit)
+    ratio = duration_delta(duration) // config.Config.durations[source]
+
+    # The first bucket may lack some candles, so the candles of another bucket are read
+    df = _cached(product_code, duration, source, (product_code, duration, ('latest', limit)),
+                 lambda: candle.get_all_candles(product_code, source, (limit + 1) * ratio))
+    if df is not None and df.length() > limit:
+        df = df.tail(limit)
+    return df
+
+
+def get_candles_after_time(product_code, duration, time:datetime.datetime):
+    '''
+    Returns the candles of any duration whose time is equal to or after the time (see candle.get_candles_after_time)
+    '''
+    source = source_duration(duration)
+    if source == duration:
+        return candle.get_candles_after_time(product_code, duration, time)
+    start = base.from_epoch_ms(base.truncate_epoch_ms(base.to_epoch_ms(time), duration_delta(duration)))
+    if start < time:
+        start += duration_delta(duration)
+    return _cached(product_code, duration, source, (product_code, duration, ('after', start)),
+                   lambda: candle.get_candles_after_time(product_code, source, start))
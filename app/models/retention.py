@@ -0,0 +1,225 @@
+'''
+Retention of the candles
+
+    python -m app.models.retention [db_name] [--vacuum]
+
+A background thread exports the closed candles to the archive (see app.models.archive)
+if config.Config.db_archive_dir is set, and deletes the candles older than the newest candle
+minus the kept candles of each duration (config.Config.db_retention), every interval seconds.
+Candles are deleted in batches of batch_size rows, each in its own short transaction,
+so that the writer (see app.models.writer) is not blocked for long.
+After the deletes, up to vacuum_pages free pages are returned to the file system
+(the DB must be in auto_vacuum = incremental mode, see base.init), and ANALYZE is run
+every analyze_interval seconds.
+
+--vacuum converts an existing DB to auto_vacuum = incremental (the application must be stopped).
+'''
+import argparse
+import datetime
+import sqlite3
+import threading
+import time
+
+from config import config
+from utils.logsettings import getLogger
+from . import archive, base, hotcache
+
+
+logger = getLogger(__name__)
+
+
+# pragma auto_vacuum
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+class Retention(object):
+    def __init__(self, product_code, policies, interval=60, batch_size=1000, vacuum_pages=1000, analyze_interval=3600,
+                 archive_dir=None):
+        self.product_code = product_code
+        self.policies = policies        # {duration: candles kept (0: all)}
+        self.archive_dir = archive_dir  # candles are archived before they are deleted (None: not archived)
+        self.interval = interval
+        self.batch_size = batch_size
+        self.vacuum_pages = vacuum_pages
+        self.analyze_interval = analyze_interval
+        self.thread = None
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+        self.last_analyze = None
+
+        # Statistics
+        self.runs = 0
+        self.archived = 0
+        self.deleted = 0
+        self.vacuumed = 0
+        self.analyzed = 0
+        self.errors = 0
+        self.seconds = 0.0
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.stopped.clear()
+                self.thread = threading.Thread(target=self.run)
+                self.thread.setDaemon(True)
+                self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def stats(self):
+        return {
+            'runs': self.runs,
+            'archived': self.archived,
+            'deleted': self.deleted,
+            'vacuumed': self.vacuumed,
+            'analyzed': self.analyzed,
+            'errors': self.errors,
+            'seconds': self.seconds
+        }
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.run_once()
+            except sqlite3.Error as e:
+                self.errors += 1
+                logger.error({
+                    'action': 'Retention:run',
+                    'error': e
+                })
+
+    def run_once(self):
+        '''
+        Deletes the old candles, vacuums and analyzes (if due) the DB
+
+        Returns {'archived': {duration: rows}, 'deleted': {duration: rows}, 'vacuumed': pages,
+        'analyzed': bool, 'seconds': float}.
+        '''
+        start = time.monotonic()
+        archived = {}
+        deleted = {}
+        for duration, keep in self.policies.items():
+            if self.archive_dir:
+                try:
+                    archived[duration] = archive.export(self.product_code, duration, directory=self.archive_dir)
+                except (OSError, ValueError) as e:
+                    # The candles are kept until they are archived
+                    self.errors += 1
+                    logger.error({
+                        'action': 'Retention:run_once',
+                        'duration': duration,
+                        'error': e
+                    })
+                    continue
+            if keep > 0:
+                deleted[duration] = self.delete_old_candles(duration, keep)
+        vacuumed = self.vacuum()
+        analyzed = False
+        if self.last_analyze is None or start - self.last_analyze >= self.analyze_interval:
+            self.analyze()
+            self.last_analyze = start
+            analyzed = True
+        seconds = time.monotonic() - start
+
+        self.runs += 1
+        self.archived += sum(archived.values())
+        self.deleted += sum(deleted.values())
+        self.vacuumed += vacuumed
+        self.analyzed += analyzed
+        self.seconds += seconds
+        result = {
+            'archived': archived,
+            'deleted': deleted,
+            'vacuumed': vacuumed,
+            'analyzed': analyzed,
+            'seconds': seconds
+        }
+        logger.info(dict({'action': 'Retention:run_once'}, **result))
+        return result
+
+    def delete_old_candles(self, duration, keep):
+        '''
+        Deletes the candles before the latest keep candles in batches
+
+        Returns the number of deleted candles.
+        '''
+        table_name = base.get_candle_table_name(self.product_code, duration)
+        step = config.Config.durations[duration] // datetime.timedelta(milliseconds=1)
+        deleted = 0
+        with base.connect() as conn:
+            latest = conn.execute('select max(time) from {}'.format(table_name)).fetchone()[0]
+            if latest is None:
+                return 0
+            limit_time = latest - step * (keep - 1)
+            hotcache.CACHE.discard_before(self.product_code, duration, limit_time)
+            while True:
+                with conn:
+                    rows = conn.execute(
+                        '''
+                        delete from {0} where time in (
+                            select time from {0} where time < ? order by time limit ?
+                        );
+                        '''.format(table_name),
+                        (limit_time, self.batch_size)
+                    ).rowcount
+                deleted += rows
+                if rows < self.batch_size or self.stopped.is_set():
+                    return deleted
+
+    def vacuum(self):
+        '''
+        Returns up to vacuum_pages free pages to the file system
+
+        Returns the number of the returned pages.
+        '''
+        with base.connect() as conn:
+            if conn.execute('pragma auto_vacuum').fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+                return 0
+            before = conn.execute('pragma freelist_count').fetchone()[0]
+            if before == 0:
+                return 0
+            # execute() stops the pragma after the first page, executescript() runs it to the end
+            conn.executescript('pragma incremental_vacuum({:d})'.format(self.vacuum_pages))
+            return before - conn.execute('pragma freelist_count').fetchone()[0]
+
+    def analyze(self):
+        with base.connect() as conn:
+            conn.execute('analyze')
+            conn.commit()
+
+
+RETENTION = Retention(
+    config.Config.product_code,
+    config.Config.db_retention,
+    config.Config.db_retention_interval,
+    config.Config.db_retention_batch_size,
+    config.Config.db_vacuum_pages,
+    config.Config.db_analyze_interval,
+    config.Config.db_archive_dir
+)
+
+
+def start():
+    RETENTION.start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Delete old candles and vacuum the DB')
+    parser.add_argument('db_name', nargs='?', default=config.Config.db_name)
+    parser.add_argument('--vacuum', action='store_true', help='convert the DB to auto_vacuum = incremental')
+    args = parser.parse_args()
+
+    config.Config.db_name = args.db_name
+    base.init()
+    if args.vacuum:
+        with base.connect() as conn:
+            conn.execute('pragma auto_vacuum = incremental')
+            conn.execute('vacuum')
+    print('{}: {}'.format(args.db_name, RETENTION.run_once()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,307 @@
+'''
+Search strategies of trade parameters
+
+A search space is a dict of parameter name -> candidate values (in order).
+A strategy calls objective(params, fraction) with params as a dict
+and returns the best (performance, params).
+objective returns the performance of the parameters on the latest fraction of the candles
+(None if they never trade).
+
+Like the grid search of DataFrameCandle, only a performance which is strictly better than
+the best so far (starting from 0.0) is taken, so (0.0, None) means nothing made a profit.
+Every evaluation is counted by the budget, and the search stops when the budget runs out.
+'''
+import abc
+import copy
+import itertools
+import math
+import random
+import time
+
+
+class Budget(object):
+    '''
+    Limits of a search (None: no limit)
+    '''
+    def __init__(self, max_evals=None, max_seconds=None):
+        self.max_evals = max_evals
+        self.max_seconds = max_seconds
+        self.evals = 0
+        self.started = None
+
+    def start(self):
+        self.evals = 0
+        self.started = time.monotonic()
+
+    def spend(self):
+        self.evals += 1
+
+    def split(self, parts, concurrency=1):
+        '''
+        Returns the budgets of parts searches which are within this budget in total
+
+        concurrency: the number of the searches run at the same time (max_seconds is the wall time)
+        '''
+        waves = -(-parts // max(concurrency, 1))
+        budgets = []
+        for i in range(parts):
+            max_evals = None if self.max_evals is None else self.max_evals // parts + (i < self.max_evals % parts)
+            max_seconds = None if self.max_seconds is None else self.max_seconds / waves
+            budgets.append(Budget(max_evals, max_seconds))
+        return budgets
+
+    def exhausted(self):
+        if self.max_evals is not None and self.evals >= self.max_evals:
+            return True
+        if self.max_seconds is not None and time.monotonic() - self.started >= self.max_seconds:
+            return True
+        return False
+
+
+class Search(abc.ABC):
+    '''
+    Base class of the search strategies
+    '''
+    def __init__(self, budget=None):
+        self.budget = budget or Budget()
+
+    def run(self, space, objective):
+        '''
+        Returns the best (performance, params) in the space
+        '''
+        self.budget.start()
+        self.best = (0.0, None)
+        self.search(space, objective)
+        return self.best
+
+    @abc.abstractmethod
+    def search(self, space, objective):
+        '''
+        Evaluates params of the space until the budget runs out (the best is kept by evaluate)
+        '''
+
+    def split(self, parts, concurrency=1):
+        '''
+        Returns copies of the strategy for parts searches, which share the budget (see Budget.split)
+        '''
+        strategies = []
+        for budget in self.budget.split(parts, concurrency):
+            strategy = copy.copy(self)
+            strategy.budget = budget
+            strategies.append(strategy)
+        return strategies
+
+    def evaluate(self, objective, params, fraction=1.0, force=False):
+        '''
+        Returns the performance of the params (None if the budget has run out)
+
+        force: evaluates the params even if the budget has run out
+        '''
+        if self.budget.exhausted() and not force:
+            return None
+        self.budget.spend()
+        performance = objective(params, fraction)
+        if fraction >= 1.0 and performance is not None and self.best[0] < performance:
+            self.best = (performance, params)
+        return performance
+
+
+def grid_size(space):
+    return math.prod(len(values) for values in space.values())
+
+
+def grid_point(space, index):
+    '''
+    Returns the params at the index of the grid (in the order of itertools.product)
+    '''
+    params = {}
+    for name, values in reversed(list(space.items())):
+        index, i = divmod(index, len(values))
+        params[name] = values[i]
+    return {name: params[name] for name in space}
+
+
+def _key(performance):
+    return -math.inf if performance is None else performance
+
+
+class Exhaustive(Search):
+    '''
+    Evaluates every point of the grid in order
+    '''
+    def search(self, space, objective):
+        for values in itertools.product(*space.values()):
+            if self.budget.exhausted():
+                return
+            self.evaluate(objective, dict(zip(space, values)))
+
+
+class RandomSearch(Search):
+    '''
+    Evaluates points of the grid sampled at random without replacement
+
+    samples: the number of points (None: until the budget runs out or the grid is covered)
+    '''
+    def __init__(self, budget=None, samples=None, seed=None):
+        super().__init__(budget)
+        self.samples = samples
+        self.seed = seed
+
+    def search(self, space, objective):
+        rand = random.Random(self.seed)
+        size = grid_size(space)
+        samples = size if self.samples is None else min(self.samples, size)
+        seen = set()
+        while len(seen) < samples and not self.budget.exhausted():
+            index = rand.randrange(size)
+            if index in seen:
+                continue
+            seen.add(index)
+            self.evaluate(objective, grid_point(space, index))
+
+
+class SuccessiveHalving(Search):
+    '''
+    Evaluates the candidates on the latest min_fraction of the candles first,
+    and promotes the best 1/eta of them to eta times longer candles until all the candles are used
+
+    samples: the number of the first candidates sampled at random (None: the whole grid)
+    With max_evals, the first candidates are sampled so that every round fits in the budget.
+    If the budget runs out before the last round (e.g. by max_seconds), the best candidate
+    of the last finished round is evaluated on all the candles anyway.
+    '''
+    def __init__(self, budget=None, min_fraction=1/8, eta=2, samples=None, seed=None):
+        super().__init__(budget)
+        self.min_fraction = min_fraction
+        self.eta = eta
+        self.samples = samples
+        self.seed = seed
+
+    def cost(self, candidates):
+        '''
+        Returns the number of evaluations of the rounds from the candidates
+        '''
+        evals = 0
+        fraction = self.min_fraction
+        while fraction < 1.0 and candidates > 1:
+            evals += candidates
+            candidates = max(1, math.ceil(candidates / self.eta))
+            fraction *= self.eta
+        return evals + candidates
+
+    def affordable(self, size):
+        '''
+        Returns the most candidates (at least 1) whose rounds fit in the evaluations left of the budget
+        '''
+        if self.budget.max_evals is None:
+            return size
+        left = self.budget.max_evals - self.budget.evals
+        low, high = 1, size
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.cost(middle) <= left:
+                low = middle
+            else:
+                high = middle - 1
+        return low
+
+    def search(self, space, objective):
+        size = grid_size(space)
+        samples = self.affordable(size if self.samples is None else min(self.samples, size))
+        if samples >= size:
+            indices = range(size)
+        else:
+            indices = sorted(random.Random(self.seed).sample(range(size), samples))
+        candidates = [grid_point(space, index) for index in indices]
+
+        leader = None   # the best candidate of the last finished round
+        fraction = self.min_fraction
+        while fraction < 1.0 and len(candidates) > 1:
+            performances = []
+            for params in candidates:
+                if self.budget.exhausted():
+                    break
+                performances.append(self.evaluate(objective, params, fraction))
+            ranked = sorted(
+                range(len(performances)), key=lambda i: _key(performances[i]), reverse=True)
+            if len(performances) < len(candidates):
+                # Out of budget
+                if leader is None:
+                    leader = candidates[ranked[0]] if ranked else candidates[0]
+                candidates = [leader]
+                break
+            leader = candidates[ranked[0]]
+            keep = max(1, math.ceil(len(candidates) / self.eta))
+            candidates = [candidates[i] for i in sorted(ranked[:keep])]
+            fraction *= self.eta
+
+        for i, params in enumerate(candidates):
+            # At least one candidate is evaluated on all the candles
+            if not self.evaluate(objective, params, force=i == 0) and self.budget.exhausted():
+                return
+
+
+class CoordinateDescent(Search):
+    '''
+    Moves along one parameter at a time to its best value with the others fixed,
+    until a round over all the parameters makes no move
+
+    start: the first params (default: the middle of each parameter)
+    rounds: the maximum number of rounds (None: no limit)
+    '''
+    def __init__(self, budget=None, start=None, rounds=None):
+        super().__init__(budget)
+        self.start = start
+        self.rounds = rounds
+
+    def search(self, space, objective):
+        if self.start is None:
+            current = {name: values[len(values) // 2] for name, values in space.items()}
+        else:
+            current = dict(self.start)
+        performances = {}
+
+        def evaluate(params):
+            key = tuple(params.values())
+            if key not in performances:
+                performances[key] = self.evaluate(objective, params)
+            return performances[key]
+
+        current_performance = evaluate(current)
+        for _ in itertools.count() if self.rounds is None else range(self.rounds):
+            moved = False
+            for name, values in space.items():
+                for value in values:
+                    if self.budget.exhausted():
+                        return
+                    params = dict(current, **{name: value})
+                    performance = evaluate(params)
+                    if _key(current_performance) < _key(performance):
+                        current, current_performance = params, performance
+                        moved = True
+            if not moved:
+                return
+
+
+STRATEGIES = {
+    'exhaustive': Exhaustive,
+    'random': RandomSearch,
+    'halving': SuccessiveHalving,
+    'coordinate': CoordinateDescent
+}
+
+
+def get_strategy(name, max_evals=0, max_seconds=0):
+    '''
+    Returns the search strategy of the name
+
+    max_evals, max_seconds: the budget of the optimization of all the indicators in total (0: no limit)
+    Returns None for the exhaustive search without budget,
+    which is done by the optimize_* methods of DataFrameCandle (and can run on the process pool).
+    '''
+    if name not in STRATEGIES:
+        raise ValueError('Unknown search strategy: {}'.format(name))
+    if name == 'exhaustive' and not max_evals and not max_seconds:
+        return None
+    budget = Budget(max_evals or None, max_seconds or None)
+    return STRATEGIES[name](budget)
@@ -1,6 +1,57 @@
 '''
 買い, 売りを判断するトレードクラス
+
+should_buy / should_sell judge one index (live trading).
+signals(df) returns the boolean arrays of buy / sell signals of all the indices at once (back test).
+A NaN (None) value makes every comparison False, so it never signals.
 '''
+import numpy as np
+
+
+def _array(values, length):
+    '''
+    Returns values as a float64 array of the length (None and missing values are NaN)
+    '''
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) >= length:
+        return values[:length]
+    return np.concatenate((values, np.full(length - len(values), np.nan)))
+
+
+def _signals(start, conditions):
+    '''
+    Returns a boolean array of the signals
+
+    conditions are of the indices from 1, and the indices before start never signal.
+    '''
+    result = np.zeros(len(conditions) + 1, dtype=bool)
+    result[1:] = conditions
+    result[:start] = False
+    return result
+
+
+def fills(buy, sell):
+    '''
+    Returns the indices of the trades (BUY, SELL, BUY, ...) of the signal arrays
+
+    Like SignalEvents, it buys only without a position and sells only with one,
+    and one index makes at most one trade.
+    '''
+    buys = np.flatnonzero(buy)
+    sells = np.flatnonzero(sell)
+    result = []
+    index = 0
+    holding = False
+    while True:
+        indices = sells if holding else buys
+        j = np.searchsorted(indices, index)
+        if j == len(indices):
+            break
+        result.append(int(indices[j]))
+        index = indices[j] + 1
+        holding = not holding
+    return result
+
 
 class TradeEma(object):
     def __init__(self, value1, value2, period1, period2):
@@ -27,6 +78,15 @@ class TradeEma(object):
             return True
         return False
 
+    def signals(self, df):
+        length = df.length()
+        value1 = _array(self.value1, length)
+        value2 = _array(self.value2, length)
+        start = max(self.period1, self.period2)
+        buy = _signals(start, (value1[:-1] < value2[:-1]) & (value1[1:] >= value2[1:]))
+        sell = _signals(start, (value1[:-1] > value2[:-1]) & (value1[1:] <= value2[1:]))
+        return buy, sell
+
 class TradeBb(object):
     def __init__(self, up, mid, down, n, k):
         self.up = up
@@ -53,6 +113,15 @@ class TradeBb(object):
             return True
         return False
 
+    def signals(self, df):
+        length = df.length()
+        up = _array(self.up, length)
+        down = _array(self.down, length)
+        closes = df.closes()
+        buy = _signals(self.n, (down[:-1] > closes[:-1]) & (down[1:] <= closes[1:]))
+        sell = _signals(self.n, (up[:-1] < closes[:-1]) & (up[1:] >= closes[1:]))
+        return buy, sell
+
 class TradeIchimoku(object):
     def __init__(self, tenkan, base, pre1, pre2, delay):
         self.tenkan = tenkan
@@ -91,6 +160,21 @@ class TradeIchimoku(object):
             return True
         return False
 
+    def signals(self, df):
+        length = df.length()
+        tenkan = _array(self.tenkan, length)[1:]
+        base = _array(self.base, length)[1:]
+        pre1 = _array(self.pre1, length)[1:]
+        pre2 = _array(self.pre2, length)[1:]
+        delay = _array(self.delay, length)
+        highs = df.highs()
+        lows = df.lows()[1:]
+        buy = _signals(52, (delay[:-1] < highs[:-1]) & (delay[1:] >= highs[1:])
+                       & (pre1 < lows) & (pre2 < lows) & (tenkan > base))
+        sell = _signals(52, (delay[:-1] > highs[:-1]) & (delay[1:] <= highs[1:])
+                        & (pre1 > lows) & (pre2 > lows) & (tenkan < base))
+        return buy, sell
+
 class TradeMacd(object):
     def __init__(self, macd, signal, histogram, short_period, long_period, signal_period):
         self.macd = macd
@@ -118,6 +202,17 @@ class TradeMacd(object):
             return True
         return False
 
+    def signals(self, df):
+        length = df.length()
+        macd = _array(self.macd, length)[1:]
+        signal = _array(self.signal, length)[1:]
+        histogram = _array(self.histogram, length)
+        buy = _signals(self.long_period,
+                       (macd < 0) & (signal < 0) & (histogram[:-1] < 0) & (histogram[1:] >= 0))
+        sell = _signals(self.long_period,
+                        (macd > 0) & (signal > 0) & (histogram[:-1] > 0) & (histogram[1:] <= 0))
+        return buy, sell
+
 class TradeRsi(object):
     def __init__(self, value, period, buy_thread, sell_thread):
         self.value = value
@@ -141,4 +236,10 @@ class TradeRsi(object):
             return False
         if self.value[index-1] > self.sell_thread and self.value[index] <= self.sell_thread:
             return True
-        return False
\ No newline at end of file
+        return False
+
+    def signals(self, df):
+        value = _array(self.value, df.length())
+        buy = _signals(self.preiod, (value[:-1] < self.buy_thread) & (value[1:] >= self.buy_thread))
+        sell = _signals(self.preiod, (value[:-1] > self.sell_thread) & (value[1:] <= self.sell_thread))
+        return buy, sell
@@ -0,0 +1,258 @@
+'''
+Write-behind queue of the DB
+
+Writes (sql, params) are queued by the callers and executed by a writer thread.
+Consecutive writes of the same sql are grouped into executemany,
+and a batch of up to batch_size writes (or the writes queued within flush_interval seconds)
+is committed in a single transaction.
+When the queue is full, submit() blocks until the writer catches up (backpressure).
+A failed batch is retried (see write_batch); a write which keeps failing is dropped and counted in errors.
+
+A write may have a pending row (table, key, row), which is kept in memory until it is committed.
+Readers merge pending_rows(table) into the rows read from the DB (see merge_rows), so they see
+every write queued before without waiting for the disk.
+flush() waits until the writes queued before it are committed (e.g. for the retention and tests).
+'''
+import atexit
+import queue
+import sqlite3
+import threading
+import time
+
+from config import config
+from utils.logsettings import getLogger
+from . import base
+
+
+logger = getLogger(__name__)
+
+
+# Marker which makes the writer thread write the current batch at once
+_FLUSH = object()
+
+
+class Writer(object):
+    def __init__(self, batch_size=500, flush_interval=0.5, max_queue=10000, retries=3, retry_interval=0.1):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retries = retries
+        self.retry_interval = retry_interval
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.thread = None
+        self.lock = threading.Lock()
+
+        # Rows of the writes which are not committed yet {table: {key: (sequence number, row)}}
+        self.pending = {}
+        self.submitted = 0
+        self.processed = 0
+        self.processed_cond = threading.Condition()
+
+        # Statistics
+        self.written = 0
+        self.batches = 0
+        self.errors = 0         # writes dropped
+        self.retried = 0
+        self.blocked = 0
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+
+    def submit(self, sql, params, pending=None):
+        '''
+        Queues a write (blocks while the queue is full)
+
+        pending: (table, key, row) which readers see until the write is committed
+        '''
+        if self.thread is None or not self.thread.is_alive():
+            self.start()
+        with self.processed_cond:
+            self.submitted += 1
+            seq = self.submitted
+            if pending is not None:
+                table, key, row = pending
+                self.pending.setdefault(table, {})[key] = (seq, row)
+        if self.queue.full():
+            self.blocked += 1
+            logger.warning({
+                'action': 'Writer:submit',
+                'status': 'queue is full',
+                'depth': self.depth()
+            })
+        self.queue.put((seq, sql, params, pending))
+
+    def pending_rows(self, table):
+        '''
+        Returns {key: row} of the writes of the table which are not committed yet
+        '''
+        with self.processed_cond:
+            rows = self.pending.get(table)
+            return {key: row for key, (_, row) in rows.items()} if rows else {}
+
+    def depth(self):
+        '''
+        The number of queued writes
+        '''
+        return self.queue.qsize()
+
+    def flush(self):
+        '''
+        Waits until the writes queued before are committed
+
+        Writes queued by other threads while waiting are not waited for.
+        '''
+        if self.thread is None or not self.thread.is_alive():
+            return
+        with self.processed_cond:
+            seq = self.submitted
+            if self.processed >= seq:
+                return
+        self.queue.put(_FLUSH)
+        with self.processed_cond:
+            self.processed_cond.wait_for(lambda: self.processed >= seq or not self.thread.is_alive())
+
+    def stats(self):
+        return {
+            'depth': self.depth(),
+            'written': self.written,
+            'batches': self.batches,
+            'errors': self.errors,
+            'retried': self.retried,
+            'blocked': self.blocked
+        }
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while batch[-1] is not _FLUSH and len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            items = [item for item in batch if item is not _FLUSH]
+            try:
+                self.write_batch([(sql, params) for _, sql, params, _ in items])
+            except Exception as e:
+                # The thread keeps running (the writes are dropped)
+                self.errors += len(items)
+                logger.error({
+                    'action': 'Writer:run',
+                    'rows': len(items),
+                    'error': e
+                })
+            finally:
+                self.done(items)
+                for _ in batch:
+                    self.queue.task_done()
+
+    def done(self, items):
+        '''
+        Removes the pending rows of the processed writes
+        '''
+        with self.processed_cond:
+            for seq, _, _, pending in items:
+                if pending is not None:
+                    rows = self.pending.get(pending[0])
+                    # A later write of the key stays pending
+                    if rows is not None and rows.get(pending[1], (None,))[0] == seq:
+                        del rows[pending[1]]
+            self.processed += len(items)
+            self.processed_cond.notify_all()
+
+    def write_batch(self, items):
+        '''
+        Writes the batch, retrying it when it fails
+
+        If it still fails, the writes are retried one by one and only the failing ones are dropped.
+        '''
+        for attempt in range(self.retries + 1):
+            if self.write(items):
+                return
+            if attempt < self.retries:
+                self.retried += 1
+                time.sleep(self.retry_interval * 2 ** attempt)
+        if len(items) == 1:
+            self.errors += 1
+            logger.error({
+                'action': 'Writer:write_batch',
+                'status': 'dropped',
+                'sql': items[0][0]
+            })
+            return
+        for item in items:
+            self.write_batch([item])
+
+    def write(self, items):
+        '''
+        Executes the writes in a transaction, grouping consecutive ones of the same sql
+
+        Returns whether they are committed.
+        '''
+        if not items:
+            return True
+        groups = []
+        for sql, params in items:
+            if groups and groups[-1][0] == sql:
+                groups[-1][1].append(params)
+            else:
+                groups.append((sql, [params]))
+
+        try:
+            with base.connect() as conn, conn:
+                for sql, rows in groups:
+                    conn.executemany(sql, rows)
+        except sqlite3.Error as e:
+            logger.warning({
+                'action': 'Writer:write',
+                'rows': len(items),
+                'error': e
+            })
+            return False
+        self.written += len(items)
+        self.batches += 1
+        logger.debug({
+            'action': 'Writer:write',
+            'rows': len(items),
+            'statements': len(groups),
+            'depth': self.depth()
+        })
+        return True
+
+
+WRITER = Writer(
+    config.Config.db_write_batch_size, config.Config.db_write_interval, config.Config.db_write_queue_size,
+    config.Config.db_write_retries, config.Config.db_write_retry_interval
+)
+atexit.register(WRITER.flush)
+
+
+def submit(sql, params, pending=None):
+    WRITER.submit(sql, params, pending)
+
+
+def flush():
+    WRITER.flush()
+
+
+def pending_rows(table):
+    return WRITER.pending_rows(table)
+
+
+def merge_rows(rows, pending, reverse=False, limit=None):
+    '''
+    Returns the rows (ordered by their first column) with the pending rows {key: row} merged
+
+    A pending row replaces the row of the same key (the first column).
+    '''
+    if not pending:
+        return rows
+    merged = {row[0]: tuple(row) for row in rows}
+    merged.update(pending)
+    rows = sorted(merged.values(), key=lambda row: row[0], reverse=reverse)
+    return rows if limit is None else rows[:limit]
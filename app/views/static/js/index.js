@@ -58,11 +58,13 @@ let candleDataTable;
 
 // DateTimeFormat
 function dateTimeFormatByDuration(duration) {
-    switch (duration) {
-        case '1s': return 'm:ss';
-        case '1m': return 'H:mm';
-        case '1h': return 'd H';
-        case '1d': return 'M d';
+    // 単位 (e.g. 5m -> m)
+    switch (duration.slice(-1)) {
+        case 's': return 'm:ss';
+        case 'm': return 'H:mm';
+        case 'h': return 'd H';
+        case 'd': return 'M d';
+        case 'w': return 'M d';
     }
 }
 
@@ -24,7 +24,9 @@ def create_app():
 
     return app
 
-app = create_app()
+# The worker processes of the optimizer import this module as __mp_main__ (see app.models.optimizer)
+if __name__ != '__mp_main__':
+    app = create_app()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,478 @@
+'''
+asyncio client of bitFlyer Lightning API
+
+    async with aio.AsyncAPIClient(key, secret) as client:
+        balances = await client.get_balance()
+        async for ticker in client.subscribe_ticker('BTC_JPY'):
+            ...
+
+The same operations as bitflyer.APIClient as coroutines, built on asyncio streams:
+REST requests are sent over a pool of kept-alive HTTP/1.1 connections (with the retry policy
+of APIClient), and realtime tickers are read from the JSON-RPC websocket in the event loop,
+so many requests and subscriptions run on one loop without a thread per stream.
+'''
+import asyncio
+import base64
+import dataclasses
+import hashlib
+import json
+import os
+import random
+import ssl
+import struct
+import urllib.parse
+
+from config import config
+from utils.logsettings import getLogger
+from . import bitflyer
+
+
+logger = getLogger(__name__)
+
+
+# WebSocket opcodes
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xa
+
+WEBSOCKET_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC11D3B'
+
+
+class ConnectionClosed(ConnectionError):
+    pass
+
+
+@dataclasses.dataclass
+class Response(object):
+    '''
+    Response of a REST request
+    '''
+    status_code: int
+    headers: dict
+    content: bytes
+
+    def json(self):
+        return json.loads(self.content)
+
+
+def address(url, default_ports):
+    '''
+    Returns (host, port, ssl context or None) of the url
+    '''
+    u = urllib.parse.urlparse(url)
+    secure = u.scheme in ('https', 'wss')
+    port = u.port or default_ports[secure]
+    return u.hostname, port, ssl.create_default_context() if secure else None
+
+
+async def read_headers(reader):
+    '''
+    Returns {lower name: value} of the header lines
+    '''
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if not line:
+            raise ConnectionClosed('Connection closed in the headers')
+        line = line.decode('latin-1').rstrip('\r\n')
+        if not line:
+            return headers
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+
+class HTTPConnection(object):
+    '''
+    HTTP/1.1 connection, which sends a request at a time
+    '''
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    def closed(self):
+        return self.reader.at_eof() or self.writer.is_closing()
+
+    def close(self):
+        self.writer.close()
+
+    async def request(self, method, target, headers, body):
+        '''
+        Returns (Response, whether the connection can be reused)
+        '''
+        lines = ['{} {} HTTP/1.1'.format(method, target)]
+        lines += ['{}: {}'.format(name, value) for name, value in headers.items()]
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionClosed('Connection closed before the response')
+        status_code = int(status_line.split()[1])
+        headers = await read_headers(self.reader)
+        keep_alive = headers.get('connection', '').lower() != 'close'
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await self.reader.readline()).split(b';')[0], 16)
+                chunk = await self.reader.readexactly(size + 2)
+                if size == 0:
+                    break
+                chunks.append(chunk[:-2])
+            content = b''.join(chunks)
+        elif 'content-length' in headers:
+            content = await self.reader.readexactly(int(headers['content-length']))
+        else:
+            # The body ends with the connection
+            content = await self.reader.read()
+            keep_alive = False
+        return Response(status_code, headers, content), keep_alive
+
+
+class ConnectionPool(object):
+    '''
+    Pool of kept-alive connections to a host (size connections at most)
+    '''
+    def __init__(self, host, port, ssl_context, size, connect_timeout):
+        self.host = host
+        self.port = port
+        self.ssl_context = ssl_context
+        self.connect_timeout = connect_timeout
+        self.semaphore = asyncio.Semaphore(size)
+        self.idle = []
+
+        # Statistics
+        self.opened = 0
+
+    async def acquire(self):
+        await self.semaphore.acquire()
+        try:
+            while self.idle:
+                conn = self.idle.pop()
+                if not conn.closed():
+                    return conn
+                conn.close()
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port, ssl=self.ssl_context), self.connect_timeout)
+            self.opened += 1
+            return HTTPConnection(reader, writer)
+        except BaseException:
+            self.semaphore.release()
+            raise
+
+    def release(self, conn, keep_alive):
+        if keep_alive:
+            self.idle.append(conn)
+        else:
+            conn.close()
+        self.semaphore.release()
+
+    def close(self):
+        while self.idle:
+            self.idle.pop().close()
+
+
+def apply_mask(payload, key):
+    n = len(payload)
+    mask = (key * (n // 4 + 1))[:n]
+    return (int.from_bytes(payload, 'big') ^ int.from_bytes(mask, 'big')).to_bytes(n, 'big')
+
+
+def encode_frame(opcode, payload, mask=True):
+    '''
+    Returns a websocket frame of the payload (frames of a client are masked)
+    '''
+    header = bytearray([0x80 | opcode])
+    mask_bit = 0x80 if mask else 0
+    n = len(payload)
+    if n < 126:
+        header.append(mask_bit | n)
+    elif n < 65536:
+        header.append(mask_bit | 126)
+        header += struct.pack('!H', n)
+    else:
+        header.append(mask_bit | 127)
+        header += struct.pack('!Q', n)
+    if mask:
+        key = os.urandom(4)
+        header += key
+        payload = apply_mask(payload, key)
+    return bytes(header) + payload
+
+
+async def read_frame(reader):
+    '''
+    Returns (fin, opcode, payload) of a websocket frame
+    '''
+    b1, b2 = await reader.readexactly(2)
+    n = b2 & 0x7f
+    if n == 126:
+        n = struct.unpack('!H', await reader.readexactly(2))[0]
+    elif n == 127:
+        n = struct.unpack('!Q', await reader.readexactly(8))[0]
+    key = await reader.readexactly(4) if b2 & 0x80 else None
+    payload = await reader.readexactly(n)
+    if key is not None:
+        payload = apply_mask(payload, key)
+    return bool(b1 & 0x80), b1 & 0x0f, payload
+
+
+def accept_key(key):
+    return base64.b64encode(hashlib.sha1(key.encode('ascii') + WEBSOCKET_GUID).digest()).decode('ascii')
+
+
+class WebSocket(object):
+    '''
+    Client of a websocket
+    '''
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.closed = False
+
+    @classmethod
+    async def connect(cls, url, timeout=None):
+        host, port, ssl_context = address(url, {False: 80, True: 443})
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port, ssl=ssl_context), timeout)
+        u = urllib.parse.urlparse(url)
+        key = base64.b64encode(os.urandom(16)).decode('ascii')
+        writer.write((
+            'GET {} HTTP/1.1\r\n'
+            'Host: {}\r\n'
+            'Upgrade: websocket\r\n'
+            'Connection: Upgrade\r\n'
+            'Sec-WebSocket-Key: {}\r\n'
+            'Sec-WebSocket-Version: 13\r\n\r\n'
+        ).format(u.path or '/', u.netloc, key).encode('latin-1'))
+        await writer.drain()
+
+        status_line = await asyncio.wait_for(reader.readline(), timeout)
+        headers = await asyncio.wait_for(read_headers(reader), timeout)
+        if status_line.split()[1:2] != [b'101'] or headers.get('sec-websocket-accept') != accept_key(key):
+            writer.close()
+            raise ConnectionError('Websocket handshake failed: {}'.format(status_line))
+        return cls(reader, writer)
+
+    async def send(self, message):
+        self.writer.write(encode_frame(OP_TEXT, message.encode('utf-8')))
+        await self.writer.drain()
+
+    async def recv(self):
+        '''
+        Returns a message (str of a text message, bytes of a binary message)
+        '''
+        opcode = None
+        payloads = []
+        while True:
+            fin, op, payload = await read_frame(self.reader)
+            if op == OP_PING:
+                self.writer.write(encode_frame(OP_PONG, payload))
+                continue
+            if op == OP_PONG:
+                continue
+            if op == OP_CLOSE:
+                await self.close()
+                raise ConnectionClosed('Websocket closed by the server')
+            if op != OP_CONTINUATION:
+                opcode = op
+            payloads.append(payload)
+            if fin:
+                message = b''.join(payloads)
+                return message.decode('utf-8') if opcode == OP_TEXT else message
+
+    async def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.writer.write(encode_frame(OP_CLOSE, b''))
+            await self.writer.drain()
+        except (OSError, RuntimeError):
+            pass
+        self.writer.close()
+
+
+class AsyncAPIClient(object):
+    '''
+    asyncio APIClient (see bitflyer.APIClient)
+    '''
+    # Same signature as APIClient
+    header = bitflyer.APIClient.header
+
+    def __init__(self, key, secret, base_url=bitflyer.BASE_URL, websocket_url=bitflyer.WEBSOCKET_URL,
+                 pool_size=None, timeout=None, retries=None, backoff=None):
+        self.key = str(key)
+        self.secret = str(secret)
+        self.base_url = base_url
+        self.websocket_url = websocket_url
+        self.timeout = timeout if timeout is not None else (config.Config.api_connect_timeout, config.Config.api_read_timeout)
+        self.retries = retries if retries is not None else config.Config.api_retries
+        self.backoff = backoff if backoff is not None else config.Config.api_backoff
+        host, port, ssl_context = address(base_url, {False: 80, True: 443})
+        self.pool = ConnectionPool(host, port, ssl_context, pool_size or config.Config.api_pool_size, self.timeout[0])
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.pool.close()
+
+    async def do_request(self, method, urlpath, query={}, data=bytes()):
+        '''
+        Do request
+        '''
+        if method not in ('GET', 'POST'):
+            logger.error('invalid method {}'.format(method))
+            return
+        endpoint = urllib.parse.urljoin(self.base_url, urlpath)
+        u = urllib.parse.urlparse(endpoint)
+        target = u.path + ('?' + urllib.parse.urlencode(query) if query else '')
+        logger.debug({
+            'action': 'AsyncAPIClient:do_request',
+            'endpoint': endpoint,
+        })
+
+        attempt = 0
+        while True:
+            sent = False
+            try:
+                conn = await self.pool.acquire()
+                sent = True
+                headers = {'Host': u.netloc}
+                # The header is signed again by every attempt (ACCESS-TIMESTAMP)
+                headers.update(self.header(method, endpoint, data))
+                if method == 'POST':
+                    headers['Content-Length'] = len(data)
+                try:
+                    r, keep_alive = await asyncio.wait_for(conn.request(method, target, headers, data), self.timeout[1])
+                except BaseException:
+                    self.pool.release(conn, False)
+                    raise
+                self.pool.release(conn, keep_alive)
+            except (OSError, EOFError, asyncio.TimeoutError) as err:
+                # A request is not sent if the connection fails
+                if attempt >= self.retries or not (method in bitflyer.IDEMPOTENT_METHODS or not sent):
+                    raise
+                error = err
+            else:
+                if attempt >= self.retries or r.status_code not in bitflyer.RETRY_STATUSES or not (
+                        method in bitflyer.IDEMPOTENT_METHODS or r.status_code == 429):
+                    return r
+                error = r.status_code
+
+            wait = random.uniform(0, self.backoff * 2 ** attempt)
+            attempt += 1
+            logger.warning({
+                'action': 'AsyncAPIClient:do_request',
+                'endpoint': endpoint,
+                'error': error,
+                'retry': attempt,
+                'wait': wait
+            })
+            await asyncio.sleep(wait)
+
+    async def get_balance(self):
+        r = await self.do_request('GET', 'me/getbalance')
+        results = r.json()
+        try:
+            return [bitflyer.Balance(**result) for result in results]
+        except TypeError as err:
+            logger.warning({
+                'action': 'AsyncAPIClient:get_balance',
+                'error': err,
+                'response': results
+            })
+
+    async def get_ticker(self, product_code):
+        r = await self.do_request('GET', 'ticker', query={'product_code': product_code})
+        try:
+            return bitflyer.Ticker(**r.json())
+        except TypeError as err:
+            logger.warning({
+                'action': 'AsyncAPIClient:get_ticker',
+                'error': err,
+                'response': r.json()
+            })
+
+    async def send_order(self, order:bitflyer.Order):
+        data = json.dumps(order.__dict__).encode('utf-8')
+        r = await self.do_request('POST', 'me/sendchildorder', data=data)
+        logger.debug({
+            'action': 'AsyncAPIClient:send_order',
+            'resp': r.json(),
+            'status': 'done'
+        })
+        try:
+            return bitflyer.ResponseSendChildOrder(**r.json())
+        except TypeError as err:
+            logger.error({
+                'action': 'AsyncAPIClient:send_order',
+                'error': err,
+                'response': r.json()
+            })
+
+    async def list_order(self, query):
+        r = await self.do_request('GET', 'me/getchildorders', query=query)
+        try:
+            return [bitflyer.ResponseGetChildOrder(**d) for d in r.json()]
+        except TypeError as err:
+            logger.error({
+                'action': 'AsyncAPIClient:list_order',
+                'error': err,
+                'response': r.json()
+            })
+
+    async def subscribe_ticker(self, product_code, reconnect=True):
+        '''
+        Yields realtime tickers (bitflyer.TickerRecord) of the product code
+
+        https://bf-lightning-api.readme.io/docs/realtime-ticker
+
+        The websocket is connected again after backoff if it is closed (unless reconnect is False).
+        '''
+        param = json.dumps({
+            'jsonrpc': '2.0',
+            'method': 'subscribe',
+            'params': {'channel': 'lightning_ticker_' + product_code}
+        })
+        attempt = 0
+        while True:
+            ws = None
+            try:
+                ws = await WebSocket.connect(self.websocket_url, self.timeout[0])
+                await ws.send(param)
+                while True:
+                    message = await ws.recv()
+                    try:
+                        ticker = bitflyer.decode_ticker(message)
+                    except (KeyError, TypeError, ValueError) as err:
+                        logger.warning({
+                            'action': 'AsyncAPIClient:subscribe_ticker',
+                            'content': message,
+                            'error': err
+                        })
+                        continue
+                    if ticker is None:
+                        continue
+                    attempt = 0
+                    yield ticker
+            except (OSError, EOFError, asyncio.TimeoutError) as err:
+                logger.warning({
+                    'action': 'AsyncAPIClient:subscribe_ticker',
+                    'error': err,
+                    'reconnect': reconnect
+                })
+                if not reconnect:
+                    return
+            finally:
+                if ws is not None:
+                    await ws.close()
+
+            wait = random.uniform(0, self.backoff * 2 ** min(attempt, 6))
+            attempt += 1
+            await asyncio.sleep(wait)
@@ -1,6 +1,8 @@
 import re
 import time
 import datetime
+import functools
+import random
 from pytz import timezone
 import json
 import hashlib
@@ -8,12 +10,15 @@ import hmac
 import secrets
 import socket
 import urllib.parse
-import threading
 import queue
 from dataclasses import dataclass
 
 import requests
 import websocket
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 
 from config import config
@@ -24,6 +29,15 @@ logger = getLogger(__name__)
 
 
 BASE_URL = 'https://api.bitflyer.com/v1/'
+WEBSOCKET_URL = 'wss://ws.lightstream.bitflyer.com/json-rpc'
+
+# JSON decoder of the realtime messages (orjson if it is installed)
+loads = orjson.loads if orjson is not None else json.loads
+
+# Status codes retried (429: rate limited, 5xx: the server is busy or down)
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Methods which can be sent again even if the server may have received them
+IDEMPOTENT_METHODS = ('GET',)
 
 
 @dataclass
@@ -37,6 +51,52 @@ class Balance(object):
     amount: int
     available: int
 
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=timezone('UTC'))
+_EPOCH_ORDINAL = _EPOCH.toordinal()
+_MICROSECOND = datetime.timedelta(microseconds=1)
+# 1970-01-01 is Thursday (weekly candles start on Monday)
+_WEEK_US = datetime.timedelta(weeks=1) // _MICROSECOND
+_WEEK_OFFSET_US = datetime.timedelta(days=4) // _MICROSECOND
+
+
+@functools.lru_cache(maxsize=16)
+def _epoch_days(date):
+    return datetime.date.fromisoformat(date).toordinal() - _EPOCH_ORDINAL
+
+
+def parse_timestamp(timestamp):
+    '''
+    Returns the epoch microseconds of the ISO 8601 timestamp (UTC unless an offset is given)
+
+    Timestamps of bitFlyer (e.g. 2015-07-08T02:50:59.9743057Z) are sliced without datetime,
+    and a fraction longer than 6 digits is truncated to microseconds.
+    '''
+    if (timestamp[4:5] == '-' and timestamp[10:11] == 'T' and timestamp[13:14] == ':' and timestamp[16:17] == ':'
+            and timestamp[19:20] in ('.', 'Z', '')):
+        fraction = timestamp[20:-1] if timestamp[-1] == 'Z' else timestamp[20:]
+        hours, minutes, seconds = timestamp[11:13], timestamp[14:16], timestamp[17:19]
+        if (fraction.isdigit() or not fraction) and (hours + minutes + seconds).isdigit():
+            try:
+                days = _epoch_days(timestamp[:10])
+            except ValueError:
+                raise TypeError('{} is invalid timestamp'.format(timestamp))
+            return ((days * 86400 + int(hours) * 3600 + int(minutes) * 60 + int(seconds)) * 1000000
+                    + int((fraction + '00000')[:6]))
+
+    # With an UTC offset (e.g. +09:00)
+    m = re.match(r'(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)(?:\.(\d+))?(Z|[+-]\d\d:?\d\d)?$', timestamp)
+    if not m:
+        raise TypeError('{} is invalid timestamp'.format(timestamp))
+    main, fraction, tz = m.groups()
+    try:
+        dt = datetime.datetime.fromisoformat(main + '.' + ((fraction or '') + '000000')[:6] + (tz or '').replace('Z', '+00:00'))
+    except ValueError:
+        raise TypeError('{} is invalid timestamp'.format(timestamp))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    return (dt - _EPOCH) // _MICROSECOND
+
+
 @dataclass
 class Ticker(object):
     '''
@@ -69,54 +129,89 @@ class Ticker(object):
     def get_mid_price(self):
         return (self.best_bid + self.best_ask) / 2
 
+    def ohlcv(self):
+        '''
+        Returns [open, close, high, low, volume] of the ticker as a candle
+        '''
+        price = self.get_mid_price()
+        return [price, price, price, price, self.volume]
+
+    def __post_init__(self):
+        # The timestamp is parsed once (the candles of every duration use it)
+        self.epoch_us = parse_timestamp(self.timestamp)
+
+    def epoch_ms(self):
+        return self.epoch_us // 1000
+
     def datetime(self):
         '''
-        Get datetime from timestamp of ticker
+        Get datetime (UTC) from timestamp of ticker
         '''
-        # timestamp validation
-        # timestamp format %Y-%m-%dT%H:%M:%S.%f%z 
-        m = re.match(
-            r'(?P<year>\d+)-(?P<month>\d+)-(?P<day>\d+)T(?P<hour>\d+):(?P<minute>\d+):(?P<second>\d+)\.(?P<float>\d+)(?P<tz>\w*)',
-            self.timestamp)
-        if not m:
-            raise TypeError('{} is invalid timestamp'.format(self.timestamp))
-
-        d = m.groupdict()
-        # The length of %f in datetime format must be 1 to 6 integers
-        if len(d['float']) > 6:
-            d['float'] = d['float'][:6-len(d['float'])]
-
-        timestamp = '{year}-{month}-{day}T{hour}:{minute}:{second}.{float}{tz}'.format(**d)
-        try:
-            dt = datetime.datetime.strptime(timestamp, '%Y-%m-%dT%H:%M:%S.%f%z').astimezone(timezone('UTC'))
-        except ValueError as v_error:
-            try:
-                dt = datetime.datetime.strptime(timestamp, '%Y-%m-%dT%H:%M:%S.%f').astimezone(timezone('UTC'))
-            except Exception as ex:
-                logger.error({
-                    'action': 'Ticker:datetime',
-                    'exeption': ex
-                })
-        return dt
+        return _EPOCH + datetime.timedelta(microseconds=self.epoch_us)
 
     def truncate_datetime(self, duration):
         '''
         Tcuncate datetime
 
         duration: str
-            (1s, 1m, 1h, 1d, 1w)
+            (e.g. 1s, 1m, 15m, 1h, 1d, 1w)
         '''
-        if duration == '1s':
-            dt = self.datetime().replace(microsecond=0)
-        elif duration == '1m':
-            dt = self.datetime().replace(second=0, microsecond=0)
-        elif duration == '1h':
-            dt = self.datetime().replace(minute=0, second=0, microsecond=0)
-        elif duration == '1d':
-            dt = self.datetime().replace(hour=0, minute=0, second=0, microsecond=0)
-        else:
+        try:
+            step = config.parse_duration(duration) // _MICROSECOND
+        except ValueError:
             raise TypeError('unsupported duration: ' + duration)
-        return dt
+        offset = _WEEK_OFFSET_US if step % _WEEK_US == 0 else 0
+        return _EPOCH + datetime.timedelta(microseconds=(self.epoch_us - offset) // step * step + offset)
+
+
+class TickerRecord(object):
+    '''
+    Compact ticker of the realtime API, which has only the fields used by the candles (see Ticker)
+    '''
+    __slots__ = ('product_code', 'tick_id', 'epoch_us', 'best_bid', 'best_ask', 'ltp', 'volume')
+
+    def __init__(self, product_code, tick_id, epoch_us, best_bid, best_ask, ltp, volume):
+        self.product_code = product_code
+        self.tick_id = tick_id
+        self.epoch_us = epoch_us
+        self.best_bid = best_bid
+        self.best_ask = best_ask
+        self.ltp = ltp
+        self.volume = volume
+
+    def get_mid_price(self):
+        return (self.best_bid + self.best_ask) / 2
+
+    def ohlcv(self):
+        price = self.get_mid_price()
+        return [price, price, price, price, self.volume]
+
+    def epoch_ms(self):
+        return self.epoch_us // 1000
+
+    def datetime(self):
+        return _EPOCH + datetime.timedelta(microseconds=self.epoch_us)
+
+
+def decode_ticker(message):
+    '''
+    Returns TickerRecord of a message of the realtime ticker, or None if it is not a ticker
+
+    https://bf-lightning-api.readme.io/docs/realtime-ticker
+    '''
+    resp = loads(message)
+    if resp.get('method') != 'channelMessage':
+        return
+    m = resp['params']['message']
+    return TickerRecord(m['product_code'], m['tick_id'], parse_timestamp(m['timestamp']),
+                        m['best_bid'], m['best_ask'], m['ltp'], m['volume'])
+
+
+def decode_message(message):
+    '''
+    Returns the dict of a message of a channel
+    '''
+    return loads(message)['params']['message']
 
 
 @dataclass
@@ -177,10 +272,30 @@ class ResponseGetChildOrder(object):
 class APIClient(object):
     '''
     APIClient
+
+    Requests are sent over a pooled requests.Session, so the TCP and TLS connections are kept alive
+    and reused by the following requests (e.g. get_balance, get_ticker and send_order of a buy).
+    A failed request is retried up to retries times with jittered exponential backoff:
+    GET on a connection error, a timeout or RETRY_STATUSES, and POST (e.g. send_order, which must not
+    be sent twice) only when the server surely did not take it (a connect timeout or 429).
     '''
-    def __init__(self, key, secret):
+    def __init__(self, key, secret, base_url=BASE_URL, pool_size=None, timeout=None, retries=None, backoff=None):
         self.key = str(key)
         self.secret = str(secret)
+        self.base_url = base_url
+        self.timeout = timeout if timeout is not None else (config.Config.api_connect_timeout, config.Config.api_read_timeout)
+        self.retries = retries if retries is not None else config.Config.api_retries
+        self.backoff = backoff if backoff is not None else config.Config.api_backoff
+
+        pool_size = pool_size or config.Config.api_pool_size
+        self.session = requests.Session()
+        # Retries are done by do_request, which knows whether the request is idempotent
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def close(self):
+        self.session.close()
 
     def header(self, method, endpoint, body):
         '''
@@ -207,7 +322,7 @@ class APIClient(object):
         '''
         Do request
         '''
-        baseurl = BASE_URL
+        baseurl = self.base_url
         if len(urllib.parse.urlparse(baseurl).netloc) == 0:
             return
         apiurl = urlpath
@@ -219,14 +334,40 @@ class APIClient(object):
             'endpoint': endpoint,
         })
 
-        if method == 'GET':
-            r = requests.get(endpoint, query, headers=self.header(method, endpoint, data))
-        elif method == 'POST':
-            r = requests.post(endpoint, data, headers=self.header(method, endpoint, data))
-        else:
+        if method not in ('GET', 'POST'):
             logger.error('invalid method {}'.format(method))
+            return
 
-        return r
+        attempt = 0
+        while True:
+            try:
+                # The header is signed again by every attempt (ACCESS-TIMESTAMP)
+                if method == 'GET':
+                    r = self.session.get(endpoint, params=query, headers=self.header(method, endpoint, data), timeout=self.timeout)
+                else:
+                    r = self.session.post(endpoint, data, headers=self.header(method, endpoint, data), timeout=self.timeout)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as err:
+                # A connect timeout is raised before the request is sent
+                if attempt >= self.retries or not (
+                        method in IDEMPOTENT_METHODS or isinstance(err, requests.exceptions.ConnectTimeout)):
+                    raise
+                error = err
+            else:
+                if attempt >= self.retries or r.status_code not in RETRY_STATUSES or not (
+                        method in IDEMPOTENT_METHODS or r.status_code == 429):
+                    return r
+                error = r.status_code
+
+            wait = random.uniform(0, self.backoff * 2 ** attempt)
+            attempt += 1
+            logger.warning({
+                'action': 'APIClient:do_request',
+                'endpoint': endpoint,
+                'error': error,
+                'retry': attempt,
+                'wait': wait
+            })
+            time.sleep(wait)
 
     def get_balance(self):
         url = 'me/getbalance'
@@ -272,11 +413,13 @@ class APIClient(object):
 
     def get_realtime_ticker(self, product_code, ticker_q:queue.Queue):
         '''
-        Returns realtime ticker over WebSocket
+        Puts realtime tickers (TickerRecord) over WebSocket into ticker_q
 
         https://bf-lightning-api.readme.io/docs/realtime-ticker
+
+        Messages are decoded in the callback of the websocket, which runs in this thread.
         '''
-        endpoint = 'wss://ws.lightstream.bitflyer.com/json-rpc'
+        endpoint = WEBSOCKET_URL
 
         param = json.dumps({
                     'jsonrpc': '2.0',
@@ -284,27 +427,13 @@ class APIClient(object):
                     'params': {'channel': 'lightning_ticker_' + product_code}
                 })
 
-        resp_q = queue.Queue()
-        c = RealTimeAPI(endpoint, param, queue=resp_q)
-        t = threading.Thread(target=c.start)
-        t.setDaemon(True)
-        t.start()
+        c = RealTimeAPI(endpoint, param, queue=ticker_q, decode=decode_ticker)
         logger.debug({
             'action': 'get_realtime_ticker',
-            'status': 'websocket starts in another thread'
+            'status': 'websocket starts'
         })
-        
-        while True:
-            try:
-                ticker_q.put(Ticker(**resp_q.get()))
-            except TypeError as err:
-                logger.warning({
-                    'action': 'APIClient:get_realtime_ticker',
-                    'content': resp_q.get(),
-                    'error': err
-                })
-                return
-    
+        c.start()
+
     def send_order(self, order:Order):
         '''
         Send Order
@@ -355,10 +484,13 @@ class APIClient(object):
 class RealTimeAPI(object):
     '''
     Websocket API
+
+    decode: function which returns the object put into the queue from a message (None is not put)
     '''
-    def __init__(self, url, param, queue):
+    def __init__(self, url, param, queue, decode=decode_message):
         self.param = param
         self.queue = queue
+        self.decode = decode
         self.results = []
         websocket.enableTrace(True)
         self.ws = websocket.WebSocketApp(
@@ -370,8 +502,17 @@ class RealTimeAPI(object):
         self.ws.run_forever()
 
     def on_message(self, message):
-        resp = json.loads(message)
-        self.queue.put(resp['params']['message'])
+        try:
+            resp = self.decode(message)
+        except (KeyError, TypeError, ValueError) as err:
+            logger.warning({
+                'action': 'RealTimeAPI:on_message',
+                'content': message,
+                'error': err
+            })
+            return
+        if resp is not None:
+            self.queue.put(resp)
 
 
     def on_error(self, error):
@@ -384,11 +525,7 @@ class RealTimeAPI(object):
         logger.info('### websocket closed ###')
     
     def on_open(self):
-        def run(*args):
-            self.ws.send(self.param)
-        t = threading.Thread(target=run)
-        t.setDaemon(True)
-        t.start()
+        self.ws.send(self.param)
 
 
 #### ReaitimeAPI authentication
@@ -14,6 +14,14 @@ class ConfigList(object):
     api_key: str
     api_secret: str
 
+    # Connections to the API kept alive, timeouts (seconds), and retries of a failed request
+    # after backoff seconds (doubled by every retry, jittered)
+    api_pool_size: int
+    api_connect_timeout: float
+    api_read_timeout: float
+    api_retries: int
+    api_backoff: float
+
     # Logger Settings
     system_log_file: str
     trade_log_file: str
@@ -29,6 +37,7 @@ class ConfigList(object):
 
     # Trade Duration (1s, 1m, 1d)
     trade_duration: str
+    # Durations of the candles (finest first). Coarser candles are rolled up from finer ones.
     durations: dict
 
     # DB
@@ -47,6 +56,60 @@ class ConfigList(object):
     stop_limit_percent: float
     num_ranking: int
 
+    # Connection pool of the DB (idle connections kept, prepared statements cached per connection, mmap bytes)
+    db_pool_size: int
+    db_cached_statements: int
+    db_mmap_size: int
+
+    # Write-behind queue of the DB (rows per transaction, seconds to wait for a batch, queue size)
+    # A failed batch is retried write_retries times, first after write_retry_interval seconds (doubled each time)
+    db_write_batch_size: int
+    db_write_interval: float
+    db_write_queue_size: int
+    db_write_retries: int
+    db_write_retry_interval: float
+
+    # Retention of the candles ({duration: candles kept}, 0 keeps all), run every interval seconds
+    # in batches of batch_size rows, followed by an incremental vacuum of up to vacuum_pages pages
+    # and ANALYZE every analyze_interval seconds
+    db_retention: dict
+    db_retention_interval: float
+    db_retention_batch_size: int
+    db_vacuum_pages: int
+    db_analyze_interval: float
+
+    # Directory of the archive of the candles (see app.models.archive), which the retention
+    # exports the candles to before deleting them (empty: no archive)
+    db_archive_dir: str
+
+    # Queue of the realtime tickers (items kept, overflow policy: block, drop_oldest or coalesce,
+    # recent tick ids of a product checked for duplicates, 0 disables the check)
+    ingestion_queue_size: int
+    ingestion_policy: str
+    ingestion_dedup_window: int
+
+    # Seconds between writes of the open candles to the DB
+    candle_flush_interval: float
+
+    # Latest candles of each duration kept in memory (0 disables the cache)
+    candle_cache_size: int
+
+    # Candles of durations without a table (e.g. 15m) resampled and kept in memory (0 disables the cache)
+    resample_cache_size: int
+
+    # Processes to optimize parameters (1: no process pool, 0: the number of CPUs)
+    optimize_workers: int
+
+    # Search strategy of parameters (exhaustive, random, halving, coordinate) and its budget
+    # for all the indicators in total (0: no limit)
+    optimize_strategy: str
+    optimize_max_evals: int
+    optimize_max_seconds: float
+
+    # Cache of optimized parameters (entries: 0 disables the cache, hours: 0 keeps entries regardless of age)
+    optimize_cache_entries: int
+    optimize_cache_hours: float
+
 cfg = configparser.ConfigParser()
 
 try:
@@ -64,17 +127,58 @@ log_levels ={
 }
 
 # Durations
-durations = {
-    '1s': datetime.timedelta(seconds=1),
-    '1m': datetime.timedelta(minutes=1),
-    '1h': datetime.timedelta(hours=1),
-    '1d': datetime.timedelta(days=1),
-    # '1w': datetime.timedelta(weeks=1)
+DURATION_UNITS = {
+    's': datetime.timedelta(seconds=1),
+    'm': datetime.timedelta(minutes=1),
+    'h': datetime.timedelta(hours=1),
+    'd': datetime.timedelta(days=1),
+    'w': datetime.timedelta(weeks=1)
+}
+
+
+def parse_duration(name):
+    '''
+    Returns timedelta of the duration (e.g. 15m)
+    '''
+    if not name or name[-1] not in DURATION_UNITS or not name[:-1].isdigit() or int(name[:-1]) <= 0:
+        raise ValueError('Invalid duration: {}'.format(name))
+    return DURATION_UNITS[name[-1]] * int(name[:-1])
+
+
+def parse_durations(value):
+    '''
+    Returns {duration: timedelta} of comma separated durations (e.g. "1s, 1m, 5m, 1h"), finest first
+
+    Each duration must be a multiple of the finer ones, so that the candles can be rolled up.
+    '''
+    result = {}
+    for name in (v.strip() for v in value.split(',')):
+        if name:
+            result[name] = parse_duration(name)
+    result = dict(sorted(result.items(), key=lambda item: item[1]))
+    deltas = list(result.values())
+    for finer, coarser in zip(deltas, deltas[1:]):
+        if coarser % finer:
+            raise ValueError('Durations must be multiples of each other: {}'.format(value))
+    return result
+
+
+durations = parse_durations(cfg['trading'].get('durations', '1s, 1m, 1h, 1d'))
+
+# Candles kept of each duration (retention_<duration> overrides retention_candles)
+retention = {
+    duration: cfg['db'].getint('retention_' + duration, cfg['db'].getint('retention_candles', 10000))
+    for duration in durations
 }
 
 Config = ConfigList(
     api_key = cfg['bitflyer']['api_key'],
     api_secret = cfg['bitflyer']['api_secret'],
+    api_pool_size = cfg['bitflyer'].getint('pool_size', 4),
+    api_connect_timeout = cfg['bitflyer'].getfloat('connect_timeout', 3.05),
+    api_read_timeout = cfg['bitflyer'].getfloat('read_timeout', 10),
+    api_retries = cfg['bitflyer'].getint('retries', 3),
+    api_backoff = cfg['bitflyer'].getfloat('backoff', 0.5),
     system_log_file = cfg['trading']['system_log_file'],
     trade_log_file = cfg['trading']['trade_log_file'],
     log_stream_level = log_levels[cfg['trading']['log_stream_level']],
@@ -91,5 +195,31 @@ Config = ConfigList(
     use_percent = cfg['trading'].getfloat('use_percent'),
     data_limit = cfg['trading'].getint('data_limit'),
     stop_limit_percent = cfg['trading'].getfloat('stop_limit_percent'),
-    num_ranking = cfg['trading'].getint('num_ranking')
+    num_ranking = cfg['trading'].getint('num_ranking'),
+    db_pool_size = cfg['db'].getint('pool_size', 8),
+    db_cached_statements = cfg['db'].getint('cached_statements', 128),
+    db_mmap_size = cfg['db'].getint('mmap_size', 268435456),
+    db_write_batch_size = cfg['db'].getint('write_batch_size', 500),
+    db_write_interval = cfg['db'].getfloat('write_interval', 0.5),
+    db_write_queue_size = cfg['db'].getint('write_queue_size', 10000),
+    db_write_retries = cfg['db'].getint('write_retries', 3),
+    db_write_retry_interval = cfg['db'].getfloat('write_retry_interval', 0.1),
+    db_retention = retention,
+    db_retention_interval = cfg['db'].getfloat('retention_interval', 60),
+    db_retention_batch_size = cfg['db'].getint('retention_batch_size', 1000),
+    db_vacuum_pages = cfg['db'].getint('vacuum_pages', 1000),
+    db_analyze_interval = cfg['db'].getfloat('analyze_interval', 3600),
+    db_archive_dir = cfg['db'].get('archive_dir', ''),
+    ingestion_queue_size = cfg['trading'].getint('ingestion_queue_size', 10000),
+    ingestion_policy = cfg['trading'].get('ingestion_policy', 'coalesce'),
+    ingestion_dedup_window = cfg['trading'].getint('ingestion_dedup_window', 1024),
+    candle_flush_interval = cfg['trading'].getfloat('candle_flush_interval', 1.0),
+    candle_cache_size = cfg['trading'].getint('candle_cache_size', 1000),
+    resample_cache_size = cfg['trading'].getint('resample_cache_size', 64),
+    optimize_workers = cfg['trading'].getint('optimize_workers', 1),
+    optimize_strategy = cfg['trading'].get('optimize_strategy', 'exhaustive'),
+    optimize_max_evals = cfg['trading'].getint('optimize_max_evals', 0),
+    optimize_max_seconds = cfg['trading'].getfloat('optimize_max_seconds', 0),
+    optimize_cache_entries = cfg['trading'].getint('optimize_cache_entries', 100),
+    optimize_cache_hours = cfg['trading'].getfloat('optimize_cache_hours', 168)
 )
\ No newline at end of file
@@ -0,0 +1,62 @@
+import datetime
+import os
+import random
+import tempfile
+from unittest import TestCase
+
+from config import config
+from app.models import base, hotcache, resample, writer
+from app.models.candle import Candle
+
+
+def random_walk(seed, n, price=1000000.0):
+    '''
+    Yields n prices of a random walk seeded by seed
+
+    The global random is used, so the draws of the caller between the prices are seeded too.
+    '''
+    random.seed(seed)
+    for _ in range(n):
+        price += random.gauss(0, 1000)
+        yield price
+
+
+def random_walk_candles(seed, n, duration='1m', start=datetime.datetime(2020, 1, 1), product_code='BTC_JPY'):
+    '''
+    Returns n candles of a random walk from the start
+    '''
+    delta = config.Config.durations[duration]
+    return [
+        Candle(product_code, duration, start + delta * i, price, price + random.gauss(0, 500), price + 300, price - 300, 1)
+        for i, price in enumerate(random_walk(seed, n))
+    ]
+
+
+class TempDBTestCase(TestCase):
+    '''
+    TestCase on a DB in a temporary directory
+
+    setUp switches config.Config.db_name to the DB and empties the caches of candles,
+    and the pending writes are flushed before the DB is restored and removed.
+    init_db: whether setUp creates the tables by base.init()
+    '''
+    init_db = True
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.addCleanup(setattr, config.Config, 'db_name', config.Config.db_name)
+        self.addCleanup(writer.flush)
+        # Writes of the previous tests are not in the DB of this test
+        writer.flush()
+        config.Config.db_name = self.path('test.sql')
+        hotcache.CACHE.clear()
+        resample.CACHE.clear()
+        if self.init_db:
+            base.init()
+
+    def path(self, name):
+        '''
+        Returns the path of the file in the temporary directory
+        '''
+        return os.path.join(self.tmpdir.name, name)
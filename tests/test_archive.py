@@ -0,0 +1,76 @@
+import datetime
+import os
+
+import numpy as np
+
+from app.models import archive, retention, writer
+from app.models.candle import Candle, get_all_candles
+from app.models.dfcandle import DataFrameCandle
+from tests.helpers import random_walk_candles, TempDBTestCase
+
+
+class TestArchive(TempDBTestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = self.path('archive')
+        self.product_code = 'BTC_JPY'
+        self.start = datetime.datetime(2020, 1, 1)
+
+        for candle in random_walk_candles(18, 3000, '1m', self.start, self.product_code):
+            candle.create()
+        writer.flush()
+
+    def test_export(self):
+        self.assertEqual(archive.export(self.product_code, '1m', directory=self.directory), 2999)
+        self.assertEqual(archive.export(self.product_code, '1m', directory=self.directory), 0)
+
+        Candle(self.product_code, '1m', self.start + datetime.timedelta(minutes=3000), 1, 1, 1, 1, 1).create()
+        self.assertEqual(archive.export(self.product_code, '1m', directory=self.directory), 1)
+
+        a = archive.Archive(self.product_code, '1m', self.directory)
+        self.assertEqual(a.length(), 3000)
+        self.assertEqual(a.last_time(), np.datetime64(self.start + datetime.timedelta(minutes=2999), 'us'))
+
+    def test_range(self):
+        archive.export(self.product_code, '1m', directory=self.directory)
+        start = self.start + datetime.timedelta(minutes=1500)
+        end = self.start + datetime.timedelta(minutes=2500)
+        df = DataFrameCandle.from_archive(self.product_code, '1m', start, end, self.directory)
+        self.assertEqual(df.length(), 1000)
+        self.assertEqual(df.times()[0], start)
+        self.assertIsInstance(df.columns['close'].base, np.memmap)
+
+        # Same as the candles in the DB
+        db = get_all_candles(self.product_code, '1m', 3000)
+        for name in archive.COLUMNS:
+            self.assertEqual(df.columns[name].tolist(), db.columns[name][1500:2500].tolist())
+        self.assertEqual(
+            DataFrameCandle.from_archive(self.product_code, '1m', start + datetime.timedelta(seconds=1), end, self.directory).length(),
+            999)
+
+        # Backtests on the memory-mapped columns
+        params = {'period': 14, 'buy_thread': 30, 'sell_thread': 70}
+        copied = DataFrameCandle.from_columns(
+            self.product_code, '1m', *(db.columns[name][1500:2500] for name in archive.COLUMNS))
+        self.assertEqual(df.evaluate('rsi', params), copied.evaluate('rsi', params))
+
+    def test_torn_append(self):
+        archive.export(self.product_code, '1m', directory=self.directory)
+        a = archive.Archive(self.product_code, '1m', self.directory)
+        with open(a.file('close'), 'ab') as f:
+            f.write(b'\0' * 8 * 5)
+        self.assertEqual(a.length(), 2999)
+
+        for i in (3000, 3001):
+            Candle(self.product_code, '1m', self.start + datetime.timedelta(minutes=i), 1, 1, 1, 1, 1).create()
+        archive.export(self.product_code, '1m', directory=self.directory)
+        self.assertEqual(a.length(), 3001)
+        self.assertEqual(os.path.getsize(a.file('close')), 3001 * 8)
+        self.assertEqual(a.open()['close'][-1], 1)
+
+    def test_retention(self):
+        r = retention.Retention(self.product_code, {'1m': 100}, archive_dir=self.directory)
+        result = r.run_once()
+        self.assertEqual(result['archived'], {'1m': 2999})
+        self.assertEqual(result['deleted'], {'1m': 2900})
+        self.assertEqual(DataFrameCandle.from_archive(self.product_code, '1m', directory=self.directory).length(), 2999)
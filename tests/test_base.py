@@ -0,0 +1,73 @@
+import datetime
+import threading
+from unittest import TestCase
+
+from config import config
+from app.models import base
+from tests.helpers import TempDBTestCase
+
+
+class TestConnectionPool(TempDBTestCase):
+    init_db = False
+
+    def test_reuse(self):
+        with base.connect() as conn1:
+            pass
+        with base.connect() as conn2:
+            self.assertIs(conn1, conn2)
+            with base.connect() as conn3:
+                self.assertIsNot(conn2, conn3)
+
+    def test_pragmas(self):
+        with base.connect() as conn:
+            self.assertEqual(conn.execute('pragma journal_mode').fetchone()[0], 'wal')
+            self.assertEqual(conn.execute('pragma synchronous').fetchone()[0], 1)
+
+    def test_db_name(self):
+        with base.connect() as conn1:
+            pass
+        config.Config.db_name = self.path('test2.sql')
+        with base.connect() as conn2:
+            self.assertIsNot(conn1, conn2)
+            self.assertEqual(conn2.execute('pragma database_list').fetchone()[2], config.Config.db_name)
+
+    def test_threads(self):
+        base.init()
+        errors = []
+
+        def read():
+            try:
+                with base.connect() as conn:
+                    conn.execute('select count(*) from signal_events').fetchone()
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=read) for _ in range(10)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+
+
+class TestTruncate(TestCase):
+    def test_truncate_epoch_ms(self):
+        ms = base.to_epoch_ms(datetime.datetime(2020, 1, 8, 13, 47, 31, 500000))
+        patterns = [
+            ('1s', datetime.datetime(2020, 1, 8, 13, 47, 31)),
+            ('5m', datetime.datetime(2020, 1, 8, 13, 45)),
+            ('4h', datetime.datetime(2020, 1, 8, 12)),
+            ('1d', datetime.datetime(2020, 1, 8)),
+            ('1w', datetime.datetime(2020, 1, 6))     # Monday
+        ]
+        for duration, expected in patterns:
+            with self.subTest(duration=duration):
+                delta = config.parse_durations(duration)[duration]
+                self.assertEqual(base.from_epoch_ms(base.truncate_epoch_ms(ms, delta)), expected)
+
+    def test_parse_durations(self):
+        self.assertEqual(list(config.parse_durations('1h, 1s, 15m, 1m, 5m')), ['1s', '1m', '5m', '15m', '1h'])
+        with self.assertRaises(ValueError):
+            config.parse_durations('1m, 5m, 7m')
+        with self.assertRaises(ValueError):
+            config.parse_durations('1x')
@@ -0,0 +1,284 @@
+import asyncio
+import datetime
+import http.server
+import json
+import queue
+import threading
+from unittest import IsolatedAsyncioTestCase, TestCase
+from unittest.mock import patch
+
+from bitflyer import aio, bitflyer
+
+
+TICKER = {
+    'product_code': 'BTC_JPY', 'state': 'RUNNING', 'timestamp': '2020-01-01T00:00:00.1234567Z', 'tick_id': 1,
+    'best_bid': 999, 'best_ask': 1001, 'best_bid_size': 1, 'best_ask_size': 1, 'total_bid_depth': 10,
+    'total_ask_depth': 10, 'market_bid_size': 0, 'market_ask_size': 0, 'ltp': 1000, 'volume': 100,
+    'volume_by_product': 100
+}
+
+
+class TestTicker(TestCase):
+    def ticker(self, timestamp):
+        return bitflyer.Ticker(**dict(TICKER, timestamp=timestamp))
+
+    def test_parse_timestamp(self):
+        utc = datetime.timezone.utc
+        test_patterns = [
+            ('2015-07-08T02:50:59.9743057Z', datetime.datetime(2015, 7, 8, 2, 50, 59, 974305, utc)),
+            ('2015-07-08T02:50:59.97', datetime.datetime(2015, 7, 8, 2, 50, 59, 970000, utc)),
+            ('2015-07-08T02:50:59Z', datetime.datetime(2015, 7, 8, 2, 50, 59, 0, utc)),
+            ('2015-07-08T11:50:59.9743057+09:00', datetime.datetime(2015, 7, 8, 2, 50, 59, 974305, utc)),
+            ('1969-12-31T23:59:59.5Z', datetime.datetime(1969, 12, 31, 23, 59, 59, 500000, utc))
+        ]
+        for timestamp, expected in test_patterns:
+            with self.subTest(timestamp=timestamp):
+                ticker = self.ticker(timestamp)
+                self.assertEqual(ticker.datetime(), expected)
+                self.assertEqual(ticker.epoch_ms(), (expected - datetime.datetime(1970, 1, 1, tzinfo=utc)) // datetime.timedelta(milliseconds=1))
+
+        for timestamp in ('2015-13-08T02:50:59.1Z', '2015-07-08 02:50:59', 'now'):
+            with self.subTest(timestamp=timestamp):
+                with self.assertRaises(TypeError):
+                    self.ticker(timestamp)
+
+    def test_truncate_datetime(self):
+        ticker = self.ticker('2015-07-08T02:50:59.9743057Z')
+        utc = datetime.timezone.utc
+        test_patterns = [
+            ('1s', datetime.datetime(2015, 7, 8, 2, 50, 59, tzinfo=utc)),
+            ('15m', datetime.datetime(2015, 7, 8, 2, 45, tzinfo=utc)),
+            ('1d', datetime.datetime(2015, 7, 8, tzinfo=utc)),
+            ('1w', datetime.datetime(2015, 7, 6, tzinfo=utc))
+        ]
+        for duration, expected in test_patterns:
+            with self.subTest(duration=duration):
+                self.assertEqual(ticker.truncate_datetime(duration), expected)
+        with self.assertRaises(TypeError):
+            ticker.truncate_datetime('1y')
+
+
+class TestRealTimeAPI(TestCase):
+    def message(self, **kwargs):
+        return json.dumps({
+            'jsonrpc': '2.0', 'method': 'channelMessage',
+            'params': {'channel': 'lightning_ticker_BTC_JPY', 'message': dict(TICKER, **kwargs)}
+        })
+
+    def test_decode_ticker(self):
+        ticker = bitflyer.Ticker(**TICKER)
+        for loads in (bitflyer.loads, json.loads):
+            with self.subTest(loads=loads):
+                with patch.object(bitflyer, 'loads', loads):
+                    record = bitflyer.decode_ticker(self.message())
+                self.assertEqual((record.product_code, record.tick_id, record.volume), ('BTC_JPY', 1, 100))
+                self.assertEqual(record.get_mid_price(), ticker.get_mid_price())
+                self.assertEqual(record.epoch_ms(), ticker.epoch_ms())
+                self.assertEqual(record.datetime(), ticker.datetime())
+                self.assertFalse(hasattr(record, '__dict__'))
+        self.assertIsNone(bitflyer.decode_ticker('{"jsonrpc": "2.0", "id": 1, "result": true}'))
+
+    def test_on_message(self):
+        q = queue.Queue()
+        api = bitflyer.RealTimeAPI('ws://127.0.0.1/json-rpc', '', q, decode=bitflyer.decode_ticker)
+        api.on_message(self.message(tick_id=2))
+        api.on_message(self.message(timestamp='now'))
+        api.on_message('{"jsonrpc": "2.0", "method": "channelMessage"}')
+        api.on_message('not json')
+        self.assertEqual(q.qsize(), 1)
+        self.assertEqual(q.get().tick_id, 2)
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.respond()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.respond()
+
+    def respond(self):
+        server = self.server
+        server.requests.append((self.command, self.path, self.client_address))
+        status = server.statuses.pop(0) if server.statuses else 200
+        body = json.dumps(server.bodies.get(self.path.split('?')[0], {})).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class TestAPIClient(TestCase):
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.requests = []
+        self.server.statuses = []
+        self.server.bodies = {
+            '/v1/me/getbalance': [{'currency_code': 'JPY', 'amount': 100, 'available': 90}],
+            '/v1/me/sendchildorder': {'child_order_acceptance_id': 'JRF20200101-000000-000001'}
+        }
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+        self.client = bitflyer.APIClient(
+            'key', 'secret', base_url='http://127.0.0.1:{}/v1/'.format(self.server.server_port), backoff=0)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def order(self):
+        return bitflyer.Order('BTC_JPY', 'MARKET', 'BUY', 0.01)
+
+    def test_keep_alive(self):
+        for _ in range(3):
+            self.assertEqual(self.client.get_balance(), [bitflyer.Balance('JPY', 100, 90)])
+        self.assertEqual(self.client.send_order(self.order()).child_order_acceptance_id, 'JRF20200101-000000-000001')
+        self.assertEqual(len(self.server.requests), 4)
+        # One connection for every request
+        self.assertEqual(len({address for _, _, address in self.server.requests}), 1)
+
+    def test_retry(self):
+        self.server.statuses = [503, 502]
+        self.assertEqual(self.client.get_balance(), [bitflyer.Balance('JPY', 100, 90)])
+        self.assertEqual(len(self.server.requests), 3)
+
+        self.server.statuses = [503] * 5
+        self.assertEqual(self.client.do_request('GET', 'me/getbalance').status_code, 503)
+        self.assertEqual(len(self.server.requests), 3 + 1 + self.client.retries)
+
+    def test_order_not_sent_twice(self):
+        self.server.statuses = [500]
+        self.assertEqual(self.client.do_request('POST', 'me/sendchildorder', data=b'{}').status_code, 500)
+        self.assertEqual(len(self.server.requests), 1)
+
+        # Rate limited orders are not taken
+        self.server.statuses = [429]
+        self.assertIsNotNone(self.client.send_order(self.order()))
+        self.assertEqual(len(self.server.requests), 3)
+
+
+class StandInServer(object):
+    '''
+    Stand-in server of the REST API and the realtime API
+    '''
+    def __init__(self, messages=3):
+        self.messages = messages
+        self.requests = []
+        self.statuses = []
+        self.connections = 0
+        self.subscriptions = []
+        self.bodies = {
+            '/v1/me/getbalance': [{'currency_code': 'JPY', 'amount': 100, 'available': 90}],
+            '/v1/ticker': TICKER,
+            '/v1/me/sendchildorder': {'child_order_acceptance_id': 'JRF20200101-000000-000001'},
+            '/v1/me/getchildorders': []
+        }
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, '127.0.0.1', 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode().split()
+                headers = await aio.read_headers(reader)
+                if headers.get('upgrade') == 'websocket':
+                    await self.realtime(reader, writer, headers)
+                    break
+                await reader.readexactly(int(headers.get('content-length', 0)))
+                await asyncio.sleep(0.01)
+                self.requests.append((method, target))
+                status = self.statuses.pop(0) if self.statuses else 200
+                body = json.dumps(self.bodies[target.split('?')[0]]).encode()
+                writer.write('HTTP/1.1 {} -\r\nContent-Length: {}\r\n\r\n'.format(status, len(body)).encode() + body)
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def realtime(self, reader, writer, headers):
+        writer.write((
+            'HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+            'Sec-WebSocket-Accept: {}\r\n\r\n').format(aio.accept_key(headers['sec-websocket-key'])).encode())
+        _, _, payload = await aio.read_frame(reader)
+        channel = json.loads(payload)['params']['channel']
+        self.subscriptions.append(channel)
+        writer.write(aio.encode_frame(aio.OP_PING, b'', mask=False))
+        for i in range(self.messages):
+            message = dict(TICKER, tick_id=i, product_code=channel[len('lightning_ticker_'):])
+            data = json.dumps({'jsonrpc': '2.0', 'method': 'channelMessage', 'params': {'channel': channel, 'message': message}})
+            # A message in two frames (the first frame without FIN)
+            writer.write(bytes([aio.OP_TEXT]) + aio.encode_frame(aio.OP_TEXT, data[:10].encode(), mask=False)[1:])
+            writer.write(aio.encode_frame(aio.OP_CONTINUATION, data[10:].encode(), mask=False))
+        writer.write(aio.encode_frame(aio.OP_CLOSE, b'', mask=False))
+        await writer.drain()
+
+
+class TestAsyncAPIClient(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = StandInServer()
+        await self.server.start()
+        self.client = aio.AsyncAPIClient(
+            'key', 'secret', base_url='http://127.0.0.1:{}/v1/'.format(self.server.port),
+            websocket_url='ws://127.0.0.1:{}/json-rpc'.format(self.server.port), pool_size=4, backoff=0)
+
+    async def asyncTearDown(self):
+        self.client.close()
+        await self.server.stop()
+
+    async def test_rest(self):
+        self.assertEqual(await self.client.get_balance(), [bitflyer.Balance('JPY', 100, 90)])
+        self.assertEqual(await self.client.get_ticker('BTC_JPY'), bitflyer.Ticker(**TICKER))
+        order = await self.client.send_order(bitflyer.Order('BTC_JPY', 'MARKET', 'BUY', 0.01))
+        self.assertEqual(order.child_order_acceptance_id, 'JRF20200101-000000-000001')
+        self.assertEqual(await self.client.list_order({'product_code': 'BTC_JPY'}), [])
+        self.assertEqual(self.server.requests[1], ('GET', '/v1/ticker?product_code=BTC_JPY'))
+        self.assertEqual(self.server.connections, 1)
+
+    async def test_concurrent(self):
+        tickers = await asyncio.gather(*(self.client.get_ticker('BTC_JPY') for _ in range(20)))
+        self.assertEqual(len(tickers), 20)
+        self.assertEqual(self.client.pool.opened, 4)
+        self.assertEqual(len(self.client.pool.idle), 4)
+
+    async def test_retry(self):
+        self.server.statuses = [503]
+        self.assertEqual(len(await self.client.get_balance()), 1)
+        self.server.statuses = [500]
+        r = await self.client.do_request('POST', 'me/sendchildorder', data=b'{}')
+        self.assertEqual(r.status_code, 500)
+        self.assertEqual(len(self.server.requests), 3)
+
+    async def test_subscribe(self):
+        async def collect(product_code):
+            return [ticker async for ticker in self.client.subscribe_ticker(product_code, reconnect=False)]
+
+        results = await asyncio.gather(collect('BTC_JPY'), collect('ETH_JPY'))
+        self.assertEqual([[t.tick_id for t in tickers] for tickers in results], [[0, 1, 2], [0, 1, 2]])
+        self.assertEqual(results[1][0].product_code, 'ETH_JPY')
+        self.assertEqual(sorted(self.server.subscriptions), ['lightning_ticker_BTC_JPY', 'lightning_ticker_ETH_JPY'])
+
+    async def test_reconnect(self):
+        tickers = []
+        async for ticker in self.client.subscribe_ticker('BTC_JPY'):
+            tickers.append(ticker)
+            if len(tickers) == 5:
+                break
+        self.assertEqual([t.tick_id for t in tickers], [0, 1, 2, 0, 1])
+        self.assertEqual(len(self.server.subscriptions), 2)
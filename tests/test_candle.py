@@ -1,13 +1,17 @@
 import datetime
+import random
 import sqlite3
 from unittest import TestCase
 from unittest.mock import MagicMock, patch
 
 
+from config import config
+from app.models import base, hotcache, writer
 from app.models.base import get_candle_table_name
-from app.models.candle import Candle, get_candle, get_all_candles, create_or_update_candle
+from app.models.candle import Candle, CandleAggregator, get_candle, get_all_candles, create_or_update_candle
 from app.models.dfcandle import DataFrameCandle
 from bitflyer.bitflyer import Ticker
+from tests.helpers import TempDBTestCase
 
 
 class TestCandle(TestCase):
@@ -16,9 +20,12 @@ class TestCandle(TestCase):
         self.product_code = 'BTC_JPY'
         self.duration = '1m'
         self.table = get_candle_table_name(self.product_code, self.duration)
+        # The DB is mocked
+        hotcache.CACHE.clear()
+        writer.flush()
 
         self.data = {
-            'time': datetime.datetime.now(),
+            'time': datetime.datetime.now().replace(microsecond=0),
             'open': 200,
             'close': 300,
             'high': 450,
@@ -39,12 +46,14 @@ class TestCandle(TestCase):
 
     def test_get_candle(self):
         curs_mock = MagicMock()
-        curs_mock.fetchone.return_value = self.data
+        curs_mock.fetchone.return_value = tuple(dict(self.data, time=base.to_epoch_ms(self.data['time'])).values())
 
         conn_mock = MagicMock()
         conn_mock.cursor.return_value = curs_mock
+        connect_mock = MagicMock()
+        connect_mock.return_value.__enter__.return_value = conn_mock
 
-        with patch('sqlite3.connect', return_value=conn_mock):
+        with patch('app.models.base.connect', connect_mock):
             candle = get_candle(self.product_code, self.duration, self.data['time'])
         
         conn_mock.commit.assert_not_called()
@@ -56,12 +65,14 @@ class TestCandle(TestCase):
     
     def test_get_all_candles(self):
         curs_mock = MagicMock()
-        curs_mock.fetchall.return_value = [list(self.data.values())]
+        curs_mock.fetchall.return_value = [list(dict(self.data, time=base.to_epoch_ms(self.data['time'])).values())]
 
         conn_mock = MagicMock()
         conn_mock.cursor.return_value = curs_mock
+        connect_mock = MagicMock()
+        connect_mock.return_value.__enter__.return_value = conn_mock
 
-        with patch('sqlite3.connect', return_value=conn_mock):
+        with patch('app.models.base.connect', connect_mock):
             df = get_all_candles(self.product_code, self.duration, 10)
         
         conn_mock.commit.assert_not_called()
@@ -89,3 +100,112 @@ class TestCandle(TestCase):
                 res = create_or_update_candle(ticker, self.product_code, self.duration)
                 self.assertEqual(res, expect_result)
 
+
+
+class TestCandleAggregator(TempDBTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product_code = 'BTC_JPY'
+        self.duration = '1m'
+
+    def ticker(self, timestamp, price, volume=1):
+        return Ticker(self.product_code, '', timestamp, 0, price, price, 0, 0, 0, 0, 0, 0, price, volume, 0)
+
+    def values(self, duration, time):
+        c = get_candle(self.product_code, duration, time)
+        return (c.open, c.close, c.high, c.low, c.volume)
+
+    def test_update(self):
+        aggregator = CandleAggregator(flush_interval=3600)
+        self.assertEqual(aggregator.update(self.ticker('2020-01-01T00:00:01.5Z', 100), self.product_code), ['1s', '1m', '1h', '1d'])
+        self.assertEqual(aggregator.update(self.ticker('2020-01-01T00:00:01.7Z', 105), self.product_code), [])
+        self.assertEqual(aggregator.update(self.ticker('2020-01-01T00:00:02.5Z', 120), self.product_code), ['1s'])
+        self.assertEqual(aggregator.update(self.ticker('2020-01-01T00:00:03.5Z', 90), self.product_code), ['1s'])
+
+        # Not written until the candle is closed or flushed
+        time = datetime.datetime(2020, 1, 1)
+        self.assertEqual(get_candle(self.product_code, self.duration, time).close, 100)
+
+        self.assertEqual(aggregator.update(self.ticker('2020-01-01T00:01:00.5Z', 95), self.product_code), ['1s', '1m'])
+        self.assertEqual(self.values('1m', time), (100, 90, 120, 90, 4))
+        self.assertEqual(self.values('1h', time), (100, 100, 100, 100, 1))
+
+        aggregator.flush(force=True)
+        self.assertEqual(self.values('1h', time), (100, 95, 120, 90, 5))
+        self.assertEqual(self.values('1d', time), (100, 95, 120, 90, 5))
+
+    def test_flush(self):
+        aggregator = CandleAggregator(flush_interval=3600)
+        aggregator.update(self.ticker('2020-01-01T00:00:01.5Z', 100), self.product_code)
+        aggregator.update(self.ticker('2020-01-01T00:00:01.6Z', 110), self.product_code)
+        time = datetime.datetime(2020, 1, 1)
+        self.assertFalse(aggregator.flush())
+        self.assertEqual(get_candle(self.product_code, self.duration, time).close, 100)
+        self.assertTrue(aggregator.flush(force=True))
+        self.assertEqual(get_candle(self.product_code, self.duration, time).close, 110)
+
+    def test_recover(self):
+        aggregator = CandleAggregator(flush_interval=0)
+        aggregator.update(self.ticker('2020-01-01T00:00:01.5Z', 100), self.product_code)
+        aggregator.update(self.ticker('2020-01-01T00:00:02.5Z', 110), self.product_code)
+        aggregator.flush()
+
+        # A new aggregator (restart) continues the open candles
+        aggregator = CandleAggregator(flush_interval=0)
+        self.assertEqual(aggregator.update(self.ticker('2020-01-01T00:00:02.7Z', 105), self.product_code), [])
+        self.assertEqual(aggregator.update(self.ticker('2020-01-01T00:00:03.5Z', 90), self.product_code), ['1s'])
+        aggregator.flush()
+        time = datetime.datetime(2020, 1, 1)
+        self.assertEqual(self.values('1m', time), (100, 90, 110, 90, 4))
+        self.assertEqual(self.values('1d', time), (100, 90, 110, 90, 4))
+
+    def test_late(self):
+        aggregator = CandleAggregator(flush_interval=3600)
+        aggregator.update(self.ticker('2020-01-01T00:00:01.5Z', 100), self.product_code)
+        aggregator.update(self.ticker('2020-01-01T00:01:01.5Z', 110), self.product_code)
+        # The closed candles are not read from the DB
+        with patch('app.models.candle.get_candle') as mock_get_candle:
+            self.assertEqual(aggregator.update(self.ticker('2020-01-01T00:00:30.5Z', 130), self.product_code), [])
+            mock_get_candle.assert_not_called()
+        aggregator.flush(force=True)
+        time = datetime.datetime(2020, 1, 1)
+        self.assertEqual(self.values('1s', time + datetime.timedelta(seconds=30)), (130, 130, 130, 130, 1))
+        # The close is not replaced by the late ticker
+        self.assertEqual(self.values('1m', time), (100, 100, 130, 100, 2))
+        self.assertEqual(self.values('1h', time), (100, 110, 130, 100, 3))
+
+        # The same after the writes are committed
+        writer.flush()
+        hotcache.CACHE.clear()
+        self.assertEqual(self.values('1s', time + datetime.timedelta(seconds=30)), (130, 130, 130, 130, 1))
+        self.assertEqual(self.values('1m', time), (100, 100, 130, 100, 2))
+
+    def test_rollup(self):
+        durations = config.parse_durations('1m, 5m, 15m, 1h')
+        with base.connect() as conn:
+            for duration in durations:
+                base.create_candle_table(conn.cursor(), get_candle_table_name(self.product_code, duration))
+
+        random.seed(15)
+        aggregator = CandleAggregator(flush_interval=0, durations=durations)
+        start = datetime.datetime(2020, 1, 1, 23, 10)
+        expected = {duration: {} for duration in durations}
+        price = 1000.0
+        for i in range(1500):
+            time = start + datetime.timedelta(seconds=7 * i)
+            price += random.gauss(0, 10)
+            aggregator.update(self.ticker(time.isoformat() + '.5Z', price, i % 3), self.product_code)
+            for duration, delta in durations.items():
+                candle_time = datetime.datetime.min + (time - datetime.datetime.min) // delta * delta
+                o, c, h, l, v = expected[duration].get(candle_time, (price, price, price, price, 0))
+                expected[duration][candle_time] = (o, price, max(h, price), min(l, price), v + i % 3)
+        aggregator.flush(force=True)
+
+        for duration in durations:
+            with self.subTest(duration=duration):
+                df = get_all_candles(self.product_code, duration, 1000)
+                self.assertEqual(df.times(), sorted(expected[duration]))
+                for c in df.candles:
+                    o, close, h, l, v = expected[duration][c.time]
+                    self.assertEqual((c.open, c.close, c.high, c.low), (o, close, h, l))
+                    self.assertAlmostEqual(c.volume, v)
@@ -0,0 +1,36 @@
+import datetime
+from unittest import TestCase
+
+from app.models.candle import Candle
+from app.models.dfcandle import DataFrameCandle
+
+
+class TestDataFrameCandle(TestCase):
+    def setUp(self):
+        start = datetime.datetime(2020, 1, 1)
+        self.rows = [
+            (start + datetime.timedelta(minutes=i), 100.0 + i, 101.0 + i, 102.0 + i, 99.0 + i, 1.0)
+            for i in range(5)
+        ]
+
+    def test_from_rows(self):
+        df = DataFrameCandle.from_rows('BTC_JPY', '1m', self.rows)
+        self.assertEqual(df.length(), 5)
+        self.assertEqual(df.times(), [row[0] for row in self.rows])
+        self.assertEqual(df.closes().tolist(), [row[2] for row in self.rows])
+
+    def test_candles(self):
+        df = DataFrameCandle.from_rows('BTC_JPY', '1m', self.rows)
+        self.assertEqual(len(df.candles), 5)
+        self.assertEqual(type(df.candles[0]), Candle)
+        self.assertEqual(df.candles[-1].time, self.rows[-1][0])
+        self.assertEqual(df.candles[-1].close, self.rows[-1][2])
+        self.assertIs(df.candles[1], df.candles[1])
+        self.assertEqual([c.open for c in df.candles[1:3]], [101.0, 102.0])
+
+    def test_same_as_candles(self):
+        candles = [Candle('BTC_JPY', '1m', *row) for row in self.rows]
+        df1 = DataFrameCandle('BTC_JPY', '1m', candles)
+        df2 = DataFrameCandle.from_rows('BTC_JPY', '1m', self.rows)
+        self.assertEqual(df1.getall(), df2.getall())
+        self.assertEqual(df1.getall()['candles'][0]['time'], self.rows[0][0])
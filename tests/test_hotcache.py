@@ -0,0 +1,117 @@
+import datetime
+from unittest import TestCase
+from unittest.mock import patch
+
+import numpy as np
+
+from app.models import base, hotcache, writer
+from app.models.candle import Candle, get_all_candles, get_candles_after_time
+from tests.helpers import TempDBTestCase
+
+
+class TestCandleBuffer(TestCase):
+    def row(self, t):
+        return (t, t, t, t, t, 1)
+
+    def test_ring(self):
+        buffer = hotcache.CandleBuffer(5)
+        for t in range(8):
+            buffer.put(self.row(t))
+        self.assertEqual(buffer.rows()[:, 0].tolist(), [3, 4, 5, 6, 7])
+        self.assertEqual(buffer.rows(2)[:, 0].tolist(), [6, 7])
+
+        buffer.put((7, 7, 8, 8, 7, 2))
+        self.assertEqual(buffer.rows(1).tolist(), [[7, 7, 8, 8, 7, 2]])
+
+    def test_late(self):
+        buffer = hotcache.CandleBuffer(5)
+        for t in (0, 2, 4):
+            buffer.put(self.row(t))
+        buffer.complete = True
+        buffer.put(self.row(3))
+        buffer.put((2, 2, 2, 9, 2, 1))
+        self.assertEqual(buffer.rows()[:, 0].tolist(), [0, 2, 3, 4])
+        self.assertEqual(buffer.rows()[1, 3], 9)
+        self.assertTrue(buffer.complete)
+
+        buffer.put(self.row(-1))
+        self.assertEqual(len(buffer), 4)
+        self.assertFalse(buffer.complete)
+
+    def test_prepend(self):
+        buffer = hotcache.CandleBuffer(5)
+        for t in (5, 6, 7):
+            buffer.put(self.row(t))
+        buffer.prepend(np.array([self.row(t) for t in range(1, 7)], dtype=np.float64))
+        self.assertEqual(buffer.rows()[:, 0].tolist(), [3, 4, 5, 6, 7])
+        buffer.discard_before(5)
+        self.assertEqual(buffer.rows()[:, 0].tolist(), [5, 6, 7])
+
+
+class TestHotCache(TempDBTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product_code = 'BTC_JPY'
+        self.start = datetime.datetime(2020, 1, 1)
+
+        # Candles written before a restart
+        for i in range(50):
+            Candle(self.product_code, '1m', self.start + datetime.timedelta(minutes=i), i, i, i, i, 1).create()
+        writer.flush()
+        hotcache.CACHE.clear()
+
+    def test_fallback(self):
+        for i in range(50, 60):
+            Candle(self.product_code, '1m', self.start + datetime.timedelta(minutes=i), i, i, i, i, 1).create()
+        df = get_all_candles(self.product_code, '1m', 10)
+        self.assertEqual(df.closes().tolist(), list(range(50, 60)))
+
+        # Older candles are read from the DB once
+        df = get_all_candles(self.product_code, '1m', 30)
+        self.assertEqual(df.closes().tolist(), list(range(30, 60)))
+        with patch('app.models.base.connect') as mock_connect:
+            df = get_all_candles(self.product_code, '1m', 30)
+            self.assertEqual(df.closes().tolist(), list(range(30, 60)))
+            df = get_candles_after_time(self.product_code, '1m', self.start + datetime.timedelta(minutes=55))
+            self.assertEqual(df.closes().tolist(), list(range(55, 60)))
+            mock_connect.assert_not_called()
+
+    def test_complete(self):
+        df = get_all_candles(self.product_code, '1m', 100)
+        self.assertEqual(df.length(), 50)
+        with patch('app.models.base.connect') as mock_connect:
+            self.assertEqual(get_all_candles(self.product_code, '1m', 100).length(), 50)
+            self.assertEqual(get_candles_after_time(self.product_code, '1m', datetime.datetime(2019, 1, 1)).length(), 50)
+            mock_connect.assert_not_called()
+
+    def test_merge(self):
+        cache = hotcache.HotCache(10)
+        for t in (0, 2, 4):
+            cache.put(self.product_code, '1m', (t, t, t, t, t, 1))
+        # high, low and volume of a late ticker are merged, the close stays
+        self.assertEqual(cache.merge(self.product_code, '1m', (2, 9, 9, 9, -1, 1)), (2, 2, 2, 9, -1, 2))
+        # A candle between the cached ones is new
+        self.assertEqual(cache.merge(self.product_code, '1m', (3, 5, 5, 5, 5, 1)), (3, 5, 5, 5, 5, 1))
+        self.assertEqual(cache.latest(self.product_code, '1m', 10)[0][:, 0].tolist(), [0, 2, 3, 4])
+        # Not cached
+        self.assertIsNone(cache.merge(self.product_code, '1m', (-1, 5, 5, 5, 5, 1)))
+
+    def test_unknown_key(self):
+        # Reads allocate no buffer
+        cache = hotcache.HotCache(10)
+        self.assertEqual(len(cache.latest('UNKNOWN', '1m', 10)[0]), 0)
+        self.assertIsNone(cache.after('UNKNOWN', '1m', 0))
+        self.assertIsNone(cache.merge('UNKNOWN', '1m', (0, 1, 1, 1, 1, 1)))
+        cache.prepend('UNKNOWN', '1m', np.empty((0, 6)), True)
+        self.assertEqual(cache.buffers, {})
+        self.assertEqual(cache.misses, 2)
+
+    def test_import(self):
+        self.assertEqual(get_all_candles(self.product_code, '1m', 100).length(), 50)
+        # Candles imported by another process
+        with base.connect() as conn, conn:
+            conn.execute('insert into BTC_JPY_1m (time, open, close, high, low, volume) values (?, 1, 1, 1, 1, 1)',
+                         (base.to_epoch_ms(self.start - datetime.timedelta(minutes=1)),))
+        with patch.object(base, 'IMPORT_CHECK_INTERVAL', 0):
+            base.mark_imported()
+            self.assertEqual(get_all_candles(self.product_code, '1m', 100).length(), 51)
@@ -0,0 +1,90 @@
+import csv
+import datetime
+import gzip
+import json
+import random
+
+from config import config
+from app.models import importer
+from app.models.candle import create_or_update_candle, get_all_candles
+from bitflyer.bitflyer import Ticker
+from tests.helpers import random_walk, TempDBTestCase
+
+
+class TestImporter(TempDBTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product_code = 'BTC_JPY'
+
+        start = datetime.datetime(2020, 1, 1, 23, 58)
+        self.ticks = []
+        for i, price in enumerate(random_walk(19, 400)):
+            time = start + datetime.timedelta(milliseconds=random.randint(0, 2000) + 1000 * i)
+            self.ticks.append((time.isoformat(timespec='microseconds') + '5Z', price - 50, price + 50, random.random()))
+        self.ticks.sort()
+
+    def candles(self, duration):
+        df = get_all_candles(self.product_code, duration, 10000)
+        return [(c.time, c.open, c.close, c.high, c.low, round(c.volume, 9)) for c in df.candles]
+
+    def test_ticks(self):
+        # Candles created by the tickers one by one
+        for timestamp, bid, ask, volume in self.ticks:
+            ticker = Ticker(self.product_code, '', timestamp, 0, bid, ask, 0, 0, 0, 0, 0, 0, bid, volume, 0)
+            for duration in config.Config.durations:
+                create_or_update_candle(ticker, self.product_code, duration)
+        expected = {duration: self.candles(duration) for duration in config.Config.durations}
+
+        config.Config.db_name = self.path('import.sql')
+        with gzip.open(self.path('ticks.csv.gz'), 'wt', newline='') as f:
+            w = csv.writer(f)
+            w.writerow(['timestamp', 'best_bid', 'best_ask', 'volume'])
+            w.writerows(self.ticks)
+        results = importer.import_files([self.path('ticks.csv.gz')], self.product_code)
+        self.assertEqual(results[self.path('ticks.csv.gz')][0], 400)
+        for duration in config.Config.durations:
+            with self.subTest(duration=duration):
+                self.assertEqual(self.candles(duration), expected[duration])
+
+    def test_ohlcv(self):
+        start = 1577836800
+        with open(self.path('candles.jsonl'), 'w') as f:
+            for i in range(120):
+                f.write(json.dumps({'time': start + 60 * i, 'open': i, 'close': i + 1, 'high': i + 2, 'low': i - 1, 'volume': 1}) + '\n')
+        # Importing the same file again replaces the candles
+        for _ in range(2):
+            importer.import_files([self.path('candles.jsonl')], self.product_code, duration='1m')
+            self.assertEqual(len(self.candles('1m')), 120)
+            self.assertEqual(self.candles('1m')[0], (datetime.datetime(2020, 1, 1), 0, 1, 2, -1, 1))
+            self.assertEqual(self.candles('1h'), [
+                (datetime.datetime(2020, 1, 1, 0), 0, 60, 61, -1, 60),
+                (datetime.datetime(2020, 1, 1, 1), 60, 120, 121, 59, 60)
+            ])
+        self.assertIsNone(get_all_candles(self.product_code, '1s', 10))
+
+    def test_parallel(self):
+        # Files of each hour
+        for hour in range(3):
+            with open(self.path('ticks{}.csv'.format(hour)), 'w', newline='') as f:
+                w = csv.writer(f)
+                w.writerow(['exec_date', 'price', 'size'])
+                for i in range(60):
+                    w.writerow(['2020-01-01T{:02d}:{:02d}:30Z'.format(hour, i), 100 * hour + i, 1])
+        paths = [self.path('ticks{}.csv'.format(hour)) for hour in range(3)]
+        results = importer.import_files(paths, self.product_code, workers=3)
+        self.assertEqual(sorted(results), paths)
+        self.assertEqual(len(self.candles('1m')), 180)
+        self.assertEqual([c[1:] for c in self.candles('1h')], [(0, 59, 59, 0, 60), (100, 159, 159, 100, 60), (200, 259, 259, 200, 60)])
+        self.assertEqual(self.candles('1d'), [(datetime.datetime(2020, 1, 1), 0, 259, 259, 0, 180)])
+
+    def test_invalid_fields(self):
+        with open(self.path('candles.jsonl'), 'w') as f:
+            f.write(json.dumps({'time': 1577836800, 'open': 1, 'close': 1, 'high': 1, 'low': 1, 'volume': 1}) + '\n')
+            f.write(json.dumps({'time': 1577836860, 'open': 1, 'close': 1, 'high': 1, 'volume': 1}) + '\n')
+        with self.assertRaisesRegex(ValueError, 'candles.jsonl:2: no value of low'):
+            list(importer.read_chunks(self.path('candles.jsonl')))
+
+        with open(self.path('ticks.csv'), 'w', newline='') as f:
+            csv.writer(f).writerows([['id', 'price', 'size'], [1, 100, 1]])
+        with self.assertRaisesRegex(ValueError, 'No time field'):
+            list(importer.read_chunks(self.path('ticks.csv')))
@@ -0,0 +1,96 @@
+import datetime
+import json
+from unittest import TestCase
+
+from utils import incremental, mathlib
+from tests.helpers import random_walk
+
+
+class FakeCandle(object):
+    def __init__(self, time, high, low, close):
+        self.time = time
+        self.open = close
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = 1.0
+
+
+class TestIncremental(TestCase):
+    def setUp(self):
+        start = datetime.datetime(2020, 1, 1)
+        self.candles = [
+            FakeCandle(start + datetime.timedelta(minutes=i), price + 300, price - 300, price)
+            for i, price in enumerate(random_walk(0, 300))
+        ]
+        self.closes = [c.close for c in self.candles]
+
+    def feed(self, indicator, names):
+        '''
+        Feeds the candles, each of them first as an open candle, and returns the latest values
+        '''
+        results = {name: [] for name in names}
+        for i, c in enumerate(self.candles):
+            indicator.update(FakeCandle(c.time, c.high + 100, c.low - 100, c.close + 500))
+            indicator.update(c)
+            if i == len(self.candles) // 2:
+                indicator = incremental.Indicator.from_state(json.loads(json.dumps(indicator.state())))
+            for name in names:
+                values = getattr(indicator, name)
+                results[name].append(values[len(values)-1])
+        return results
+
+    def assertListAlmostEqual(self, expected, actual):
+        self.assertEqual(len(expected), len(actual))
+        for e, a in zip(expected, actual):
+            if e is None:
+                self.assertIsNone(a)
+            else:
+                self.assertAlmostEqual(e, a, delta=1e-6)
+
+    def test_sma_ema_rsi(self):
+        patterns = [
+            (incremental.Sma(14), mathlib.sma(14, self.closes)),
+            (incremental.Ema(14), mathlib.ema(14, self.closes)),
+            (incremental.Rsi(14), mathlib.rsi(14, self.closes)),
+        ]
+        for indicator, expected in patterns:
+            with self.subTest(indicator=type(indicator).__name__):
+                self.assertListAlmostEqual(expected, self.feed(indicator, ['values'])['values'])
+
+    def test_bbands(self):
+        results = self.feed(incremental.Bbands(20, 2), ['up', 'mid', 'down'])
+        for name, expected in zip(['up', 'mid', 'down'], mathlib.bbands(20, 2, self.closes)):
+            self.assertListAlmostEqual(expected, results[name])
+
+    def test_macd(self):
+        results = self.feed(incremental.Macd(12, 26, 9), ['macd', 'signal', 'histogram'])
+        for name, expected in zip(['macd', 'signal', 'histogram'], mathlib.macd(12, 26, 9, self.closes)):
+            self.assertListAlmostEqual(expected, results[name])
+
+    def test_ichimoku(self):
+        results = self.feed(incremental.Ichimoku(), ['tenkan', 'base', 'pre1', 'pre2', 'delay'])
+        tenkan, base, pre1, pre2, _ = mathlib.ichimoku(
+            [c.high for c in self.candles], [c.low for c in self.candles], self.closes)
+        self.assertListAlmostEqual(tenkan, results['tenkan'])
+        self.assertListAlmostEqual(base, results['base'])
+        self.assertListAlmostEqual(pre1[:len(self.candles)], results['pre1'])
+        self.assertListAlmostEqual(pre2[:len(self.candles)], results['pre2'])
+        # The latest delay is the close of the latest candle
+        self.assertListAlmostEqual([None] * 26 + self.closes[26:], results['delay'])
+
+    def test_candles(self):
+        results = self.feed(incremental.Candles(), ['values'])['values']
+        self.assertEqual([(c.time, c.close, c.high, c.low) for c in results], [(c.time, c.close, c.high, c.low) for c in self.candles])
+        self.assertIsInstance(results[-1], incremental.CandleRecord)
+
+    def test_abstract(self):
+        with self.assertRaises(TypeError):
+            incremental.Indicator()
+
+    def test_recent_values(self):
+        values = incremental.RecentValues()
+        for v in range(5):
+            values.append(v)
+        self.assertEqual(len(values), 5)
+        self.assertEqual((values[4], values[3], values[2]), (4, 3, None))
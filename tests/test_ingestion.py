@@ -0,0 +1,110 @@
+import datetime
+import queue
+import random
+import threading
+from unittest import TestCase
+
+from config import config
+from app.models import base, ingestion
+from app.models.candle import CandleAggregator, get_all_candles
+from bitflyer.bitflyer import TickerRecord
+from tests.helpers import random_walk, TempDBTestCase
+
+
+class TestTickerQueue(TestCase):
+    def setUp(self):
+        self.start = base.to_epoch_ms(datetime.datetime(2020, 1, 1)) * 1000
+
+    def ticker(self, tick_id, seconds, price=100, volume=1, product_code='BTC_JPY'):
+        return TickerRecord(product_code, tick_id, self.start + int(seconds * 1000000), price, price, price, volume)
+
+    def queue(self, policy, maxsize=3, dedup_window=100):
+        return ingestion.TickerQueue(maxsize, policy, dedup_window, datetime.timedelta(seconds=1))
+
+    def test_drop_oldest(self):
+        q = self.queue('drop_oldest')
+        for i in range(5):
+            q.put(self.ticker(i, i))
+        self.assertEqual([q.get().tick_id for _ in range(3)], [2, 3, 4])
+        self.assertEqual(q.stats()['dropped'], 2)
+        with self.assertRaises(queue.Empty):
+            q.get(timeout=0.01)
+
+    def test_block(self):
+        q = self.queue('block')
+        for i in range(3):
+            q.put(self.ticker(i, i))
+        with self.assertRaises(queue.Full):
+            q.put(self.ticker(3, 3), timeout=0.01)
+
+        t = threading.Thread(target=q.put, args=(self.ticker(4, 4),))
+        t.start()
+        self.assertEqual(q.get().tick_id, 0)
+        t.join(1)
+        self.assertEqual([q.get().tick_id for _ in range(3)], [1, 2, 4])
+
+    def test_coalesce(self):
+        q = self.queue('coalesce')
+        prices = [100, 105, 95, 101, 110, 90, 102]
+        for i, price in enumerate(prices):
+            q.put(self.ticker(i, i * 0.3, price, volume=0.5))
+        # Tickers of 0s and 1s
+        deltas = [q.get(timeout=1) for _ in range(2)]
+        self.assertEqual([d.ohlcv() for d in deltas], [[100, 101, 105, 95, 2.0], [110, 102, 110, 90, 1.5]])
+        self.assertEqual(deltas[0].tick_id, 3)
+        self.assertEqual(q.stats()['coalesced'], 5)
+
+        # A ticker older than the newest one is not merged
+        q.put(self.ticker(10, 5))
+        q.put(self.ticker(11, 4.5))
+        self.assertEqual(q.qsize(), 2)
+
+    def test_dedup(self):
+        q = ingestion.TickerQueue(10, 'drop_oldest', 2)
+        for tick_id in (1, 2, 1, 3, 1):
+            q.put(self.ticker(tick_id, tick_id))
+        self.assertEqual(q.qsize(), 4)
+        self.assertEqual(q.stats()['duplicates'], 1)
+        q.put(self.ticker(1, 1, product_code='ETH_JPY'))
+        self.assertEqual(q.qsize(), 5)
+
+    def test_policy(self):
+        with self.assertRaises(ValueError):
+            self.queue('latest')
+
+
+class TestCoalescedCandles(TempDBTestCase):
+    init_db = False
+
+    def setUp(self):
+        super().setUp()
+        self.product_code = 'BTC_JPY'
+
+        start = base.to_epoch_ms(datetime.datetime(2020, 1, 1, 23, 58)) * 1000
+        self.tickers = []
+        for i, price in enumerate(random_walk(25, 1000)):
+            self.tickers.append(TickerRecord(self.product_code, i, start + i * 250000, price, price, price, random.random()))
+
+    def candles(self, name, q):
+        config.Config.db_name = self.path(name)
+        base.init()
+        aggregator = CandleAggregator(0)
+        for ticker in self.tickers:
+            q.put(ticker)
+            # The consumer gets a ticker for every 5 tickers put
+            if ticker.tick_id % 5 == 4:
+                aggregator.update(q.get(), self.product_code)
+        while q.qsize():
+            aggregator.update(q.get(), self.product_code)
+        aggregator.flush(True)
+        return {
+            duration: [(c.time, c.open, c.close, c.high, c.low, round(c.volume, 9)) for c in get_all_candles(self.product_code, duration, 1000).candles]
+            for duration in config.Config.durations
+        }
+
+    def test_same_candles(self):
+        expected = self.candles('raw.sql', ingestion.TickerQueue(0, 'drop_oldest', 0))
+        q = ingestion.TickerQueue(0, 'coalesce', 0, datetime.timedelta(seconds=1))
+        self.assertEqual(self.candles('coalesced.sql', q), expected)
+        self.assertGreater(q.stats()['coalesced'], 0)
+        self.assertEqual(q.stats()['dropped'], 0)
@@ -0,0 +1,141 @@
+import math
+from unittest import TestCase
+
+import numpy as np
+
+from utils import mathlib, npmathlib
+from tests.helpers import random_walk
+
+
+def naive_sma(period, values):
+    return [None if i < period - 1 else sum(values[i-period+1: i+1]) / period for i in range(len(values))]
+
+
+def naive_ema(period, values):
+    result = [None for _ in values]
+    a = 2 / (period + 1)
+    for i in range(period - 1, len(values)):
+        if i == period - 1:
+            result[i] = sum(values[:period]) / period
+        else:
+            result[i] = result[i-1] + a * (values[i] - result[i-1])
+    return result
+
+
+def naive_historical_volatility(period, values):
+    buffer = [None] + [math.log(values[i] - values[i-1] / values[i]) for i in range(1, len(values))]
+    return [None if i < period else math.sqrt(np.var(buffer[i-period+1: i+1])) * 100 for i in range(len(values))]
+
+
+class TestMathlib(TestCase):
+    def setUp(self):
+        self.closes = list(random_walk(0, 500))
+
+    def assertListAlmostEqual(self, expected, actual, delta=1e-6):
+        self.assertEqual(len(expected), len(actual))
+        for e, a in zip(expected, actual):
+            if e is None:
+                self.assertIsNone(a)
+            else:
+                self.assertAlmostEqual(e, a, delta=delta)
+
+    def test_sma(self):
+        for period in (1, 3, 14, 50):
+            with self.subTest(period=period):
+                self.assertListAlmostEqual(naive_sma(period, self.closes), mathlib.sma(period, self.closes))
+
+    def test_ema(self):
+        for period in (1, 3, 14, 50):
+            with self.subTest(period=period):
+                self.assertListAlmostEqual(naive_ema(period, self.closes), mathlib.ema(period, self.closes))
+
+    def test_period_longer_than_values(self):
+        self.assertEqual(mathlib.sma(5, [1, 2, 3]), [None, None, None])
+        self.assertEqual(mathlib.ema(5, [1, 2, 3]), [None, None, None])
+        self.assertEqual(mathlib.rsi(5, [1, 2, 3]), [None, None, None])
+
+    def test_bbands(self):
+        up, mid, down = mathlib.bbands(20, 2, self.closes)
+        for i in range(19, len(self.closes)):
+            window = self.closes[i-19: i+1]
+            sigma = np.std(window, ddof=1)
+            self.assertAlmostEqual(mid[i], sum(window) / 20, delta=1e-6)
+            self.assertAlmostEqual(up[i] - mid[i], 2 * sigma, delta=1e-6)
+            self.assertAlmostEqual(mid[i] - down[i], 2 * sigma, delta=1e-6)
+
+    def test_rsi(self):
+        values = mathlib.rsi(14, self.closes)
+        for i in range(14, len(self.closes)):
+            diffs = [self.closes[j] - self.closes[j-1] for j in range(i-13, i+1)]
+            up = sum(d for d in diffs if d > 0)
+            down = sum(-d for d in diffs if d <= 0)
+            self.assertAlmostEqual(values[i], up / (up + down + 10**-10) * 100, delta=1e-6)
+
+    def test_macd(self):
+        macd, signal, histogram = mathlib.macd(12, 26, 9, self.closes)
+        short_ema = naive_ema(12, self.closes)
+        long_ema = naive_ema(26, self.closes)
+        expected_macd = [None if i < 26 else short_ema[i] - long_ema[i] for i in range(len(self.closes))]
+        expected_signal = [None for _ in range(26)] + naive_ema(9, expected_macd[26:])
+        self.assertListAlmostEqual(expected_macd, macd)
+        self.assertListAlmostEqual(expected_signal, signal)
+        for i in range(len(self.closes)):
+            if signal[i] is None:
+                self.assertIsNone(histogram[i])
+            else:
+                self.assertAlmostEqual(histogram[i], macd[i] - signal[i], delta=1e-6)
+
+    def test_ichimoku(self):
+        highs = [c + 500 for c in self.closes]
+        lows = [c - 500 for c in self.closes]
+        tenkan, base, pre1, pre2, delay = mathlib.ichimoku(highs, lows, self.closes)
+        self.assertEqual(len(pre1), len(self.closes) + 26)
+        self.assertEqual(len(delay), len(self.closes) - 26)
+        for i in range(52, len(self.closes)):
+            self.assertEqual(tenkan[i], (max(highs[i-9: i]) + min(lows[i-9: i])) / 2)
+            self.assertEqual(pre2[i+26], (max(highs[i-52: i]) + min(lows[i-52: i])) / 2)
+        self.assertIsNone(tenkan[51])
+
+    def test_historical_volatility(self):
+        for period in (1, 21, 63):
+            with self.subTest(period=period):
+                self.assertListAlmostEqual(
+                    naive_historical_volatility(period, self.closes), mathlib.historical_volatility(period, self.closes))
+
+    def test_historical_volatility_not_finite(self):
+        # The first log return is NaN
+        closes = [self.closes[0], 0.0] + self.closes[2:]
+        result = npmathlib.historical_volatility(21, closes)
+        self.assertTrue(np.isnan(result[:22]).all())
+        # The windows without the first two log returns are as without the zero
+        self.assertListAlmostEqual(naive_historical_volatility(21, self.closes)[23:], result[23:].tolist())
+
+    def test_backend_returns_nan(self):
+        values = npmathlib.sma(3, np.array([3.0, 4.0, 5.0, 9.0]))
+        self.assertTrue(math.isnan(values[0]))
+        self.assertEqual(values[2:].tolist(), [4.0, 6.0])
+
+    def test_matrix(self):
+        periods = [1, 5, 14, 600]
+        patterns = [
+            (npmathlib.sma_matrix, npmathlib.sma),
+            (npmathlib.ema_matrix, npmathlib.ema),
+            (npmathlib.rsi_matrix, npmathlib.rsi),
+        ]
+        for matrix, single in patterns:
+            with self.subTest(indicator=single.__name__):
+                result = matrix(periods, self.closes)
+                self.assertEqual(result.shape, (len(periods), len(self.closes)))
+                for row, period in enumerate(periods):
+                    np.testing.assert_array_equal(result[row], single(period, self.closes))
+
+    def test_bbands_matrix(self):
+        ns, ks = [10, 20], [1.5, 2.0]
+        up, mid, down = npmathlib.bbands_matrix(ns, ks, self.closes)
+        self.assertEqual(up.shape, (2, 2, len(self.closes)))
+        for row, n in enumerate(ns):
+            for col, k in enumerate(ks):
+                expected_up, expected_mid, expected_down = npmathlib.bbands(n, k, self.closes)
+                np.testing.assert_array_equal(up[row, col], expected_up)
+                np.testing.assert_array_equal(mid[row], expected_mid)
+                np.testing.assert_array_equal(down[row, col], expected_down)
@@ -0,0 +1,74 @@
+import datetime
+import sqlite3
+
+import pytz
+
+from config import config
+from app.models import base, candle, events, migrate
+from tests.helpers import TempDBTestCase
+
+
+class TestMigrate(TempDBTestCase):
+    init_db = False
+
+    def setUp(self):
+        super().setUp()
+        self.table = base.get_candle_table_name(config.Config.product_code, '1m')
+        self.start = datetime.datetime(2020, 1, 1, 9, 30)
+
+        # Schema version 0
+        conn = sqlite3.connect(config.Config.db_name, detect_types=sqlite3.PARSE_DECLTYPES)
+        conn.execute(
+            'create table {}(time timestamp primary key not null, open float, close float, high float, low float, volume float)'.format(self.table))
+        conn.execute(
+            'create table signal_events(time timestamp primary key not null, product_code string, side string, price float, size float, notes string)')
+        for i in range(10):
+            conn.execute(
+                'insert into {} values (?, ?, ?, ?, ?, ?)'.format(self.table),
+                (self.start + datetime.timedelta(minutes=i), 100.0 + i, 101.0 + i, 102.0 + i, 99.0 + i, 1.5))
+        conn.execute(
+            'insert into signal_events values (?, ?, ?, ?, ?, ?)',
+            (self.start + datetime.timedelta(seconds=1.25), 'BTC_JPY', 'BUY', 100.0, 1.0, ''))
+        # Schema version 1
+        conn.execute(
+            'create table optimize_results(product_code string, duration string, params string, created_at timestamp)')
+        conn.execute('insert into optimize_results values (?, ?, ?, ?)', ('BTC_JPY', '1m', 'null', self.start))
+        conn.commit()
+        conn.close()
+
+    def test_epoch_ms(self):
+        dt = datetime.datetime(2020, 1, 1, 0, 0, 1, 500000)
+        self.assertEqual(base.to_epoch_ms(dt), 1577836801500)
+        self.assertEqual(base.from_epoch_ms(1577836801500), dt)
+        self.assertEqual(base.to_epoch_ms(pytz.timezone('Asia/Tokyo').localize(dt + datetime.timedelta(hours=9))), 1577836801500)
+
+    def test_migrate(self):
+        base.init()
+        with base.connect() as conn:
+            self.assertEqual(migrate.get_schema_version(conn), base.SCHEMA_VERSION)
+            self.assertEqual(migrate.legacy_tables(conn), [])
+            self.assertEqual(migrate.migrate(conn), 0)
+            time = conn.execute('select time from {} order by time limit 1'.format(self.table)).fetchone()[0]
+        self.assertEqual(time, base.to_epoch_ms(self.start))
+
+        df = candle.get_all_candles(config.Config.product_code, '1m', 100)
+        self.assertEqual(df.times(), [self.start + datetime.timedelta(minutes=i) for i in range(10)])
+        self.assertEqual(df.closes().tolist(), [101.0 + i for i in range(10)])
+
+        signal_events = events.get_signal_events_by_count(10)
+        self.assertEqual(signal_events.signals[0].time, self.start + datetime.timedelta(seconds=1.25))
+
+        # The cache of optimized parameters is created again
+        with base.connect() as conn:
+            columns = {row[1]: row[2].lower() for row in conn.execute('pragma table_info(optimize_results)')}
+            self.assertEqual(columns['created_at'], 'integer')
+            self.assertEqual(columns['params'], 'text')
+            self.assertEqual(conn.execute('select count(*) from optimize_results').fetchone()[0], 0)
+
+    def test_write(self):
+        base.init()
+        c = candle.Candle(config.Config.product_code, '1m', self.start + datetime.timedelta(minutes=10), 1, 2, 3, 0, 1)
+        c.create()
+        self.assertEqual(candle.get_candle(config.Config.product_code, '1m', c.time).close, 2)
+        df = candle.get_candles_after_time(config.Config.product_code, '1m', self.start + datetime.timedelta(minutes=9))
+        self.assertEqual(df.times(), [self.start + datetime.timedelta(minutes=i) for i in (9, 10)])
@@ -0,0 +1,36 @@
+from unittest import TestCase
+
+from app.models import optimizer, search
+from app.models.dfcandle import DataFrameCandle
+from tests.helpers import random_walk_candles
+
+
+class TestOptimizer(TestCase):
+    def setUp(self):
+        self.df = DataFrameCandle('BTC_JPY', '1m', random_walk_candles(1, 150))
+
+    def test_columns(self):
+        df = optimizer.from_columns('BTC_JPY', '1m', optimizer.to_columns(self.df))
+        self.assertEqual(df.times(), self.df.times())
+        self.assertEqual(df.closes().tolist(), self.df.closes().tolist())
+
+    def test_merge(self):
+        results = [(0.0, 7, 14), (10.0, 8, 14), (10.0, 9, 14), (5.0, 10, 14)]
+        self.assertEqual(optimizer.merge(results), (10.0, 8, 14))
+
+    def test_same_as_serial(self):
+        self.assertEqual(self.df.optimize_params(2), self.df.optimize_params(1))
+
+    def test_search(self):
+        # The budget is split among the searches of the indicators in both cases
+        serial = self.df.optimize_params(1, search.RandomSearch(search.Budget(max_evals=40), seed=1))
+        parallel = self.df.optimize_params(2, search.RandomSearch(search.Budget(max_evals=40), seed=1))
+        self.assertEqual(parallel, serial)
+        tasks = optimizer.search_tasks(search.SuccessiveHalving(search.Budget(max_evals=10, max_seconds=60)), 2)
+        self.assertEqual([indicator for indicator, _, _ in tasks], ['ema', 'bb', 'macd', 'rsi'])
+        self.assertEqual([kwargs['strategy'].budget.max_evals for _, _, kwargs in tasks], [3, 3, 2, 2])
+        self.assertEqual([kwargs['strategy'].budget.max_seconds for _, _, kwargs in tasks], [30, 30, 30, 30])
+
+    def test_context(self):
+        # The workers are not forked from the process running the threads
+        self.assertIn(optimizer.get_context().get_start_method(), ('forkserver', 'spawn'))
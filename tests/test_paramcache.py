@@ -0,0 +1,43 @@
+import datetime
+from unittest.mock import patch
+
+from app.models import paramcache
+from app.models.dfcandle import DataFrameCandle
+from tests.helpers import random_walk_candles, TempDBTestCase
+
+
+class TestParamCache(TempDBTestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.df = DataFrameCandle('BTC_JPY', '1m', random_walk_candles(6, 200))
+
+    def test_hit(self):
+        params = paramcache.optimize_params(self.df)
+        with patch.object(DataFrameCandle, 'optimize_params') as mock_optimize_params:
+            self.assertEqual(paramcache.optimize_params(self.df), params)
+            mock_optimize_params.assert_not_called()
+
+    def test_key(self):
+        space = paramcache.search_space()
+        key = paramcache.cache_key(self.df, space)
+        df = DataFrameCandle.from_rows('BTC_JPY', '1m', [
+            (c.time, c.open, c.close + (1 if i == 100 else 0), c.high, c.low, c.volume)
+            for i, c in enumerate(self.df.candles)])
+        self.assertNotEqual(paramcache.cache_key(df, space)['content_hash'], key['content_hash'])
+        self.assertEqual(paramcache.cache_key(self.df, space), key)
+
+    def test_none(self):
+        key = paramcache.cache_key(self.df, paramcache.search_space())
+        self.assertEqual(paramcache.get(key), (False, None))
+        paramcache.put(key, None)
+        self.assertEqual(paramcache.get(key), (True, None))
+
+    def test_evict(self):
+        space = paramcache.search_space()
+        for length in range(100, 110):
+            paramcache.put(paramcache.cache_key(self.df.tail(length), space), None)
+        self.assertEqual(paramcache.evict(3, None), 7)
+        self.assertEqual(paramcache.get(paramcache.cache_key(self.df.tail(109), space))[0], True)
+        self.assertEqual(paramcache.get(paramcache.cache_key(self.df.tail(100), space))[0], False)
+        self.assertEqual(paramcache.evict(0, datetime.timedelta(hours=-1)), 3)
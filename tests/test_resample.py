@@ -0,0 +1,61 @@
+import datetime
+from unittest.mock import patch
+
+from config import config
+from app.models import resample
+from app.models.candle import Candle
+from tests.helpers import TempDBTestCase
+
+
+class TestResample(TempDBTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product_code = 'BTC_JPY'
+        self.start = datetime.datetime(2020, 1, 1)
+        # 1m candles of 01:00 - 01:59 (without 01:20)
+        for i in range(60, 120):
+            if i == 80:
+                continue
+            Candle(self.product_code, '1m', self.start + datetime.timedelta(minutes=i), i, i + 1, i + 2, i - 1, 1).create()
+
+    def rows(self, df):
+        return [(c.time, c.open, c.close, c.high, c.low, c.volume) for c in df.candles]
+
+    def test_source_duration(self):
+        for duration, source in (('1m', '1m'), ('15m', '1m'), ('90s', '1s'), ('4h', '1h'), ('1w', '1d')):
+            with self.subTest(duration=duration):
+                self.assertEqual(resample.source_duration(duration), source)
+        with patch.object(config.Config, 'durations', config.parse_durations('1m, 1h')):
+            with self.assertRaises(ValueError):
+                resample.source_duration('90s')
+        with self.assertRaises(ValueError):
+            resample.source_duration('15x')
+
+    def test_get_all_candles(self):
+        df = resample.get_all_candles(self.product_code, '15m', 3)
+        self.assertEqual(df.duration, '15m')
+        self.assertEqual(self.rows(df), [
+            (datetime.datetime(2020, 1, 1, 1, 15), 75, 90, 91, 74, 14),
+            (datetime.datetime(2020, 1, 1, 1, 30), 90, 105, 106, 89, 15),
+            (datetime.datetime(2020, 1, 1, 1, 45), 105, 120, 121, 104, 15)
+        ])
+        self.assertEqual(len(resample.get_all_candles(self.product_code, '15m', 10).candles), 4)
+        self.assertEqual(self.rows(resample.get_all_candles(self.product_code, '30m', 1)),
+                         [(datetime.datetime(2020, 1, 1, 1, 30), 90, 120, 121, 89, 30)])
+
+    def test_get_candles_after_time(self):
+        df = resample.get_candles_after_time(self.product_code, '30m', self.start + datetime.timedelta(minutes=70))
+        self.assertEqual(self.rows(df), [(datetime.datetime(2020, 1, 1, 1, 30), 90, 120, 121, 89, 30)])
+        self.assertIsNone(resample.get_candles_after_time(self.product_code, '30m', self.start + datetime.timedelta(hours=2)))
+
+    def test_cache(self):
+        df = resample.get_all_candles(self.product_code, '15m', 2)
+        df.add_sma(3)
+        stats = resample.CACHE.stats()
+        self.assertEqual(resample.get_all_candles(self.product_code, '15m', 2).columns['close'].tolist(), [105, 120])
+        self.assertEqual(resample.CACHE.stats()['hits'], stats['hits'] + 1)
+
+        # A write of the source candles
+        Candle(self.product_code, '1m', self.start + datetime.timedelta(minutes=120), 120, 200, 200, 120, 1).create()
+        self.assertEqual(resample.get_all_candles(self.product_code, '15m', 2).columns['close'].tolist(), [120, 200])
+        self.assertEqual(resample.CACHE.stats()['hits'], stats['hits'] + 1)
@@ -0,0 +1,47 @@
+import datetime
+
+from app.models import base, retention, writer
+from app.models.candle import Candle
+from tests.helpers import TempDBTestCase
+
+
+class TestRetention(TempDBTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product_code = 'BTC_JPY'
+        self.table = base.get_candle_table_name(self.product_code, '1m')
+
+        start = datetime.datetime(2020, 1, 1)
+        for i in range(3000):
+            Candle(self.product_code, '1m', start + datetime.timedelta(minutes=i), i, i, i, i, 1).create()
+        writer.flush()
+
+    def count(self):
+        with base.connect() as conn:
+            return conn.execute('select count(*), min(open) from {}'.format(self.table)).fetchone()
+
+    def test_delete(self):
+        r = retention.Retention(self.product_code, {'1m': 100, '1h': 0}, batch_size=700)
+        result = r.run_once()
+        self.assertEqual(result['deleted'], {'1m': 2900})
+        self.assertEqual(self.count(), (100, 2900))
+
+        self.assertEqual(r.run_once()['deleted'], {'1m': 0})
+        self.assertEqual(r.stats()['runs'], 2)
+        self.assertEqual(r.stats()['deleted'], 2900)
+
+    def test_vacuum(self):
+        with base.connect() as conn:
+            self.assertEqual(conn.execute('pragma auto_vacuum').fetchone()[0], retention.AUTO_VACUUM_INCREMENTAL)
+        r = retention.Retention(self.product_code, {'1m': 10}, vacuum_pages=100000)
+        result = r.run_once()
+        self.assertGreater(result['vacuumed'], 0)
+        with base.connect() as conn:
+            self.assertEqual(conn.execute('pragma freelist_count').fetchone()[0], 0)
+
+    def test_analyze(self):
+        r = retention.Retention(self.product_code, {'1m': 10}, analyze_interval=3600)
+        self.assertTrue(r.run_once()['analyzed'])
+        self.assertFalse(r.run_once()['analyzed'])
+        with base.connect() as conn:
+            self.assertEqual(conn.execute("select count(*) from sqlite_master where name = 'sqlite_stat1'").fetchone()[0], 1)
@@ -0,0 +1,45 @@
+import random
+from unittest import TestCase
+
+from utils.rolling import RollingExtreme, RollingMax, RollingMin, window_max, window_min
+
+
+class TestRolling(TestCase):
+    def setUp(self):
+        random.seed(0)
+        self.values = [random.randint(0, 50) for _ in range(300)]
+
+    def test_window_max_min(self):
+        for period in (1, 2, 9, 26, 52, 300):
+            with self.subTest(period=period):
+                expected_max = [max(self.values[j: j+period]) for j in range(len(self.values) - period + 1)]
+                expected_min = [min(self.values[j: j+period]) for j in range(len(self.values) - period + 1)]
+                self.assertEqual(window_max(period, self.values).tolist(), expected_max)
+                self.assertEqual(window_min(period, self.values).tolist(), expected_min)
+
+    def test_incremental(self):
+        for period in (1, 9, 52):
+            with self.subTest(period=period):
+                rolling_max = RollingMax(period)
+                rolling_min = RollingMin(period)
+                for i, value in enumerate(self.values):
+                    rolling_max.append(value)
+                    rolling_min.append(value)
+                    window = self.values[max(0, i-period+1): i+1]
+                    self.assertEqual(rolling_max.value, max(window))
+                    self.assertEqual(rolling_min.value, min(window))
+                    self.assertEqual(rolling_max.is_full(), i + 1 >= period)
+
+    def test_state(self):
+        rolling_max = RollingMax(9)
+        for value in self.values[:100]:
+            rolling_max.append(value)
+        restored = RollingMax.from_state(rolling_max.state())
+        for value in self.values[100:]:
+            rolling_max.append(value)
+            restored.append(value)
+            self.assertEqual(restored.value, rolling_max.value)
+
+    def test_abstract(self):
+        with self.assertRaises(TypeError):
+            RollingExtreme(9)
@@ -0,0 +1,89 @@
+from unittest import TestCase
+
+from app.models import search
+from app.models.dfcandle import DataFrameCandle
+from tests.helpers import random_walk_candles
+
+
+class TestSearch(TestCase):
+    def setUp(self):
+        self.df = DataFrameCandle('BTC_JPY', '1m', random_walk_candles(4, 400))
+
+    def test_grid_point(self):
+        space = {'a': [1, 2], 'b': [3, 4, 5]}
+        points = [search.grid_point(space, i) for i in range(search.grid_size(space))]
+        self.assertEqual(points, [{'a': a, 'b': b} for a in space['a'] for b in space['b']])
+
+    def test_abstract(self):
+        with self.assertRaises(TypeError):
+            search.Search()
+
+    def test_exhaustive(self):
+        strategy = search.Exhaustive()
+        self.assertEqual(self.df.search('ema', strategy), self.df.optimize_ema())
+        self.assertEqual(self.df.search('bb', strategy), self.df.optimize_bb())
+        self.assertEqual(self.df.search('macd', strategy), self.df.optimize_macd())
+        self.assertEqual(self.df.search('rsi', strategy), self.df.optimize_rsi())
+
+    def test_budget(self):
+        strategies = [
+            search.Exhaustive(search.Budget(max_evals=20)),
+            search.RandomSearch(search.Budget(max_evals=20), seed=1),
+            search.SuccessiveHalving(search.Budget(max_evals=20), samples=50, seed=1),
+            search.CoordinateDescent(search.Budget(max_evals=20))
+        ]
+        for strategy in strategies:
+            with self.subTest(strategy=type(strategy).__name__):
+                result = self.df.search('macd', strategy)
+                self.assertEqual(len(result), 4)
+                self.assertLessEqual(strategy.budget.evals, 20)
+
+    def test_halving_small_budget(self):
+        # A 20x20 grid whose optimum is at (15, 5)
+        space = {'a': list(range(20)), 'b': list(range(20))}
+
+        def objective(params, fraction):
+            return 1000.0 - (params['a'] - 15) ** 2 - (params['b'] - 5) ** 2
+
+        for budget in [search.Budget(max_evals=300), search.Budget(max_evals=3), search.Budget(max_seconds=0)]:
+            with self.subTest(max_evals=budget.max_evals, max_seconds=budget.max_seconds):
+                strategy = search.SuccessiveHalving(budget, seed=1)
+                performance, params = strategy.run(space, objective)
+                self.assertIsNotNone(params)
+                self.assertEqual(performance, objective(params, 1.0))
+                if budget.max_evals is not None:
+                    self.assertLessEqual(budget.evals, budget.max_evals)
+        # Close to the optimum though a part of the grid is sampled
+        self.assertGreater(search.SuccessiveHalving(search.Budget(max_evals=300), seed=1).run(space, objective)[0], 990.0)
+
+    def test_split(self):
+        budgets = search.Budget(max_evals=10, max_seconds=60).split(4)
+        self.assertEqual([budget.max_evals for budget in budgets], [3, 3, 2, 2])
+        self.assertEqual([budget.max_seconds for budget in budgets], [15, 15, 15, 15])
+        budgets = search.Budget(max_seconds=60).split(4, concurrency=2)
+        self.assertEqual([budget.max_evals for budget in budgets], [None] * 4)
+        self.assertEqual([budget.max_seconds for budget in budgets], [30, 30, 30, 30])
+        strategies = search.RandomSearch(search.Budget(max_evals=8), samples=5).split(2)
+        self.assertEqual([(s.budget.max_evals, s.samples) for s in strategies], [(4, 5), (4, 5)])
+
+    def test_not_better_than_exhaustive(self):
+        best = self.df.optimize_rsi()[0]
+        strategies = [
+            search.RandomSearch(samples=30, seed=1),
+            search.SuccessiveHalving(),
+            search.CoordinateDescent()
+        ]
+        for strategy in strategies:
+            with self.subTest(strategy=type(strategy).__name__):
+                performance, period, buy_thread, sell_thread = self.df.search('rsi', strategy)
+                self.assertLessEqual(performance, best)
+                if performance > 0:
+                    self.assertEqual(
+                        performance,
+                        self.df.evaluate('rsi', {'period': period, 'buy_thread': buy_thread, 'sell_thread': sell_thread}))
+
+    def test_get_strategy(self):
+        self.assertIsNone(search.get_strategy('exhaustive'))
+        self.assertEqual(type(search.get_strategy('halving', max_evals=10)), search.SuccessiveHalving)
+        with self.assertRaises(ValueError):
+            search.get_strategy('unknown')
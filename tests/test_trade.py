@@ -0,0 +1,38 @@
+from unittest import TestCase
+
+from app.models import trade
+from app.models.dfcandle import DataFrameCandle
+from tests.helpers import random_walk_candles
+from utils import mathlib
+
+
+class TestTrade(TestCase):
+    def setUp(self):
+        self.df = DataFrameCandle('BTC_JPY', '1m', random_walk_candles(2, 300))
+
+    def assertSameSignals(self, trade_model, with_candles=False):
+        buy, sell = trade_model.signals(self.df)
+        candles = self.df.candles
+        for i in range(1, self.df.length()):
+            args = (i, candles) if with_candles else (i,)
+            self.assertEqual(bool(buy[i]), trade_model.should_buy(*args), i)
+            self.assertEqual(bool(sell[i]), trade_model.should_sell(*args), i)
+
+    def test_signals(self):
+        closes = self.df.closes()
+        self.assertSameSignals(trade.TradeEma(mathlib.ema(7, closes), mathlib.ema(14, closes), 7, 14))
+        self.assertSameSignals(trade.TradeBb(*mathlib.bbands(20, 2.0, closes), 20, 2.0), with_candles=True)
+        self.assertSameSignals(trade.TradeMacd(*mathlib.macd(12, 26, 9, closes), 12, 26, 9))
+        self.assertSameSignals(trade.TradeRsi(mathlib.rsi(14, closes), 14, 30, 70))
+
+    def test_fills(self):
+        buy = [False, True, True, False, True, False, False]
+        sell = [True, True, False, True, True, True, False]
+        self.assertEqual(trade.fills(buy, sell), [1, 3, 4, 5])
+        self.assertEqual(trade.fills([False] * 3, [True] * 3), [])
+
+    def test_performance(self):
+        closes = self.df.closes()
+        trade_model = trade.TradeRsi(mathlib.rsi(14, closes), 14, 30, 70)
+        signal_events = self.df.simulate(trade_model)
+        self.assertEqual(self.df.performance(trade_model), signal_events.profit())
@@ -0,0 +1,60 @@
+import os
+import tempfile
+from unittest import SkipTest, TestCase
+from unittest.mock import patch
+
+from config import config
+from app.models import base
+
+
+webserver = None
+
+
+def setUpModule():
+    global webserver, tmpdir, db_name
+    # TRADE_AI reads the candles when app.controllers is imported
+    tmpdir = tempfile.TemporaryDirectory()
+    db_name = config.Config.db_name
+    config.Config.db_name = os.path.join(tmpdir.name, 'test.sql')
+    base.init()
+    try:
+        from app.controllers import webserver
+    except ImportError as err:
+        raise SkipTest('flask is not available: {}'.format(err))
+
+
+def tearDownModule():
+    config.Config.db_name = db_name
+    tmpdir.cleanup()
+
+
+class TestIndex(TestCase):
+    def setUp(self):
+        self.client = webserver.app.test_client()
+        patcher = patch.object(config.Config, 'durations', config.parse_durations('1s, 1m, 1h, 1d'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_stored_trade_duration(self):
+        with patch.object(config.Config, 'trade_duration', '1m'):
+            self.assertEqual(webserver.view_durations(), (['1s', '1m', '1h', '1d'], 1))
+            r = self.client.get('/')
+        self.assertEqual(r.status_code, 200)
+        self.assertIn(b'active: 1', r.data)
+
+    def test_resampled_trade_duration(self):
+        with patch.object(config.Config, 'trade_duration', '15m'):
+            self.assertEqual(webserver.view_durations(), (['1s', '1m', '15m', '1h', '1d'], 2))
+            r = self.client.get('/')
+        self.assertEqual(r.status_code, 200)
+        self.assertIn(b'active: 2', r.data)
+        self.assertIn(b"changeDuration('15m')", r.data)
+
+
+class TestStats(TestCase):
+    def test_stats(self):
+        r = webserver.app.test_client().get('/api/stats')
+        self.assertEqual(r.status_code, 200)
+        stats = r.get_json()['ai']
+        self.assertIn('optimize_seconds', stats)
+        self.assertIn('staleness', stats)
@@ -0,0 +1,101 @@
+import sqlite3
+import threading
+from unittest.mock import patch
+
+from config import config
+from app.models import base
+from app.models.writer import Writer, merge_rows
+from tests.helpers import TempDBTestCase
+
+
+class TestWriter(TempDBTestCase):
+    init_db = False
+
+    def setUp(self):
+        super().setUp()
+        conn = sqlite3.connect(config.Config.db_name)
+        conn.execute('create table test(id integer primary key, value float)')
+        conn.commit()
+        conn.close()
+
+    def rows(self):
+        conn = sqlite3.connect(config.Config.db_name)
+        rows = conn.execute('select id, value from test order by id').fetchall()
+        conn.close()
+        return rows
+
+    def test_batch(self):
+        writer = Writer(batch_size=50, flush_interval=10, max_queue=1000)
+        for i in range(120):
+            writer.submit('insert into test (id, value) values (?, ?)', (i, 0.0))
+            writer.submit('update test set value = ? where id = ?', (i * 2.0, i))
+        writer.flush()
+        self.assertEqual(self.rows(), [(i, i * 2.0) for i in range(120)])
+        self.assertEqual(writer.stats()['written'], 240)
+        self.assertEqual(writer.depth(), 0)
+        self.assertLessEqual(writer.stats()['batches'], 6)
+
+    def test_backpressure(self):
+        writer = Writer(batch_size=10, flush_interval=0.01, max_queue=5)
+        for i in range(100):
+            writer.submit('insert into test (id, value) values (?, ?)', (i, 1.0))
+        writer.flush()
+        self.assertEqual(len(self.rows()), 100)
+
+    def test_error(self):
+        writer = Writer(batch_size=10, flush_interval=0.01, retry_interval=0.001)
+        writer.submit('insert into unknown (id) values (?)', (1,))
+        writer.flush()
+        self.assertEqual(writer.stats()['errors'], 1)
+        writer.submit('insert into test (id, value) values (?, ?)', (1, 1.0))
+        writer.flush()
+        self.assertEqual(self.rows(), [(1, 1.0)])
+
+    def test_retry(self):
+        writer = Writer(batch_size=10, flush_interval=10, retry_interval=0.001)
+        connect = base.connect
+        with patch('app.models.base.connect', side_effect=[sqlite3.OperationalError('database is locked'), connect()]):
+            writer.submit('insert into test (id, value) values (?, ?)', (1, 1.0))
+            writer.flush()
+        self.assertEqual(self.rows(), [(1, 1.0)])
+        self.assertEqual(writer.stats()['retried'], 1)
+        self.assertEqual(writer.stats()['errors'], 0)
+
+        # Only the failing write of a batch is dropped
+        writer.submit('insert into test (id, value) values (?, ?)', (2, 2.0))
+        writer.submit('insert into unknown (id) values (?)', (1,))
+        writer.submit('insert into test (id, value) values (?, ?)', (3, 3.0))
+        writer.flush()
+        self.assertEqual(self.rows(), [(1, 1.0), (2, 2.0), (3, 3.0)])
+        self.assertEqual(writer.stats()['errors'], 1)
+
+    def test_restart(self):
+        writer = Writer(batch_size=10, flush_interval=0.01)
+        # A thread which is stopped
+        writer.thread = threading.Thread(target=lambda: None)
+        writer.thread.start()
+        writer.thread.join()
+        writer.submit('insert into test (id, value) values (?, ?)', (1, 1.0))
+        self.assertTrue(writer.thread.is_alive())
+        writer.flush()
+        self.assertEqual(self.rows(), [(1, 1.0)])
+
+    def test_pending(self):
+        writer = Writer(batch_size=50, flush_interval=10, max_queue=1000)
+        writer.submit('insert into test (id, value) values (?, ?)', (1, 1.0), ('test', 1, (1, 1.0)))
+        writer.submit('insert or replace into test (id, value) values (?, ?)', (1, 2.0), ('test', 1, (1, 2.0)))
+        writer.submit('insert into test (id, value) values (?, ?)', (2, 3.0), ('test', 2, (2, 3.0)))
+        # Readers see the writes before they are committed
+        self.assertEqual(self.rows(), [])
+        self.assertEqual(writer.pending_rows('test'), {1: (1, 2.0), 2: (2, 3.0)})
+        self.assertEqual(writer.pending_rows('other'), {})
+        writer.flush()
+        self.assertEqual(self.rows(), [(1, 2.0), (2, 3.0)])
+        self.assertEqual(writer.pending_rows('test'), {})
+
+    def test_merge_rows(self):
+        rows = [(1, 'a'), (3, 'c')]
+        self.assertIs(merge_rows(rows, {}), rows)
+        pending = {2: (2, 'b'), 3: (3, 'C')}
+        self.assertEqual(merge_rows(rows, pending), [(1, 'a'), (2, 'b'), (3, 'C')])
+        self.assertEqual(merge_rows(rows[::-1], pending, reverse=True, limit=2), [(3, 'C'), (2, 'b')])
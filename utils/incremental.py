@@ -0,0 +1,455 @@
+'''
+Incremental (streaming) indicators
+
+Each indicator is advanced one candle at a time by update(candle) in O(1)
+(amortized O(1) for Ichimoku) and gives the same values as utils.mathlib.
+A candle with the same time as the previous one (a candle which is still open)
+replaces the previous step instead of adding a new one.
+
+The latest values are kept in RecentValues windows which are indexed
+by the absolute candle index, so the trade models in app.models.trade
+can be used as they are with index = indicator.count - 1.
+
+The state of an indicator can be saved with state() and restored with
+Indicator.from_state(state). States are JSON serializable.
+'''
+import abc
+import collections
+import datetime
+import math
+
+from utils import rolling
+
+
+class RecentValues(object):
+    '''
+    The latest values of a series, addressed by absolute index
+
+    Values older than the capacity are forgotten and read as None.
+    len() is the length of the whole series.
+    '''
+    def __init__(self, capacity=2):
+        self.capacity = capacity
+        self.count = 0
+        self.buffer = collections.deque(maxlen=capacity)
+
+    def append(self, value):
+        self.buffer.append(value)
+        self.count += 1
+
+    def pop(self):
+        self.count -= 1
+        return self.buffer.pop()
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        offset = self.count - 1 - index
+        if index < 0 or offset >= len(self.buffer):
+            return None
+        return self.buffer[-1-offset]
+
+    def last(self):
+        return self.buffer[-1] if self.buffer else None
+
+
+class Indicator(abc.ABC):
+    '''
+    Base class of the incremental indicators
+
+    Subclasses implement push(value) to advance by one value and
+    rollback() to undo the last push.
+    '''
+    def __init__(self):
+        self.time = None
+        self.count = 0
+
+    def source(self, candle):
+        return candle.close
+
+    def update(self, candle):
+        '''
+        Advances the indicator by the candle
+        '''
+        if self.time is not None and candle.time == self.time:
+            self.rollback()
+        self.push(self.source(candle))
+        self.time = candle.time
+
+    def warm(self, candles):
+        '''
+        Feeds the history of candles
+        '''
+        for candle in candles:
+            self.update(candle)
+        return self
+
+    @abc.abstractmethod
+    def push(self, value):
+        pass
+
+    @abc.abstractmethod
+    def rollback(self):
+        pass
+
+    def state(self):
+        return _encode(self)
+
+    @staticmethod
+    def from_state(state):
+        return _decode(state)
+
+
+# Values of a candle kept by Candles
+CandleRecord = collections.namedtuple('CandleRecord', ('time', 'open', 'close', 'high', 'low', 'volume'))
+
+
+class Candles(Indicator):
+    '''
+    The latest candles (as CandleRecord, so that the state is plain values)
+    '''
+    def __init__(self, capacity=2):
+        super().__init__()
+        self.values = RecentValues(capacity)
+
+    def source(self, candle):
+        return CandleRecord(candle.time, candle.open, candle.close, candle.high, candle.low, candle.volume)
+
+    def push(self, value):
+        self.count += 1
+        self.values.append(value)
+
+    def rollback(self):
+        self.count -= 1
+        self.values.pop()
+
+
+class Sma(Indicator):
+    '''
+    Simple moving average
+    '''
+    def __init__(self, period):
+        super().__init__()
+        self.period = period
+        self.window = collections.deque()
+        self.total = 0.0
+        self.values = RecentValues()
+        self.undo = None
+
+    def push(self, value):
+        self.undo = (self.total, None)
+        self.count += 1
+        self.window.append(value)
+        self.total += value
+        if len(self.window) > self.period:
+            old = self.window.popleft()
+            self.undo = (self.undo[0], old)
+            self.total -= old
+        # Recalculate the sum once in a period to cancel the rounding errors
+        if self.count % self.period == 0:
+            self.total = math.fsum(self.window)
+        self.values.append(self.total / self.period if len(self.window) == self.period else None)
+
+    def rollback(self):
+        total, old = self.undo
+        self.count -= 1
+        self.window.pop()
+        if old is not None:
+            self.window.appendleft(old)
+        self.total = total
+        self.values.pop()
+
+
+class Ema(Indicator):
+    '''
+    Exponential moving average
+    '''
+    def __init__(self, period):
+        super().__init__()
+        self.period = period
+        self.alpha = 2 / (period + 1)
+        self.total = 0.0
+        self.value = None
+        self.values = RecentValues()
+        self.undo = None
+
+    def push(self, value):
+        self.undo = (self.total, self.value)
+        self.count += 1
+        if self.count < self.period:
+            self.total += value
+        elif self.count == self.period:
+            self.total += value
+            self.value = self.total / self.period
+        else:
+            self.value = self.value + self.alpha * (value - self.value)
+        self.values.append(self.value)
+
+    def rollback(self):
+        self.total, self.value = self.undo
+        self.count -= 1
+        self.values.pop()
+
+
+class Bbands(Indicator):
+    '''
+    Bollinger Bands
+    '''
+    def __init__(self, n, k):
+        super().__init__()
+        self.n = n
+        self.k = k
+        self.sma = Sma(n)
+        # Sums of the values shifted by the first value to avoid cancellation
+        self.ref = None
+        self.sq_total = 0.0
+        self.up = RecentValues()
+        self.down = RecentValues()
+        self.undo = None
+
+    @property
+    def mid(self):
+        return self.sma.values
+
+    def push(self, value):
+        if self.ref is None:
+            self.ref = value
+        self.count += 1
+        self.undo = self.sq_total
+        self.sma.push(value - self.ref)
+        shifted = value - self.ref
+        self.sq_total += shifted * shifted
+        if self.sma.undo[1] is not None:
+            self.sq_total -= self.sma.undo[1] ** 2
+        if self.sma.count % self.n == 0:
+            self.sq_total = math.fsum(v * v for v in self.sma.window)
+
+        mid = self.mid.pop()
+        if mid is None:
+            self.mid.append(None)
+            self.up.append(None)
+            self.down.append(None)
+            return
+        self.mid.append(mid + self.ref)
+        if self.n <= 1:
+            self.up.append(None)
+            self.down.append(None)
+            return
+        total = self.sma.total
+        var = (self.n * self.sq_total - total * total) / self.n / (self.n-1)
+        sigma = math.sqrt(max(var, 0.0))
+        self.up.append(mid + self.ref + self.k * sigma)
+        self.down.append(mid + self.ref - self.k * sigma)
+
+    def rollback(self):
+        self.count -= 1
+        self.sq_total = self.undo
+        self.sma.rollback()
+        self.up.pop()
+        self.down.pop()
+
+
+class Rsi(Indicator):
+    '''
+    RSI
+    '''
+    def __init__(self, period):
+        super().__init__()
+        self.period = period
+        self.last_value = None
+        self.diffs = collections.deque()
+        self.up_sum = 0.0
+        self.down_sum = 0.0
+        self.values = RecentValues()
+        self.undo = None
+
+    def push(self, value):
+        self.undo = (self.last_value, self.up_sum, self.down_sum, None)
+        self.count += 1
+        last_value, self.last_value = self.last_value, value
+        if last_value is None:
+            self.values.append(None)
+            return
+
+        diff = value - last_value
+        up, down = (diff, 0.0) if diff > 0 else (0.0, -diff)
+        self.diffs.append((up, down))
+        self.up_sum += up
+        self.down_sum += down
+        if len(self.diffs) > self.period:
+            old = self.diffs.popleft()
+            self.undo = self.undo[:3] + (old,)
+            self.up_sum -= old[0]
+            self.down_sum -= old[1]
+        if self.count % self.period == 0:
+            self.up_sum = math.fsum(d[0] for d in self.diffs)
+            self.down_sum = math.fsum(d[1] for d in self.diffs)
+
+        if len(self.diffs) < self.period:
+            self.values.append(None)
+            return
+        up_sum = max(self.up_sum, 0.0)
+        down_sum = max(self.down_sum, 0.0)
+        self.values.append((up_sum / (up_sum + down_sum + 10**-10)) * 100)   # avoid zero division
+
+    def rollback(self):
+        last_value, self.up_sum, self.down_sum, old = self.undo
+        self.count -= 1
+        if last_value is not None:
+            self.diffs.pop()
+        if old is not None:
+            self.diffs.appendleft(old)
+        self.last_value = last_value
+        self.values.pop()
+
+
+class Macd(Indicator):
+    '''
+    MACD
+    '''
+    def __init__(self, short_period, long_period, signal_period):
+        super().__init__()
+        self.short_period = short_period
+        self.long_period = long_period
+        self.signal_period = signal_period
+        self.short_ema = Ema(short_period)
+        self.long_ema = Ema(long_period)
+        self.signal_ema = Ema(signal_period)
+        self.macd = RecentValues()
+        self.signal = RecentValues()
+        self.histogram = RecentValues()
+
+    def push(self, value):
+        self.count += 1
+        self.short_ema.push(value)
+        self.long_ema.push(value)
+        # The MACD line starts at index long_period
+        if self.count <= self.long_period:
+            self.macd.append(None)
+            self.signal.append(None)
+            self.histogram.append(None)
+            return
+        macd = self.short_ema.value - self.long_ema.value
+        self.signal_ema.push(macd)
+        signal = self.signal_ema.value
+        self.macd.append(macd)
+        self.signal.append(signal)
+        self.histogram.append(None if signal is None else macd - signal)
+
+    def rollback(self):
+        if self.count > self.long_period:
+            self.signal_ema.rollback()
+        self.count -= 1
+        self.short_ema.rollback()
+        self.long_ema.rollback()
+        self.macd.pop()
+        self.signal.pop()
+        self.histogram.pop()
+
+
+class Ichimoku(Indicator):
+    '''
+    Ichimoku clouds
+
+    The lines at index i use the highs and lows of the candles before i,
+    so the current candle is held back and added to the windows when the next one comes.
+    A rollback leaves the windows as they are (they do not contain the open candle).
+    delay[j] is the close of index j + delay_period, which is known delay_period candles later.
+    '''
+    def __init__(self, tenkan_period=9, base_period=26, pre1_shift=26, pre2_period=52, delay_period=26):
+        super().__init__()
+        self.tenkan_period = tenkan_period
+        self.base_period = base_period
+        self.pre1_shift = pre1_shift
+        self.pre2_period = pre2_period
+        self.delay_period = delay_period
+        self.start = max(tenkan_period, base_period, pre2_period)
+        self.highs = [rolling.RollingMax(p) for p in (tenkan_period, base_period, pre2_period)]
+        self.lows = [rolling.RollingMin(p) for p in (tenkan_period, base_period, pre2_period)]
+        self.pending = None
+        self.clouds = collections.deque([(None, None)] * pre1_shift, maxlen=pre1_shift + 1)
+        self.tenkan = RecentValues()
+        self.base = RecentValues()
+        self.pre1 = RecentValues()
+        self.pre2 = RecentValues()
+        self.delay = RecentValues()
+        self.undo = None
+
+    def source(self, candle):
+        return (candle.high, candle.low, candle.close)
+
+    def push(self, value):
+        if self.pending is not None:
+            high, low, _ = self.pending
+            for rolling_max, rolling_min in zip(self.highs, self.lows):
+                rolling_max.append(high)
+                rolling_min.append(low)
+        self.pending = value
+        index = self.count
+        self.count += 1
+
+        if index < self.start:
+            tenkan, base, pre2 = None, None, None
+            pre1 = None
+        else:
+            tenkan, base, pre2 = ((mx.value + mn.value) / 2 for mx, mn in zip(self.highs, self.lows))
+            pre1 = (tenkan + base) / 2
+        self.tenkan.append(tenkan)
+        self.base.append(base)
+        # The cloud dropped from the window
+        self.undo = self.clouds[0] if len(self.clouds) == self.clouds.maxlen else None
+        self.clouds.append((pre1, pre2))
+        pre1, pre2 = self.clouds[0]
+        self.pre1.append(pre1)
+        self.pre2.append(pre2)
+        if index >= self.delay_period:
+            self.delay.append(value[2])
+
+    def rollback(self):
+        # The held-back candle is in the windows already
+        self.pending = None
+        self.count -= 1
+        self.tenkan.pop()
+        self.base.pop()
+        self.clouds.pop()
+        if self.undo is not None:
+            self.clouds.appendleft(self.undo)
+        self.pre1.pop()
+        self.pre2.pop()
+        if self.count >= self.delay_period:
+            self.delay.pop()
+
+
+_CLASSES = {cls.__name__: cls for cls in (
+    RecentValues, Candles, Sma, Ema, Bbands, Rsi, Macd, Ichimoku, rolling.RollingMax, rolling.RollingMin)}
+
+
+def _encode(value):
+    if isinstance(value, datetime.datetime):
+        return {'datetime': value.isoformat()}
+    if isinstance(value, CandleRecord):
+        return {'candle': [_encode(v) for v in value]}
+    if isinstance(value, collections.deque):
+        return {'deque': [_encode(v) for v in value], 'maxlen': value.maxlen}
+    if isinstance(value, (list, tuple)):
+        return [_encode(v) for v in value]
+    if type(value).__name__ in _CLASSES:
+        return {'object': type(value).__name__, 'fields': {k: _encode(v) for k, v in value.__dict__.items()}}
+    return value
+
+
+def _decode(value):
+    if isinstance(value, list):
+        return tuple(_decode(v) for v in value)
+    if not isinstance(value, dict):
+        return value
+    if 'datetime' in value:
+        return datetime.datetime.fromisoformat(value['datetime'])
+    if 'candle' in value:
+        return CandleRecord(*(_decode(v) for v in value['candle']))
+    if 'deque' in value:
+        return collections.deque((_decode(v) for v in value['deque']), maxlen=value['maxlen'])
+    obj = _CLASSES[value['object']].__new__(_CLASSES[value['object']])
+    obj.__dict__.update({k: _decode(v) for k, v in value['fields'].items()})
+    return obj
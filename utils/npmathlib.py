@@ -0,0 +1,325 @@
+'''
+NumPy backend of mathlib
+
+Every function accepts a sequence of numbers (list, array('d'), numpy.ndarray)
+and returns float64 numpy arrays of the same length as the input.
+Values which are not defined yet are NaN instead of None.
+'''
+import math
+
+import numpy as np
+
+from utils import rolling
+
+
+def as_array(values):
+    '''
+    Returns values as a float64 numpy array (no copy if it already is one)
+    '''
+    return np.asarray(values, dtype=np.float64)
+
+
+def _nans(length):
+    return np.full(length, np.nan)
+
+
+def _prefix_sums(values):
+    '''
+    acc[i] = sum(values[:i]) (length: len(values) + 1)
+    '''
+    acc = np.empty(len(values) + 1)
+    acc[0] = 0.0
+    np.cumsum(values, out=acc[1:])
+    return acc
+
+
+def _rolling_sum(period, values):
+    '''
+    Sums of every window values[j: j+period] (length: len(values) - period + 1)
+    '''
+    acc = _prefix_sums(values)
+    return acc[period:] - acc[:-period]
+
+
+def _ema_filter(alpha, start, values):
+    '''
+    Runs y[i] = y[i-1] + alpha * (values[i] - y[i-1]) from y[-1] = start
+
+    The recurrence is solved in closed form block by block,
+    y[j] = w^j * (start + alpha * sum(values[l] * w^-l)), w = 1 - alpha,
+    so that each block is a single cumulative sum.
+    The block size keeps w^-j far away from overflow.
+    '''
+    length = len(values)
+    result = np.empty(length)
+    w = 1.0 - alpha
+    if w <= 0.0:
+        result[:] = values
+        return result
+
+    block = max(1, min(length, int(230 / -math.log(w))))
+    powers = w ** np.arange(1, block + 1)
+    prev = start
+    for begin in range(0, length, block):
+        end = min(begin + block, length)
+        p = powers[:end - begin]
+        out = result[begin:end]
+        np.cumsum(values[begin:end] / p, out=out)
+        out *= alpha
+        out += prev
+        out *= p
+        prev = out[-1]
+    return result
+
+
+def sma_matrix(periods, values):
+    '''
+    Simple moving averages of every period
+
+    Returns an array of shape (len(periods), len(values)).
+    The cumulative sums are shared by all periods.
+    '''
+    values = as_array(values)
+    length = len(values)
+    result = np.full((len(periods), length), np.nan)
+    if length == 0:
+        return result
+    # Shift by the first value to keep the cumulative sums small
+    ref = values[0]
+    acc = _prefix_sums(values - ref)
+    for row, period in enumerate(periods):
+        if 0 < period <= length:
+            result[row, period-1:] = (acc[period:] - acc[:-period]) / period + ref
+    return result
+
+
+def sma(period, values):
+    '''
+    Simple moving average
+    '''
+    return sma_matrix([period], values)[0]
+
+
+def ema_matrix(periods, values):
+    '''
+    Exponential moving averages of every period
+
+    Returns an array of shape (len(periods), len(values)).
+    The first value of each row is the simple average of the first period values.
+    '''
+    values = as_array(values)
+    length = len(values)
+    result = np.full((len(periods), length), np.nan)
+    if length == 0:
+        return result
+    ref = values[0]
+    shifted = values - ref
+    acc = _prefix_sums(shifted)
+    for row, period in enumerate(periods):
+        if 0 < period <= length:
+            seed = acc[period] / period
+            result[row, period-1] = seed
+            result[row, period:] = _ema_filter(2 / (period + 1), seed, shifted[period:])
+            result[row, period-1:] += ref
+    return result
+
+
+def ema(period, values):
+    '''
+    Exponential moving average
+    '''
+    return ema_matrix([period], values)[0]
+
+
+def bbands_matrix(ns, ks, values):
+    '''
+    Bollinger Bands of every n and k
+
+    Returns (up, mid, down).
+    The shape of mid is (len(ns), len(values)),
+    and the shapes of up and down are (len(ns), len(ks), len(values)).
+    '''
+    values = as_array(values)
+    length = len(values)
+    ks = np.asarray(ks, dtype=np.float64)
+    mid = sma_matrix(ns, values)
+    up = np.full((len(ns), len(ks), length), np.nan)
+    down = np.full((len(ns), len(ks), length), np.nan)
+    if length == 0:
+        return up, mid, down
+
+    shifted = values - values[0]
+    acc = _prefix_sums(shifted)
+    acc_sq = _prefix_sums(shifted * shifted)
+    for row, n in enumerate(ns):
+        if n <= 1 or n > length:
+            continue
+        total = acc[n:] - acc[:-n]
+        sq_total = acc_sq[n:] - acc_sq[:-n]
+        var = (n * sq_total - total * total) / n / (n-1)
+        sigma = np.sqrt(np.maximum(var, 0.0))
+
+        up[row, :, n-1:] = mid[row, n-1:] + ks[:, np.newaxis] * sigma
+        down[row, :, n-1:] = mid[row, n-1:] - ks[:, np.newaxis] * sigma
+    return up, mid, down
+
+
+def bbands(n, k, values):
+    '''
+    Bollinger Bands
+
+    Returns (up, mid, down)
+    '''
+    up, mid, down = bbands_matrix([n], [k], values)
+    return up[0, 0], mid[0], down[0, 0]
+
+
+def rolling_max(period, values):
+    '''
+    max(values[i-period: i]) for i >= period, NaN otherwise
+    '''
+    values = as_array(values)
+    result = _nans(len(values))
+    if period <= 0 or period >= len(values):
+        return result
+    result[period:] = rolling.window_max(period, values[:-1])
+    return result
+
+
+def rolling_min(period, values):
+    '''
+    min(values[i-period: i]) for i >= period, NaN otherwise
+    '''
+    values = as_array(values)
+    result = _nans(len(values))
+    if period <= 0 or period >= len(values):
+        return result
+    result[period:] = rolling.window_min(period, values[:-1])
+    return result
+
+
+def donchian(period, highs, lows):
+    '''
+    Donchian channel of the previous period candles
+
+    Returns (up, mid, down)
+    '''
+    up = rolling_max(period, highs)
+    down = rolling_min(period, lows)
+    return up, (up + down) / 2, down
+
+
+def ichimoku(highs, lows, closes, tenkan_period=9, base_period=26, pre1_shift=26, pre2_period=52, delay_period=26):
+    '''
+    Ichimoku clouds
+
+    Returns (tenkan, base, pre1, pre2, delay).
+    pre1 and pre2 are shifted forward by pre1_shift,
+    and delay is closes shifted backward by delay_period.
+    '''
+    highs = as_array(highs)
+    lows = as_array(lows)
+    closes = as_array(closes)
+    start = max(tenkan_period, base_period, pre2_period)
+
+    def middle(period):
+        _, line, _ = donchian(period, highs, lows)
+        line[:start] = np.nan
+        return line
+
+    tenkan = middle(tenkan_period)
+    base = middle(base_period)
+    pre1 = (tenkan + base) / 2
+    pre2 = middle(pre2_period)
+
+    pre1 = np.concatenate((_nans(pre1_shift), pre1))
+    pre2 = np.concatenate((_nans(pre1_shift), pre2))
+
+    delay = closes[delay_period:].copy()
+
+    return tenkan, base, pre1, pre2, delay
+
+
+def rsi_matrix(periods, values):
+    '''
+    RSI of every period
+
+    Returns an array of shape (len(periods), len(values)).
+    '''
+    values = as_array(values)
+    length = len(values)
+    result = np.full((len(periods), length), np.nan)
+    if length == 0:
+        return result
+
+    diff = np.diff(values)
+    up_acc = _prefix_sums(np.where(diff > 0, diff, 0.0))
+    down_acc = _prefix_sums(np.where(diff > 0, 0.0, -diff))
+    for row, period in enumerate(periods):
+        if period <= 0:
+            result[row] = 0.0
+            continue
+        if period >= length:
+            continue
+        up_sum = np.maximum(up_acc[period:] - up_acc[:-period], 0.0)
+        down_sum = np.maximum(down_acc[period:] - down_acc[:-period], 0.0)
+        result[row, period:] = (up_sum / (up_sum + down_sum + 10**-10)) * 100   # avoid zero division
+    return result
+
+
+def rsi(period, values):
+    '''
+    RSI
+    '''
+    return rsi_matrix([period], values)[0]
+
+
+def macd(short_period, long_period, signal_period, values):
+    '''
+    MACD
+
+    Returns (macd, signal, histogram)
+    '''
+    values = as_array(values)
+    length = len(values)
+    macd = _nans(length)
+    signal = _nans(length)
+    histogram = _nans(length)
+    if length <= long_period:
+        return macd, signal, histogram
+
+    short_ema, long_ema = ema_matrix([short_period, long_period], values)
+    macd[long_period:] = short_ema[long_period:] - long_ema[long_period:]
+    signal[long_period:] = ema(signal_period, macd[long_period:])
+
+    start = max(long_period, signal_period)
+    histogram[start:] = macd[start:] - signal[start:]
+    return macd, signal, histogram
+
+
+def historical_volatility(period, values):
+    '''
+    Historical volatility
+    '''
+    values = as_array(values)
+    length = len(values)
+    result = _nans(length)
+    if period <= 0 or period >= length:
+        return result
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        buffer = np.log(values[1:] - values[:-1] / values[1:])
+    finite = np.isfinite(buffer)
+    head = buffer[:period][finite[:period]]
+    # Shifted by a finite reference to avoid cancellation
+    if len(head):
+        buffer = buffer - head.mean()
+    if not finite.all():
+        # Only the windows of a non-finite log return are NaN
+        buffer = np.where(finite, buffer, 0.0)
+    mean = _rolling_sum(period, buffer) / period
+    sq_mean = _rolling_sum(period, buffer * buffer) / period
+    result[period:] = np.sqrt(np.maximum(sq_mean - mean * mean, 0.0)) * 100
+    if not finite.all():
+        result[period:][_rolling_sum(period, (~finite).astype(np.float64)) > 0] = np.nan
+    return result
@@ -0,0 +1,120 @@
+'''
+Sliding window maximum / minimum
+
+RollingMax / RollingMin keep a monotonic deque and are updated one value at a time
+(amortized O(1) per value).
+window_max / window_min compute every window of an array at once
+with the van Herk/Gil-Werman algorithm (O(n) regardless of the period).
+'''
+import abc
+import collections
+
+import numpy as np
+
+
+class RollingExtreme(abc.ABC):
+    '''
+    Extreme value of the last `period` values
+
+    The deque holds (index, value) pairs whose values are monotonic,
+    so the extreme value is always at its left end.
+    Subclasses define dominates(a, b): whether an older value a stays before a newer value b.
+    '''
+    def __init__(self, period):
+        if period <= 0:
+            raise ValueError('period must be positive: {}'.format(period))
+        self.period = period
+        self.count = 0
+        self.deque = collections.deque()
+
+    @abc.abstractmethod
+    def dominates(self, a, b):
+        pass
+
+    def append(self, value):
+        while self.deque and not self.dominates(self.deque[-1][1], value):
+            self.deque.pop()
+        self.deque.append((self.count, value))
+        self.count += 1
+        if self.deque[0][0] <= self.count - 1 - self.period:
+            self.deque.popleft()
+
+    def is_full(self):
+        return self.count >= self.period
+
+    @property
+    def value(self):
+        '''
+        Extreme value of the last period values (None before any value)
+        '''
+        if not self.deque:
+            return None
+        return self.deque[0][1]
+
+    def state(self):
+        return {
+            'period': self.period,
+            'count': self.count,
+            'deque': [list(e) for e in self.deque]
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        rolling = cls(state['period'])
+        rolling.count = state['count']
+        rolling.deque.extend(tuple(e) for e in state['deque'])
+        return rolling
+
+
+class RollingMax(RollingExtreme):
+    def dominates(self, a, b):
+        return a > b
+
+
+class RollingMin(RollingExtreme):
+    def dominates(self, a, b):
+        return a < b
+
+
+def _windows(period, values, ufunc, identity):
+    '''
+    ufunc reduction of every window values[j: j+period] (length: len(values) - period + 1)
+    '''
+    length = len(values)
+    blocks = -(-length // period)
+    padded = np.full(blocks * period, identity)
+    padded[:length] = values
+    padded = padded.reshape(blocks, period)
+
+    # prefix[j]: reduction from the start of j's block to j
+    # suffix[j]: reduction from j to the end of j's block
+    prefix = ufunc.accumulate(padded, axis=1).ravel()
+    suffix = ufunc.accumulate(padded[:, ::-1], axis=1)[:, ::-1].ravel()
+
+    # values[j: j+period] is the suffix of one block and the prefix of the next
+    return ufunc(suffix[:length-period+1], prefix[period-1:length])
+
+
+def window_max(period, values):
+    '''
+    max(values[j: j+period]) for every j
+
+    >>> window_max(3, np.array([1., 3., 2., 5., 4.])).tolist()
+    [3.0, 5.0, 5.0]
+    '''
+    return _windows(period, np.asarray(values, dtype=np.float64), np.maximum, -np.inf)
+
+
+def window_min(period, values):
+    '''
+    min(values[j: j+period]) for every j
+
+    >>> window_min(3, np.array([1., 3., 2., 5., 4.])).tolist()
+    [1.0, 2.0, 2.0]
+    '''
+    return _windows(period, np.asarray(values, dtype=np.float64), np.minimum, np.inf)
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()